@@ -1,6 +1,7 @@
 from django.contrib import admin
 from .models import Item  # Import your models here
 from .models import User  # Import the User model only
+from .models import SyncState
 
 # Customize the admin site title and header
 admin.site.site_header = "My Droid Administration"
@@ -9,6 +10,7 @@ admin.site.index_title = "Welcome to My Droid Admin"
 
 # Register the User model
 admin.site.register(User)
+admin.site.register(SyncState)
 
 # Create an admin class for your Item model
 class ItemAdmin(admin.ModelAdmin):
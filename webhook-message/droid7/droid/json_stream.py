@@ -0,0 +1,90 @@
+import json
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = ' \t\n\r'
+_DELIMITERS = ',:]}'
+
+
+class _Reader:
+    # Text buffer over an iterable of str pieces; consumed text is dropped as parsing moves on
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = ''
+        self.pos = 0
+        self.exhausted = False
+
+    def fill(self):
+        # Appends the next piece; False once the input is used up
+        for chunk in self.chunks:
+            if chunk:
+                if self.pos > 65536:
+                    self.buffer, self.pos = self.buffer[self.pos:], 0
+                self.buffer += chunk
+                return True
+        self.exhausted = True
+        return False
+
+    def peek(self):
+        # Next non-whitespace character, or '' at the end of the input
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, allowed):
+        char = self.peek()
+        if not char or char not in allowed:
+            raise ValueError(f"Expected one of {allowed!r} at offset {self.pos}, got {char or 'end of input'!r}")
+        self.pos += 1
+        return char
+
+    def value(self):
+        # Decodes the JSON value at the current position, reading more input until it is complete.
+        # A decoded value only counts once a delimiter follows it (or the input ends): a number cut off
+        # between pieces, such as '1.' of '1.5', still decodes as a shorter number.
+        self.peek()
+        while True:
+            try:
+                obj, end = _decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self.exhausted:
+                    raise
+            else:
+                following = end
+                while following < len(self.buffer) and self.buffer[following] in _WHITESPACE:
+                    following += 1
+                if self.exhausted or (following < len(self.buffer) and self.buffer[following] in _DELIMITERS):
+                    self.pos = end
+                    return obj
+            self.fill()
+
+
+def iter_array_items(chunks, key):
+    """Yields the items of the array stored under ``key`` in a top-level JSON object.
+
+    ``chunks`` is an iterable of str pieces (such as a streamed HTTP response); items are decoded
+    one at a time, so only the current item and the unparsed tail are held in memory. Other keys
+    are decoded and discarded. Yields nothing when the key is absent or null.
+    """
+    reader = _Reader(chunks)
+    reader.expect('{')
+    if reader.peek() == '}':
+        return
+    while True:
+        name = reader.value()
+        reader.expect(':')
+        if name == key and reader.peek() == '[':
+            reader.expect('[')
+            if reader.peek() == ']':
+                return
+            while True:
+                yield reader.value()
+                if reader.expect(',]') == ']':
+                    return
+        reader.value()
+        if reader.expect(',}') == '}':
+            return
@@ -0,0 +1,80 @@
+import gc
+import logging
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from droid.upsert import content_hash, validate_users_per_record, validate_user_batch
+
+PLATFORMS = ['Twitch', 'YouTube', 'Trovo']
+
+
+def synthetic_users(count, invalid_share, seed=0):
+    # /users records shaped like Mix It Up's, linked on one to three platforms, some of them invalid
+    rng = random.Random(seed)
+    records = []
+    for i in range(count):
+        platforms = {}
+        for name in rng.sample(PLATFORMS, rng.randint(1, len(PLATFORMS))):
+            platforms[name] = {
+                'Platform': name, 'ID': str(100000 + i), 'Username': f'viewer{i}', 'DisplayName': f'Viewer{i}',
+                'AvatarLink': f'https://example.com/avatars/{i}.png', 'SubscriberBadgeLink': None, 'RoleBadgeLink': None,
+                'SpecialtyBadgeLink': None, 'Roles': ['User', 'Follower'][:rng.randint(1, 2)],
+                'AccountDate': '2019-03-14T09:26:53.5897932+00:00', 'FollowDate': '2023-06-01T18:00:00-04:00',
+                'SubscribeDate': None, 'SubscriberTier': rng.randint(0, 3),
+            }
+        record = {
+            'ID': f'00000000-0000-4000-8000-{i:012d}', 'Notes': None, 'CustomTitle': None,
+            'LastUpdated': '2024-10-06T11:51:00.1234567+00:00', 'LastActivity': '2024-10-05T20:15:42-04:00',
+            'CurrencyAmounts': {'1783e5d9-c2ab-423a-ae64-7dc9a086b194': rng.randint(0, 5000)},
+            'InventoryAmounts': {}, 'StreamPassAmounts': {}, 'IsSpecialtyExcluded': False,
+            'OnlineViewingMinutes': rng.randint(0, 100000), 'PlatformData': platforms,
+        }
+        if rng.random() < invalid_share:
+            record['OnlineViewingMinutes'] = 'a lot'
+        records.append(record)
+    return records
+
+
+class Command(BaseCommand):
+    help = 'Compare the per-record UserSchema loop with batch validation of Mix It Up user records'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20000, help='Synthetic records per round (default 20000)')
+        parser.add_argument('--rounds', type=int, default=3, help='Timed rounds per path; the best is reported (default 3)')
+        parser.add_argument('--invalid', type=float, default=0.001,
+                            help='Share of records that fail validation (default 0.001)')
+
+    def handle(self, *args, **options):
+        records = synthetic_users(options['users'], options['invalid'])
+        # platform_data differs in form only (a PlatformData model in the loop, the received entry in the
+        # batch), so users are compared without it. Only hashes are kept between rounds: live results would
+        # make the garbage collector slower for whichever path runs later.
+        paths = {
+            'per-record': (lambda: validate_users_per_record(records), lambda user: {**user.model_dump(), 'platform_data': None}),
+            'batch': (lambda: validate_user_batch(records)[0], lambda user: {**user, 'platform_data': None}),
+        }
+
+        # The per-record loop logs every invalid record; keep those lines out of the timings
+        logging.disable(logging.ERROR)
+        try:
+            results = {}
+            for name, (path, comparable) in paths.items():
+                best, users = None, None
+                for _ in range(max(1, options['rounds'])):
+                    users = None
+                    gc.collect()
+                    started = time.perf_counter()
+                    users = path()
+                    elapsed = time.perf_counter() - started
+                    best = elapsed if best is None else min(best, elapsed)
+                results[name] = (best, [content_hash(comparable(user)) for user in users])
+        finally:
+            logging.disable(logging.NOTSET)
+
+        baseline = results['per-record'][0]
+        for name, (seconds, hashes) in results.items():
+            self.stdout.write(f"{name:>10}: {seconds * 1000:8.1f} ms  {seconds / len(records) * 1e6:6.2f} us/user  "
+                              f"{len(hashes)} valid  x{baseline / seconds:.2f}")
+        if results['per-record'][1] != results['batch'][1]:
+            self.stdout.write(self.style.ERROR('The two paths produced different users.'))
@@ -1,13 +1,36 @@
 from django.core.management.base import BaseCommand
-from droid.upsert import fetch_and_upsert_users  # Adjust the import if needed
+from droid.upsert import fetch_and_upsert_users, refresh_users, sync_active_users, UPSERT_CHUNK_SIZE  # Adjust the import if needed
 
 class Command(BaseCommand):
     help = 'Fetch users from the external API and upsert them into the database'
 
-    def handle(self, *args, **kwargs):
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=['bulk', 'incremental', 'row'], default='bulk',
+                            help='bulk: chunked INSERT ... ON DUPLICATE KEY UPDATE (default); incremental: as bulk, '
+                                 'but only new and changed users are written, and users not updated upstream since the last '
+                                 'sync are not even compared; row: one update_or_create per user')
+        parser.add_argument('--chunk-size', type=int, default=UPSERT_CHUNK_SIZE,
+                            help=f'Rows per bulk upsert statement and transaction (default {UPSERT_CHUNK_SIZE}, env UPSERT_CHUNK_SIZE)')
+        parser.add_argument('--flag-missing', action='store_true',
+                            help='Set missing_upstream on stored users the API no longer returns')
+        parser.add_argument('--stream', action='store_true',
+                            help='Parse the response as it downloads and write each chunk as soon as it is validated')
+        parser.add_argument('--active', action='store_true',
+                            help='Only sync the users /users/active lists')
+        parser.add_argument('--user', action='append', dest='user_ids', metavar='USER_ID',
+                            help='Only re-read and sync this Mix It Up user ID (repeatable); lookups run concurrently')
+
+    def handle(self, *args, **options):
         try:
             self.stdout.write(self.style.NOTICE('Starting to fetch and upsert users...'))
-            fetch_and_upsert_users()
+            if options['user_ids']:
+                stats = refresh_users(options['user_ids'])
+            elif options['active']:
+                stats = sync_active_users()
+            else:
+                stats = fetch_and_upsert_users(mode=options['mode'], chunk_size=options['chunk_size'],
+                                               flag_missing=options['flag_missing'], stream=options['stream'])
+            self.stdout.write(', '.join(f'{key}={value}' for key, value in stats.items()))
             self.stdout.write(self.style.SUCCESS('Successfully fetched and upserted users!'))
         except Exception as e:
             self.stdout.write(self.style.ERROR(f'Error: {e}'))
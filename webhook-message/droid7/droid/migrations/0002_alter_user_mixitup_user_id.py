@@ -0,0 +1,33 @@
+# Generated by Django 5.1.2 on 2026-10-18 09:12
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def remove_duplicate_users(apps, schema_editor):
+    # Keep the newest row for each mixitup_user_id so the unique index can be created
+    User = apps.get_model('droid', 'User')
+    duplicates = (
+        User.objects.exclude(mixitup_user_id=None)
+        .values('mixitup_user_id')
+        .annotate(rows=Count('id'), newest=Max('id'))
+        .filter(rows__gt=1)
+    )
+    for duplicate in duplicates:
+        User.objects.filter(mixitup_user_id=duplicate['mixitup_user_id']).exclude(id=duplicate['newest']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('droid', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_users, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='user',
+            name='mixitup_user_id',
+            field=models.CharField(max_length=100, null=True, unique=True),
+        ),
+    ]
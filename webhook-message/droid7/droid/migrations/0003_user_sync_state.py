@@ -0,0 +1,33 @@
+# Generated by Django 5.1.2 on 2026-10-18 10:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('droid', '0002_alter_user_mixitup_user_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('synced_at', models.DateTimeField(null=True)),
+                ('source_updated_at', models.DateTimeField(null=True)),
+                ('stats', models.JSONField(null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='content_hash',
+            field=models.CharField(max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='missing_upstream',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,218 @@
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class TokenBucket:
+    """Allows ``rate`` acquisitions per second on average, with bursts of up to ``burst``.
+
+    Shared by every thread of a client, so it caps the request rate however many lookups run
+    at once. A rate of 0 disables limiting.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1.0, self.rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        # Blocks until a token is free; returns the seconds spent waiting
+        if self.rate <= 0:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class FetchStats:
+    # Request counts and latencies of one client; latencies keep the most recent max_samples requests
+
+    def __init__(self, max_samples=10000):
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=max_samples)
+        self.started = None
+        self.requests = 0
+        self.statuses = {}
+        self.connection_errors = 0
+        self.retries = 0
+        self.failures = 0
+        self.throttled_s = 0.0
+
+    def record(self, seconds, status=None):
+        with self._lock:
+            if self.started is None:
+                self.started = time.perf_counter() - seconds
+            self.requests += 1
+            self._latencies.append(seconds)
+            if status is None:
+                self.connection_errors += 1
+            else:
+                self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def add(self, name, amount=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def snapshot(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            elapsed = time.perf_counter() - self.started if self.started is not None else 0.0
+
+            def percentile(share):
+                return round(latencies[min(len(latencies) - 1, int(share * len(latencies)))] * 1000, 2) if latencies else None
+
+            return {
+                'requests': self.requests,
+                'statuses': dict(self.statuses),
+                'connection_errors': self.connection_errors,
+                'retries': self.retries,
+                'failures': self.failures,
+                'throttled_s': round(self.throttled_s, 3),
+                'requests_per_s': round(self.requests / elapsed, 2) if elapsed > 0 else 0.0,
+                'latency_ms': {
+                    'p50': percentile(0.5),
+                    'p95': percentile(0.95),
+                    'p99': percentile(0.99),
+                    'max': round(latencies[-1] * 1000, 2) if latencies else None,
+                },
+            }
+
+
+class MixItUpClient:
+    """Mix It Up Developer API client for per-user and per-currency lookups.
+
+    One keep-alive requests.Session with a connection pool the size of the worker pool; fan-out
+    lookups run on up to ``max_workers`` threads. Every attempt takes a token from the rate
+    limiter. Connection errors, timeouts, 429 and 5xx responses are retried up to ``retries``
+    times with jittered exponential backoff (or the server's Retry-After). A 404 reads as None.
+    """
+
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(self, base_url, max_workers=8, rate=20.0, burst=None, retries=3, backoff=0.5,
+                 max_backoff=30.0, timeout=10.0):
+        self.base_url = base_url.rstrip('/')
+        self.max_workers = max(1, int(max_workers))
+        self.retries = max(0, int(retries))
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.limiter = TokenBucket(rate, burst)
+        self.stats = FetchStats()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def close(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+        self.session.close()
+
+    def _delay(self, attempt, retry_after=None):
+        if retry_after is not None:
+            try:
+                return min(self.max_backoff, max(0.0, float(retry_after)))
+            except ValueError:
+                pass
+        return min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+    def get(self, path, params=None):
+        # Decoded JSON of GET base_url + path, or None when the API answers 404
+        url = f"{self.base_url}/{path.lstrip('/')}"
+        for attempt in range(self.retries + 1):
+            self.stats.add('throttled_s', self.limiter.acquire())
+            started = time.perf_counter()
+            retry_after = None
+            try:
+                response = self.session.get(url, params=params, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.stats.record(time.perf_counter() - started)
+                error = e
+            else:
+                self.stats.record(time.perf_counter() - started, response.status_code)
+                if response.status_code == 404:
+                    return None
+                if response.status_code not in self.RETRY_STATUSES:
+                    response.raise_for_status()
+                    return response.json()
+                error = requests.HTTPError(f"{response.status_code} Error for url: {url}", response=response)
+                retry_after = response.headers.get('Retry-After')
+            if attempt == self.retries:
+                break
+            self.stats.add('retries')
+            time.sleep(self._delay(attempt, retry_after))
+        self.stats.add('failures')
+        raise error
+
+    def get_user(self, user_id):
+        return self.get(f'users/{user_id}')
+
+    def get_active_users(self, page_size=100):
+        # Every active user, one page of page_size at a time
+        users = []
+        while True:
+            page = self.get('users/active', params={'skip': len(users), 'pageSize': page_size}) or []
+            if isinstance(page, dict):
+                page = page.get('Users', [])
+            users.extend(page)
+            if len(page) < page_size:
+                return users
+
+    def get_currency_amount(self, currency_id, user_id):
+        return self.get(f'currency/{currency_id}/{user_id}')
+
+    def map(self, func, keys):
+        # {key: func(key)} computed on the worker pool; keys whose lookup failed are left out and logged
+        keys = list(dict.fromkeys(keys))
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='mixitup-fetch')
+            futures = {key: self._executor.submit(func, key) for key in keys}
+        results, failed = {}, []
+        for key, future in futures.items():
+            try:
+                results[key] = future.result()
+            except Exception as e:
+                failed.append(key)
+                logging.warning(f"Mix It Up lookup for {key} failed: {e}")
+        if failed:
+            logging.error(f"{len(failed)} of {len(keys)} Mix It Up lookups failed.")
+        return results
+
+    def fetch_users(self, user_ids):
+        # {user_id: user record, or None when Mix It Up does not know the user}
+        return self.map(self.get_user, user_ids)
+
+    def fetch_currency_amounts(self, currency_id, user_ids):
+        # {user_id: amount of currency_id, or None when the user or currency is unknown}
+        return self.map(lambda user_id: self.get_currency_amount(currency_id, user_id), user_ids)
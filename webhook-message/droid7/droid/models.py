@@ -12,7 +12,7 @@ class Item(models.Model):
         return self.name
 
 class User(models.Model):
-    mixitup_user_id = models.CharField(max_length=100, null=True)
+    mixitup_user_id = models.CharField(max_length=100, null=True, unique=True)  # Upsert key for the Mix It Up sync
     notes = models.TextField(null=True)
     custom_title = models.CharField(max_length=100, null=True)
     last_updated = models.DateTimeField(null=True)
@@ -36,10 +36,23 @@ class User(models.Model):
     subscribe_date = models.DateTimeField(null=True)  # Optional
     subscriber_tier = models.IntegerField(null=True)  # Optional
 
+    # Sync bookkeeping
+    content_hash = models.CharField(max_length=64, null=True)  # SHA-256 of the synced fields, to skip unchanged users
+    missing_upstream = models.BooleanField(default=False)  # No longer listed by Mix It Up
+
     # Meta options can be added if needed
     class Meta:
         verbose_name = "User"
         verbose_name_plural = "Users"
 
     def __str__(self):
-        return f"{self.display_name} ({self.mixitup_user_id})"
\ No newline at end of file
+        return f"{self.display_name} ({self.mixitup_user_id})"
+
+class SyncState(models.Model):
+    name = models.CharField(max_length=100, unique=True)
+    synced_at = models.DateTimeField(null=True)  # When the last sync finished
+    source_updated_at = models.DateTimeField(null=True)  # Newest upstream LastUpdated seen so far
+    stats = JSONField(null=True)  # Counts from the last sync
+
+    def __str__(self):
+        return f"{self.name} (synced {self.synced_at})"
@@ -1,3 +1,365 @@
-from django.test import TestCase
+import json
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import requests
+from unittest import mock
+
+from django.test import TestCase, SimpleTestCase
+
+from .json_stream import iter_array_items
+from .mixitup_client import MixItUpClient, TokenBucket
+from .models import SyncState, User
+from .upsert import (SYNC_NAME, bulk_upsert_users, fetch_and_upsert_users, map_user, record_sync, validate_user_batch,
+                     validate_users)
 
 # Create your tests here.
+
+USER_IDS = [f'00000000-0000-0000-0000-{i:012d}' for i in range(40)]
+CURRENCY_ID = '1783e5d9-c2ab-423a-ae64-7dc9a086b194'
+
+
+class StubMixItUp(BaseHTTPRequestHandler):
+    # Serves /users/{userId}, /users/active and /currency/{currencyId}/{userId} from USER_IDS.
+    # The server object carries the knobs and counters the tests use.
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        parts = url.path.strip('/').split('/')
+        with server.lock:
+            server.connections.add(self.client_address)
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            server.hits[url.path] = server.hits.get(url.path, 0) + 1
+            failing = server.hits[url.path] <= server.failures.get(url.path, 0)
+        try:
+            time.sleep(server.delay)
+            if failing:
+                self.send_json(503, {'Message': 'Try again'}, {'Retry-After': '0'})
+            elif parts == ['users', 'active']:
+                query = parse_qs(url.query)
+                skip, page_size = int(query['skip'][0]), int(query['pageSize'][0])
+                self.send_json(200, [{'ID': user_id} for user_id in server.active[skip:skip + page_size]])
+            elif len(parts) == 2 and parts[0] == 'users' and parts[1] in USER_IDS:
+                self.send_json(200, {'ID': parts[1], 'OnlineViewingMinutes': USER_IDS.index(parts[1])})
+            elif len(parts) == 3 and parts[0] == 'currency' and parts[1] == CURRENCY_ID and parts[2] in USER_IDS:
+                self.send_json(200, USER_IDS.index(parts[2]) * 10)
+            else:
+                self.send_json(404, {'Message': 'Not found'})
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+
+class MixItUpClientTests(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubMixItUp)
+        cls.server.daemon_threads = True
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f'http://127.0.0.1:{cls.server.server_port}'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        server = self.server
+        server.lock = threading.Lock()
+        server.connections = set()
+        server.in_flight = 0
+        server.max_in_flight = 0
+        server.hits = {}
+        server.failures = {}
+        server.delay = 0.0
+        server.active = USER_IDS[:25]
+
+    def make_client(self, **kwargs):
+        kwargs.setdefault('rate', 0)
+        kwargs.setdefault('backoff', 0.01)
+        client = MixItUpClient(self.base_url, **kwargs)
+        self.addCleanup(client.close)
+        return client
+
+    def test_get_user_and_not_found(self):
+        client = self.make_client()
+        self.assertEqual(client.get_user(USER_IDS[3]), {'ID': USER_IDS[3], 'OnlineViewingMinutes': 3})
+        self.assertIsNone(client.get_user('unknown'))
+        self.assertEqual(client.stats.snapshot()['statuses'], {200: 1, 404: 1})
+
+    def test_active_users_are_paged(self):
+        client = self.make_client()
+        users = client.get_active_users(page_size=10)
+        self.assertEqual([user['ID'] for user in users], USER_IDS[:25])
+        self.assertEqual(client.stats.requests, 3)
+
+    def test_fan_out_is_bounded_and_reuses_connections(self):
+        self.server.delay = 0.02
+        client = self.make_client(max_workers=4)
+        amounts = client.fetch_currency_amounts(CURRENCY_ID, USER_IDS + ['unknown'])
+        self.assertEqual(amounts, {**{user_id: i * 10 for i, user_id in enumerate(USER_IDS)}, 'unknown': None})
+        self.assertLessEqual(self.server.max_in_flight, 4)
+        self.assertGreater(self.server.max_in_flight, 1)
+        self.assertLessEqual(len(self.server.connections), 4)
+
+    def test_retries_transient_errors(self):
+        path = f'/users/{USER_IDS[0]}'
+        self.server.failures[path] = 2
+        client = self.make_client(retries=3)
+        self.assertEqual(client.get_user(USER_IDS[0])['ID'], USER_IDS[0])
+        stats = client.stats.snapshot()
+        self.assertEqual(stats['retries'], 2)
+        self.assertEqual(stats['statuses'], {503: 2, 200: 1})
+
+    def test_gives_up_after_retries(self):
+        path = f'/users/{USER_IDS[0]}'
+        self.server.failures[path] = 10
+        client = self.make_client(retries=2)
+        with self.assertRaises(requests.HTTPError):
+            client.get_user(USER_IDS[0])
+        self.assertEqual(self.server.hits[path], 3)
+        self.assertEqual(client.stats.failures, 1)
+
+    def test_failed_lookups_are_left_out_of_fan_out(self):
+        self.server.failures[f'/users/{USER_IDS[1]}'] = 10
+        client = self.make_client(retries=1)
+        with self.assertLogs(level='ERROR'):
+            users = client.fetch_users(USER_IDS[:3])
+        self.assertEqual(sorted(users), [USER_IDS[0], USER_IDS[2]])
+
+    def test_rate_limit(self):
+        client = self.make_client(max_workers=8, rate=50, burst=1)
+        started = time.perf_counter()
+        client.fetch_users(USER_IDS[:20])
+        self.assertGreaterEqual(time.perf_counter() - started, 19 / 50 * 0.9)
+        self.assertGreater(client.stats.snapshot()['throttled_s'], 0)
+
+    def test_stats(self):
+        client = self.make_client()
+        client.fetch_users(USER_IDS[:10])
+        stats = client.stats.snapshot()
+        self.assertEqual(stats['requests'], 10)
+        self.assertGreater(stats['requests_per_s'], 0)
+        self.assertLessEqual(stats['latency_ms']['p50'], stats['latency_ms']['max'])
+
+
+class TokenBucketTests(SimpleTestCase):
+
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(rate=100, burst=5)
+        self.assertEqual([bucket.acquire() for _ in range(5)], [0.0] * 5)
+        self.assertGreater(bucket.acquire(), 0)
+
+    def test_disabled(self):
+        bucket = TokenBucket(rate=0)
+        self.assertEqual(sum(bucket.acquire() for _ in range(1000)), 0.0)
+
+
+STREAM_USERS = [
+    {'ID': 'a', 'Notes': 'brackets ]}, and a "quote"', 'OnlineViewingMinutes': 12, 'Ratio': 1.5, 'Flags': [True, None]},
+    2.25,
+    -7,
+    1.25e-3,
+    'text },]',
+    [1, [2.5, {}]],
+    {},
+]
+STREAM_PAYLOAD = json.dumps({'Total': 2.5, 'Skipped': {'Users': [0.5]}, 'Users': STREAM_USERS, 'After': [1, {'k': 0.75}]})
+
+
+class JsonStreamTests(SimpleTestCase):
+
+    def test_every_split_point(self):
+        for cut in range(1, len(STREAM_PAYLOAD)):
+            with self.subTest(cut=cut):
+                pieces = [STREAM_PAYLOAD[:cut], STREAM_PAYLOAD[cut:]]
+                self.assertEqual(list(iter_array_items(pieces, 'Users')), STREAM_USERS)
+
+    def test_single_characters(self):
+        self.assertEqual(list(iter_array_items(list(STREAM_PAYLOAD), 'Users')), STREAM_USERS)
+
+    def test_numbers_cut_between_pieces(self):
+        self.assertEqual(list(iter_array_items(['{"Users": [1.', '5]}'], 'Users')), [1.5])
+        self.assertEqual(list(iter_array_items(['{"Total": 2.', '5, "Users": [1e', '3, 4]}'], 'Users')), [1000.0, 4])
+        self.assertEqual(list(iter_array_items(['{"Users": [1', '2 ', ' ]}'], 'Users')), [12])
+
+    def test_missing_null_and_empty(self):
+        self.assertEqual(list(iter_array_items(['{}'], 'Users')), [])
+        self.assertEqual(list(iter_array_items(['{"Users": null}'], 'Users')), [])
+        self.assertEqual(list(iter_array_items(['{"Users": [', ']}'], 'Users')), [])
+        self.assertEqual(list(iter_array_items(['{"Other": 1', '2}'], 'Users')), [])
+
+    def test_truncated_input(self):
+        with self.assertRaises(ValueError):
+            list(iter_array_items(['{"Users": [{"ID": "a"}'], 'Users'))
+
+
+def user_record(user_id, minutes=0, updated='2024-10-06T11:51:00+00:00'):
+    return {
+        'ID': user_id, 'LastUpdated': updated, 'OnlineViewingMinutes': minutes,
+        'PlatformData': {'Twitch': {'Platform': 'Twitch', 'ID': user_id, 'Username': f'viewer-{user_id}'}},
+    }
+
+
+def platform_entry(platform, user_id, username):
+    return {'Platform': platform, 'ID': user_id, 'Username': username, 'DisplayName': username.title(),
+            'AccountDate': '2020-01-01T00:00:00+00:00', 'SubscriberTier': 1}
+
+
+class UserMappingTests(SimpleTestCase):
+
+    def map_one(self, platforms):
+        users, report = validate_user_batch([{'ID': 'u', 'PlatformData': platforms}])
+        self.assertEqual(report, [])
+        return users[0]
+
+    def test_youtube_only(self):
+        user = self.map_one({'YouTube': platform_entry('YouTube', 'yt-1', 'tuber')})
+        self.assertEqual((user['platform'], user['username'], user['display_name']), ('YouTube', 'tuber', 'Tuber'))
+        self.assertEqual(user['platform_data'], platform_entry('YouTube', 'yt-1', 'tuber'))
+
+    def test_trovo_only(self):
+        user = self.map_one({'Trovo': platform_entry('Trovo', 'tr-1', 'trover')})
+        self.assertEqual((user['platform'], user['username']), ('Trovo', 'trover'))
+        self.assertEqual(user['platform_data']['ID'], 'tr-1')
+
+    def test_multi_platform_prefers_the_configured_order(self):
+        # Twitch comes first in MIXITUP_PLATFORMS whatever order the record lists its platforms in
+        user = self.map_one({
+            'Trovo': platform_entry('Trovo', 'tr-1', 'trover'),
+            'Twitch': platform_entry('Twitch', 'tw-1', 'twitcher'),
+            'YouTube': platform_entry('YouTube', 'yt-1', 'tuber'),
+        })
+        self.assertEqual((user['platform'], user['username']), ('Twitch', 'twitcher'))
+        self.assertEqual(user['platform_data'], platform_entry('Twitch', 'tw-1', 'twitcher'))
+        # The stored entry stays as received (JSON), while the flattened date is parsed
+        self.assertIsInstance(user['platform_data']['AccountDate'], str)
+        self.assertEqual(user['account_date'], datetime(2020, 1, 1, tzinfo=dt_timezone.utc))
+
+    def test_unknown_platform_and_empty_entries(self):
+        user = self.map_one({'Twitch': {}, 'Kick': platform_entry('Kick', 'k-1', 'kicker')})
+        self.assertEqual((user['platform'], user['username']), ('Kick', 'kicker'))
+        self.assertEqual(map_user({'ID': 'u'})['platform'], None)
+
+    def test_invalid_records_are_reported_together(self):
+        records = [
+            user_record('a'),
+            user_record('b', minutes='a lot'),
+            user_record('c'),
+            {'ID': 'd', 'PlatformData': {'YouTube': {'SubscriberTier': 'gold'}}},
+            'not a record',
+            user_record('f'),
+        ]
+        users, report = validate_user_batch(records)
+        self.assertEqual([user['mixitup_user_id'] for user in users], ['a', 'c', 'f'])
+        self.assertEqual([(row['index'], row['mixitup_user_id']) for row in report], [(1, 'b'), (3, 'd'), (4, None)])
+        self.assertTrue(report[0]['errors'][0].startswith('OnlineViewingMinutes: Input should be a valid integer'))
+        self.assertTrue(report[1]['errors'][0].startswith('PlatformData.YouTube.SubscriberTier: '))
+        self.assertEqual(report[2]['errors'], ['record: Input should be a valid dictionary'])
+
+    def test_invalid_records_are_logged_once(self):
+        with self.assertLogs(level='ERROR') as logs:
+            users = validate_users([user_record('a'), user_record('b', minutes='x'), user_record('c', minutes='y')])
+        self.assertEqual(len(users), 1)
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn('2 of 3 users failed validation', logs.output[0])
+
+
+class BulkUpsertTests(TestCase):
+
+    def test_inserts_then_updates(self):
+        stats = bulk_upsert_users(validate_users([user_record(f'u{i}') for i in range(5)]), chunk_size=2)
+        self.assertEqual((stats['inserted'], stats['updated'], stats['written'], stats['chunks']), (5, 0, 5, 3))
+
+        stats = bulk_upsert_users(validate_users([user_record('u0', minutes=30), user_record('u1')]))
+        self.assertEqual((stats['inserted'], stats['updated'], stats['unchanged'], stats['written']), (0, 1, 1, 2))
+        self.assertEqual(User.objects.count(), 5)
+        user = User.objects.get(mixitup_user_id='u0')
+        self.assertEqual((user.online_viewing_minutes, user.username, user.platform), (30, 'viewer-u0', 'Twitch'))
+
+    def test_incremental_skips_unchanged(self):
+        bulk_upsert_users(validate_users([user_record('u0'), user_record('u1')]))
+        stats = bulk_upsert_users(validate_users([user_record('u0'), user_record('u1', minutes=5)]), incremental=True)
+        self.assertEqual((stats['unchanged'], stats['updated'], stats['written']), (1, 1, 1))
+
+    def test_incremental_watermark_skips_users_not_updated_since(self):
+        bulk_upsert_users(validate_users([user_record('u0'), user_record('u1')]))
+        watermark = datetime(2024, 10, 6, 11, 51, tzinfo=dt_timezone.utc)
+        users = validate_users([
+            user_record('u0', minutes=5),  # Not updated upstream since the watermark, so not even compared
+            user_record('u1', minutes=5, updated='2024-10-07T00:00:00+00:00'),
+            user_record('u2', updated='2024-01-01T00:00:00+00:00'),  # Old, but not stored yet
+        ])
+        stats = bulk_upsert_users(users, incremental=True, watermark=watermark)
+        self.assertEqual((stats['unchanged'], stats['updated'], stats['inserted'], stats['written']), (1, 1, 1, 2))
+        self.assertEqual(User.objects.get(mixitup_user_id='u0').online_viewing_minutes, 0)
+
+    def test_skips_missing_ids_and_keeps_last_duplicate(self):
+        users = validate_users([user_record('u0'), user_record('u0', minutes=9), {'OnlineViewingMinutes': 1}])
+        stats = bulk_upsert_users(users)
+        self.assertEqual((stats['skipped'], stats['duplicates'], stats['written']), (1, 1, 1))
+        self.assertEqual(User.objects.get(mixitup_user_id='u0').online_viewing_minutes, 9)
+
+
+class SyncTests(TestCase):
+
+    def sync(self, records, **kwargs):
+        with mock.patch('droid.upsert.fetch_all_users', return_value=validate_users(records)):
+            return fetch_and_upsert_users(**kwargs)
+
+    def test_flags_users_missing_upstream(self):
+        self.sync([user_record('a'), user_record('b')])
+        stats = self.sync([user_record('a')], flag_missing=True)
+        self.assertEqual(stats['missing'], 1)
+        self.assertEqual(set(User.objects.filter(missing_upstream=True).values_list('mixitup_user_id', flat=True)), {'b'})
+
+    def test_reappearing_user_is_unflagged(self):
+        self.sync([user_record('a'), user_record('b')])
+        self.sync([user_record('a')], flag_missing=True)
+        stats = self.sync([user_record('b')], mode='incremental')
+        self.assertEqual((stats['updated'], stats['unchanged'], stats['written']), (1, 0, 1))
+        self.assertFalse(User.objects.get(mixitup_user_id='b').missing_upstream)
+
+    def test_watermark_only_moves_forward(self):
+        self.sync([user_record('a', updated='2024-10-07T00:00:00+00:00')])
+        newest = datetime(2024, 10, 7, tzinfo=dt_timezone.utc)
+        self.assertEqual(SyncState.objects.get(name=SYNC_NAME).source_updated_at, newest)
+
+        self.sync([user_record('a', updated='2024-10-01T00:00:00+00:00')])
+        self.assertEqual(SyncState.objects.get(name=SYNC_NAME).source_updated_at, newest)
+        state = record_sync(None, {})
+        self.assertEqual(state.source_updated_at, newest)
+
+        later = datetime(2024, 10, 8, tzinfo=dt_timezone.utc)
+        self.assertEqual(record_sync(later, {}).source_updated_at, later)
+
+    def test_empty_fetch_leaves_sync_state(self):
+        self.sync([user_record('a')])
+        before = SyncState.objects.get(name=SYNC_NAME)
+        stats = self.sync([], flag_missing=True)
+        self.assertNotIn('missing', stats)
+        after = SyncState.objects.get(name=SYNC_NAME)
+        self.assertEqual((after.synced_at, after.source_updated_at), (before.synced_at, before.source_updated_at))
+        self.assertFalse(User.objects.get(mixitup_user_id='a').missing_upstream)
@@ -1,10 +1,17 @@
 import os
+import json
+import time
+import queue
+import threading
+import hashlib
 import django
 import logging
 from django.utils import timezone  # Import timezone from Django
 import requests
-from pydantic import BaseModel, Field, ValidationError
-from typing import Optional, Dict, List
+from datetime import datetime
+from pydantic import AfterValidator, BaseModel, Field, TypeAdapter, ValidationError
+from typing import Any, Optional, Dict, List, Iterator, Tuple, Union
+from typing_extensions import Annotated, TypedDict
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -14,10 +21,66 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'droid7.settings')
 django.setup()  # Initialize Django
 
 # Now import your User model and other necessary modules
-from .models import User  # Import your User model from the models.py file
+from django.db import connection, transaction
+from .models import User, SyncState  # Import your User model from the models.py file
+from .json_stream import iter_array_items
+from .mixitup_client import MixItUpClient
+
+# Rows per bulk INSERT ... ON DUPLICATE KEY UPDATE statement (and per transaction)
+UPSERT_CHUNK_SIZE = int(os.environ.get('UPSERT_CHUNK_SIZE', 1000))
+# SyncState row holding the watermark of the Mix It Up user sync
+SYNC_NAME = 'mixitup_users'
+# Validated chunks a streaming sync buffers between the download and the database writer
+STREAM_QUEUE_CHUNKS = int(os.environ.get('STREAM_QUEUE_CHUNKS', 2))
+# Per-user lookups: concurrent requests, requests per second and retries per request
+MIXITUP_MAX_WORKERS = int(os.environ.get('MIXITUP_MAX_WORKERS', 8))
+MIXITUP_RATE_LIMIT = float(os.environ.get('MIXITUP_RATE_LIMIT', 20))
+MIXITUP_RETRIES = int(os.environ.get('MIXITUP_RETRIES', 3))
+# Platform whose PlatformData entry fills the flattened user fields, for users linked on several
+MIXITUP_PLATFORMS = [name.strip() for name in os.environ.get('MIXITUP_PLATFORMS', 'Twitch,YouTube,Trovo').split(',') if name.strip()]
 
 # Define your User schema using Pydantic
+# Every field defaults to None: a user's PlatformData entry only carries what that platform provides
 class PlatformData(BaseModel):
+    Platform: Optional[str] = None
+    ID: Optional[str] = None
+    Username: Optional[str] = None
+    DisplayName: Optional[str] = None
+    AvatarLink: Optional[str] = None
+    SubscriberBadgeLink: Optional[str] = None
+    RoleBadgeLink: Optional[str] = None
+    SpecialtyBadgeLink: Optional[str] = None
+    Roles: Optional[List[str]] = None
+    AccountDate: Optional[str] = None
+    FollowDate: Optional[str] = None
+    SubscribeDate: Optional[str] = None
+    SubscriberTier: Optional[int] = None
+
+class UserSchema(BaseModel):
+    mixitup_user_id: Optional[str] = None
+    notes: Optional[str] = None
+    custom_title: Optional[str] = None
+    last_updated: Optional[datetime] = None
+    last_activity: Optional[datetime] = None
+    currency_amounts: Optional[Dict[str, float]] = None
+    inventory_amounts: Optional[Dict[str, float]] = None
+    stream_pass_amounts: Optional[Dict[str, float]] = None
+    is_specialty_excluded: Optional[bool] = None
+    online_viewing_minutes: Optional[int] = None
+    platform_data: Optional[PlatformData] = None
+    platform: Optional[str] = None
+    username: Optional[str] = None
+    display_name: Optional[str] = None
+    avatar_link: Optional[str] = None
+    account_date: Optional[datetime] = None
+    follow_date: Optional[datetime] = None
+    subscribe_date: Optional[datetime] = None
+    subscriber_tier: Optional[int] = None
+
+# The /users record as Mix It Up sends it (MixItUpUser and MixItUpPlatformUser in mixitup-api.yaml).
+# Validating into plain dicts skips building a model per user and per platform, which is where the
+# per-record UserSchema loop spends most of its time.
+class MixItUpPlatformUser(TypedDict, total=False):
     Platform: Optional[str]
     ID: Optional[str]
     Username: Optional[str]
@@ -27,73 +90,138 @@ class PlatformData(BaseModel):
     RoleBadgeLink: Optional[str]
     SpecialtyBadgeLink: Optional[str]
     Roles: Optional[List[str]]
-    AccountDate: Optional[str]
-    FollowDate: Optional[str]
-    SubscribeDate: Optional[str]
+    AccountDate: Optional[datetime]
+    FollowDate: Optional[datetime]
+    SubscribeDate: Optional[datetime]
     SubscriberTier: Optional[int]
 
-class UserSchema(BaseModel):
-    mixitup_user_id: Optional[str]
-    notes: Optional[str]
-    custom_title: Optional[str]
-    last_updated: Optional[str]
-    last_activity: Optional[str]
-    currency_amounts: Optional[Dict[str, float]]
-    inventory_amounts: Optional[Dict[str, float]]
-    stream_pass_amounts: Optional[Dict[str, float]]
-    is_specialty_excluded: Optional[bool]
-    online_viewing_minutes: Optional[int]
-    platform_data: Optional[PlatformData]
-    platform: Optional[str]
-    username: Optional[str]
-    display_name: Optional[str]
-    avatar_link: Optional[str]
-    account_date: Optional[str]
-    follow_date: Optional[str]
-    subscribe_date: Optional[str]
-    subscriber_tier: Optional[int]
+class MixItUpUser(TypedDict, total=False):
+    ID: Optional[str]
+    Notes: Optional[str]
+    CustomTitle: Optional[str]
+    LastUpdated: Optional[datetime]
+    LastActivity: Optional[datetime]
+    CurrencyAmounts: Optional[Dict[str, float]]
+    InventoryAmounts: Optional[Dict[str, float]]
+    StreamPassAmounts: Optional[Dict[str, float]]
+    IsSpecialtyExcluded: Optional[bool]
+    OnlineViewingMinutes: Optional[int]
+    PlatformData: Optional[Dict[str, MixItUpPlatformUser]]
+
+class _Rejected:
+    # Takes the place of a record MixItUpUser rejected, so one bad record does not fail the whole batch
+    __slots__ = ('record',)
+
+    def __init__(self, record):
+        self.record = record
+
+MIXITUP_USER = TypeAdapter(MixItUpUser)
+# Validates a list of records, every platform entry and date string included, in one call
+MIXITUP_USERS = TypeAdapter(List[Annotated[
+    Union[MixItUpUser, Annotated[Any, AfterValidator(_Rejected)]], Field(union_mode='left_to_right')
+]])
+# Records per MIXITUP_USERS call. A call allocates every output object before Python runs again; past a few
+# hundred objects the garbage collector rescans the growing batch, which made one call over 20k users no
+# faster than the per-record loop. 64 records stay within about one young-generation collection.
+VALIDATION_BATCH_SIZE = int(os.environ.get('VALIDATION_BATCH_SIZE', 64))
 
 # Base URL for the Mixitup API
 MIXITUP_BASE_URL = 'https://duckling-mighty-rhino.ngrok-free.app'
-ENDPOINT_URL = f'{MIXITUP_BASE_URL}/mixitup/api/v2/users'
+API_URL = f'{MIXITUP_BASE_URL}/mixitup/api/v2'
+ENDPOINT_URL = f'{API_URL}/users'
+
+def primary_platform(platforms: dict) -> Tuple[Optional[str], dict]:
+    # (platform name, PlatformData entry) that fills the flattened fields: the first of MIXITUP_PLATFORMS
+    # the user is linked on, else whichever platform is listed first
+    for name in MIXITUP_PLATFORMS:
+        if platforms.get(name):
+            return name, platforms[name]
+    for name, platform_data in platforms.items():
+        if platform_data:
+            return name, platform_data
+    return None, {}
+
+def map_user(user: dict, raw: Optional[dict] = None) -> dict:
+    # UserSchema fields for one record of the /users payload. For a validated record, raw is the record
+    # as received: platform_data keeps that entry so it stays JSON (validation turned its dates into datetimes).
+    platform, platform_data = primary_platform(user.get('PlatformData') or {})
+    return {
+        'mixitup_user_id': user.get('ID'),
+        'notes': user.get('Notes'),
+        'custom_title': user.get('CustomTitle'),
+        'last_updated': user.get('LastUpdated'),
+        'last_activity': user.get('LastActivity'),
+        'currency_amounts': user.get('CurrencyAmounts', {}),
+        'inventory_amounts': user.get('InventoryAmounts', {}),
+        'stream_pass_amounts': user.get('StreamPassAmounts', {}),
+        'is_specialty_excluded': user.get('IsSpecialtyExcluded'),
+        'online_viewing_minutes': user.get('OnlineViewingMinutes'),
+        'platform_data': (raw['PlatformData'][platform] if raw is not None and platform_data else platform_data) or None,
+        'platform': platform_data.get('Platform') or platform,
+        'username': platform_data.get('Username'),
+        'display_name': platform_data.get('DisplayName'),
+        'avatar_link': platform_data.get('AvatarLink'),
+        'account_date': platform_data.get('AccountDate'),
+        'follow_date': platform_data.get('FollowDate'),
+        'subscribe_date': platform_data.get('SubscribeDate'),
+        'subscriber_tier': platform_data.get('SubscriberTier')
+    }
+
+def validate_users_per_record(records: List[dict]) -> List[UserSchema]:
+    # The original loop, one UserSchema and one log line per invalid user; kept for benchmark_user_mapping
+    users = []
+    for user in records:
+        user_dict = map_user(user)
+        try:
+            user_schema = UserSchema(**user_dict)
+            users.append(user_schema)
+        except ValidationError as ve:
+            logging.error(f"Validation error for user {user_dict}: {ve}")
+    return users
+
+def validate_user_batch(records: List[Any]) -> Tuple[List[dict], List[dict]]:
+    """Validates a list of /users records with MIXITUP_USERS, VALIDATION_BATCH_SIZE at a time, and maps the valid ones.
+
+    Returns the users as dicts of UserSchema fields, in order, and a report with one entry (index,
+    ID and every error) per invalid record. Only invalid records are validated a second time, to
+    collect their errors.
+    """
+    users, report = [], []
+    batch_size = max(1, VALIDATION_BATCH_SIZE)
+    validated = (
+        user
+        for offset in range(0, len(records), batch_size)
+        for user in MIXITUP_USERS.validate_python(records[offset:offset + batch_size])
+    )
+    for index, (raw, user) in enumerate(zip(records, validated)):
+        if not isinstance(user, _Rejected):
+            users.append(map_user(user, raw))
+            continue
+        try:
+            MIXITUP_USER.validate_python(raw)
+            errors = ['record: rejected']
+        except ValidationError as e:
+            errors = [f"{'.'.join(map(str, error['loc'])) or 'record'}: {error['msg']}" for error in e.errors(include_url=False)]
+        report.append({'index': index, 'mixitup_user_id': raw.get('ID') if isinstance(raw, dict) else None, 'errors': errors})
+    return users, report
+
+def validate_users(records: List[Any]) -> List[dict]:
+    # Valid users among the records; the invalid ones are logged together in one report
+    users, report = validate_user_batch(records)
+    if report:
+        lines = [f"  #{row['index']} {row['mixitup_user_id']}: {'; '.join(row['errors'])}" for row in report[:20]]
+        if len(report) > 20:
+            lines.append(f"  ... and {len(report) - 20} more")
+        logging.error(f"{len(report)} of {len(records)} users failed validation:\n" + '\n'.join(lines))
+    return users
 
 # Function to fetch users from external API
-def fetch_all_users() -> List[UserSchema]:
+def fetch_all_users() -> List[dict]:
     try:
         response = requests.get(ENDPOINT_URL)
         response.raise_for_status()
         
-        user_data = response.json().get('Users', [])
-        users = []
-        
-        for user in user_data:
-            platform_data = user.get('PlatformData', {}).get('Twitch', {})
-            user_dict = {
-                'mixitup_user_id': user.get('ID'),
-                'notes': user.get('Notes'),
-                'custom_title': user.get('CustomTitle'),
-                'last_updated': user.get('LastUpdated'),
-                'last_activity': user.get('LastActivity'),
-                'currency_amounts': user.get('CurrencyAmounts', {}),
-                'inventory_amounts': user.get('InventoryAmounts', {}),
-                'stream_pass_amounts': user.get('StreamPassAmounts', {}),
-                'is_specialty_excluded': user.get('IsSpecialtyExcluded'),
-                'online_viewing_minutes': user.get('OnlineViewingMinutes'),
-                'platform_data': platform_data,
-                'platform': platform_data.get('Platform'),
-                'username': platform_data.get('Username'),
-                'display_name': platform_data.get('DisplayName'),
-                'avatar_link': platform_data.get('AvatarLink'),
-                'account_date': platform_data.get('AccountDate'),
-                'follow_date': platform_data.get('FollowDate'),
-                'subscribe_date': platform_data.get('SubscribeDate'),
-                'subscriber_tier': platform_data.get('SubscriberTier')
-            }
-            try:
-                user_schema = UserSchema(**user_dict)
-                users.append(user_schema)
-            except ValidationError as ve:
-                logging.error(f"Validation error for user {user_dict}: {ve}")
+        users = validate_users(response.json().get('Users', []))
 
         logging.info(f"Fetched {len(users)} users.")
         return users
@@ -101,31 +229,58 @@ def fetch_all_users() -> List[UserSchema]:
         logging.error(f"Error fetching users: {e}")
         return []
 
-def upsert_user(user_data: UserSchema):
-    mixitup_user_id = user_data.mixitup_user_id  # Accessing Pydantic field, no need to use get()
+def stream_user_chunks(chunk_size: int = UPSERT_CHUNK_SIZE) -> Iterator[List[dict]]:
+    # Reads the Users array off the response stream and yields validated users chunk_size at a time
+    chunk_size = max(1, int(chunk_size))
+    with requests.get(ENDPOINT_URL, stream=True) as response:
+        response.raise_for_status()
+        response.encoding = response.encoding or 'utf-8'
+        records = []
+        for record in iter_array_items(response.iter_content(chunk_size=65536, decode_unicode=True), 'Users'):
+            records.append(record)
+            if len(records) >= chunk_size:
+                yield validate_users(records)
+                records = []
+        if records:
+            yield validate_users(records)
+
+def content_hash(user: dict) -> str:
+    # SHA-256 of the mapped fields; the upstream LastUpdated is left out since it is not stored
+    content = {name: value for name, value in user.items() if name != 'last_updated'}
+    return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+def user_fields(user: dict) -> dict:
+    # Model field values for a user (a dict of UserSchema fields), as written by both the per-row and the bulk path
+    return {
+        'platform_data': user['platform_data'],
+        'online_viewing_minutes': user['online_viewing_minutes'],
+        'username': user['username'],
+        'display_name': user['display_name'],
+        'notes': user['notes'],
+        'avatar_link': user['avatar_link'],
+        'account_date': user['account_date'],
+        'follow_date': user['follow_date'],
+        'subscribe_date': user['subscribe_date'],
+        'subscriber_tier': user['subscriber_tier'],
+        'platform': user['platform'],
+        'last_updated': timezone.now(),
+        'last_activity': user['last_activity'],
+        'custom_title': user['custom_title'],
+        'currency_amounts': user['currency_amounts'],
+        'inventory_amounts': user['inventory_amounts'],
+        'stream_pass_amounts': user['stream_pass_amounts'],
+        'is_specialty_excluded': user['is_specialty_excluded'] or False,
+        'content_hash': content_hash(user),
+        'missing_upstream': False,
+    }
+
+def upsert_user(user_data: dict):
+    mixitup_user_id = user_data['mixitup_user_id']
 
     # Check if the user already exists, update or create a new user
     user, created = User.objects.update_or_create(
         mixitup_user_id=mixitup_user_id,
-        defaults={
-            'platform_data': user_data.platform_data.dict() if user_data.platform_data else None,  # Ensure platform_data is converted to dict
-            'online_viewing_minutes': user_data.online_viewing_minutes,
-            'username': user_data.username,
-            'display_name': user_data.display_name,
-            'notes': user_data.notes,
-            'avatar_link': user_data.avatar_link,
-            'account_date': user_data.account_date,
-            'follow_date': user_data.follow_date,
-            'subscribe_date': user_data.subscribe_date,
-            'subscriber_tier': user_data.subscriber_tier,
-            'last_updated': timezone.now(),
-            'last_activity': user_data.last_activity,
-            'custom_title': user_data.custom_title,
-            'currency_amounts': user_data.currency_amounts,
-            'inventory_amounts': user_data.inventory_amounts,
-            'stream_pass_amounts': user_data.stream_pass_amounts,
-            'is_specialty_excluded': user_data.is_specialty_excluded or False,
-        }
+        defaults=user_fields(user_data)
     )
 
     action = 'Created' if created else 'Updated'
@@ -133,11 +288,271 @@ def upsert_user(user_data: UserSchema):
 
     return user, created
 
-def fetch_and_upsert_users():
-    users = fetch_all_users()
-    logging.info(f"Upserting {len(users)} users into the database.")
+def _aware(value):
+    return timezone.make_aware(value) if timezone.is_naive(value) else value
+
+def _upsert_chunk(users: Dict[str, dict], stats: dict, incremental: bool = False, watermark=None):
+    # One transaction: read the chunk's stored hashes, then write the rows with a single upsert statement.
+    # A full sync writes every row; an incremental one only new and changed rows. With a watermark, an
+    # incremental sync takes a stored, still-listed user whose upstream LastUpdated is at or before it
+    # as unchanged without hashing it.
+    with transaction.atomic():
+        existing = {
+            mixitup_user_id: (stored_hash, missing)
+            for mixitup_user_id, stored_hash, missing in User.objects.filter(mixitup_user_id__in=list(users))
+            .values_list('mixitup_user_id', 'content_hash', 'missing_upstream')
+        }
+        changed = []
+        fields = None
+        for mixitup_user_id, user in users.items():
+            current = existing.get(mixitup_user_id)
+            if (incremental and watermark is not None and current is not None and not current[1]
+                    and user['last_updated'] is not None and _aware(user['last_updated']) <= watermark):
+                stats['unchanged'] += 1
+                continue
+            values = user_fields(user)
+            fields = fields or list(values)
+            if current is None:
+                stats['inserted'] += 1
+            elif current == (values['content_hash'], False):
+                stats['unchanged'] += 1
+                if incremental:
+                    continue
+            else:
+                stats['updated'] += 1
+            changed.append(User(mixitup_user_id=mixitup_user_id, **values))
+        if not changed:
+            return
+
+        # MySQL upserts on any unique key and rejects an explicit conflict target; other backends need one
+        conflict_target = {}
+        if connection.features.supports_update_conflicts_with_target:
+            conflict_target['unique_fields'] = ['mixitup_user_id']
+        User.objects.bulk_create(
+            changed,
+            update_conflicts=True,
+            update_fields=fields,
+            **conflict_target,
+        )
+        stats['written'] += len(changed)
+
+def flag_missing_users(seen_ids, chunk_size: int = UPSERT_CHUNK_SIZE) -> int:
+    # Mark users the upstream no longer lists; a later sync that sees them again clears the flag
+    missing = set(User.objects.exclude(mixitup_user_id=None).filter(missing_upstream=False)
+                  .values_list('mixitup_user_id', flat=True)) - set(seen_ids)
+    missing = list(missing)
+    chunk_size = max(1, int(chunk_size))
+    for offset in range(0, len(missing), chunk_size):
+        User.objects.filter(mixitup_user_id__in=missing[offset:offset + chunk_size]).update(missing_upstream=True)
+    if missing:
+        logging.info(f"Flagged {len(missing)} users missing upstream.")
+    return len(missing)
+
+def _rows(users: List[dict], stats: dict) -> Dict[str, dict]:
+    # Users by mixitup_user_id; users without an ID are skipped, a repeated ID keeps its last occurrence
+    rows = {}
     for user in users:
-        upsert_user(user)  # Implement the upsert logic for the User model
+        mixitup_user_id = user['mixitup_user_id']
+        if not mixitup_user_id:
+            stats['skipped'] += 1
+            continue
+        if mixitup_user_id in rows:
+            stats['duplicates'] += 1
+        rows[mixitup_user_id] = user
+    return rows
+
+def bulk_upsert_users(users: List[dict], chunk_size: int = UPSERT_CHUNK_SIZE, incremental: bool = False,
+                      watermark=None) -> dict:
+    """Upsert users with one INSERT ... ON DUPLICATE KEY UPDATE per chunk of ``chunk_size`` rows.
+
+    Each chunk is its own transaction. Rows are counted as inserted, updated or unchanged by
+    comparing their content hash with the stored one. A full sync still writes unchanged rows
+    (stamping last_updated, as the per-row path does); an ``incremental`` sync skips them, so a
+    repeat sync of unchanged data writes no user rows. Given the ``watermark`` of the last sync, an
+    incremental sync also skips hashing stored users Mix It Up has not updated since. Users without
+    a mixitup_user_id are skipped, and a user listed twice is written once with its last occurrence.
+    """
+    started = time.perf_counter()
+    stats = {'users': len(users), 'inserted': 0, 'updated': 0, 'unchanged': 0, 'written': 0,
+             'skipped': 0, 'duplicates': 0, 'chunks': 0}
+
+    rows = _rows(users, stats)
+    ids = list(rows)
+    chunk_size = max(1, int(chunk_size))
+    for offset in range(0, len(ids), chunk_size):
+        chunk = {mixitup_user_id: rows[mixitup_user_id] for mixitup_user_id in ids[offset:offset + chunk_size]}
+        _upsert_chunk(chunk, stats, incremental=incremental, watermark=watermark)
+        stats['chunks'] += 1
+
+    stats['seconds'] = round(time.perf_counter() - started, 3)
+    stats['rows_per_s'] = round(len(rows) / stats['seconds'], 1) if stats['seconds'] > 0 else 0.0
+    logging.info(
+        f"{'Incrementally' if incremental else 'Bulk'} upserted {len(rows)} users in {stats['chunks']} chunks: "
+        f"{stats['inserted']} inserted, {stats['updated']} updated, {stats['unchanged']} unchanged, "
+        f"{stats['written']} written, {stats['skipped']} skipped ({stats['rows_per_s']} rows/s)."
+    )
+    return stats
+
+def row_upsert_users(users: List[dict]) -> dict:
+    # The original path: one update_or_create (a SELECT plus an INSERT or UPDATE) per user
+    started = time.perf_counter()
+    stats = {'users': len(users), 'inserted': 0, 'updated': 0}
+    for user in users:
+        _, created = upsert_user(user)  # Implement the upsert logic for the User model
+        stats['inserted' if created else 'updated'] += 1
+
+    stats['seconds'] = round(time.perf_counter() - started, 3)
+    stats['rows_per_s'] = round(len(users) / stats['seconds'], 1) if stats['seconds'] > 0 else 0.0
+    logging.info(f"Upserted {len(users)} users row by row: {stats['inserted']} inserted, "
+                 f"{stats['updated']} updated ({stats['rows_per_s']} rows/s).")
+    return stats
+
+def newest_update(users: List[dict]):
+    # Newest upstream LastUpdated among the users, or None
+    updated_upstream = [user['last_updated'] for user in users if user['last_updated'] is not None]
+    return max(map(_aware, updated_upstream), default=None)
+
+def record_sync(newest, stats: dict) -> SyncState:
+    # Advance the watermark: when the sync finished and the newest upstream LastUpdated it saw
+    state, _ = SyncState.objects.get_or_create(name=SYNC_NAME)
+    state.synced_at = timezone.now()
+    if newest is not None and (state.source_updated_at is None or newest > state.source_updated_at):
+        state.source_updated_at = newest
+    state.stats = stats
+    state.save()
+    return state
+
+def _put(chunks: queue.Queue, item, stop: threading.Event) -> bool:
+    # Blocks while the writer is behind, giving up once it has stopped
+    while not stop.is_set():
+        try:
+            chunks.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _produce_user_chunks(chunk_size: int, chunks: queue.Queue, stop: threading.Event):
+    # Download thread: validated chunks, then None at the end (or the exception that ended it)
+    try:
+        for users in stream_user_chunks(chunk_size):
+            if not _put(chunks, users, stop):
+                return
+        _put(chunks, None, stop)
+    except Exception as e:
+        _put(chunks, e, stop)
+
+def stream_and_upsert_users(mode: str = 'bulk', chunk_size: int = UPSERT_CHUNK_SIZE, flag_missing: bool = False,
+                            watermark=None) -> dict:
+    """Sync while downloading: a thread parses the Users array off the response stream and
+    validates it chunk_size users at a time, and this thread writes each chunk as it arrives.
+
+    At most STREAM_QUEUE_CHUNKS chunks wait between the two, so memory does not grow with the user
+    count (apart from the set of seen IDs kept for ``flag_missing``). A download that fails part way
+    keeps the chunks already written but neither flags missing users nor moves the watermark.
+    """
+    started = time.perf_counter()
+    stats = {'users': 0, 'inserted': 0, 'updated': 0, 'unchanged': 0, 'written': 0,
+             'skipped': 0, 'duplicates': 0, 'chunks': 0}
+    seen = set()
+    newest = None
+    complete = False
+
+    chunks = queue.Queue(maxsize=max(1, STREAM_QUEUE_CHUNKS))
+    stop = threading.Event()
+    threading.Thread(target=_produce_user_chunks, args=(chunk_size, chunks, stop),
+                     name='mixitup-users-stream', daemon=True).start()
+    try:
+        while True:
+            users = chunks.get()
+            if users is None:
+                complete = True
+                break
+            if isinstance(users, Exception):
+                logging.error(f"Error fetching users: {users}")
+                break
+
+            stats['users'] += len(users)
+            if mode == 'row':
+                for user in users:
+                    _, created = upsert_user(user)
+                    stats['inserted' if created else 'updated'] += 1
+                    stats['written'] += 1
+            else:
+                _upsert_chunk(_rows(users, stats), stats, incremental=mode == 'incremental', watermark=watermark)
+            stats['chunks'] += 1
+            seen.update(user['mixitup_user_id'] for user in users if user['mixitup_user_id'])
+            chunk_newest = newest_update(users)
+            if chunk_newest is not None and (newest is None or chunk_newest > newest):
+                newest = chunk_newest
+    finally:
+        stop.set()
+
+    stats['seconds'] = round(time.perf_counter() - started, 3)
+    stats['rows_per_s'] = round(stats['users'] / stats['seconds'], 1) if stats['seconds'] > 0 else 0.0
+    logging.info(
+        f"Streamed {stats['users']} users in {stats['chunks']} chunks ({mode}): {stats['inserted']} inserted, "
+        f"{stats['updated']} updated, {stats['unchanged']} unchanged, {stats['written']} written, "
+        f"{stats['skipped']} skipped ({stats['rows_per_s']} rows/s)."
+    )
+    if complete and seen:
+        if flag_missing:
+            stats['missing'] = flag_missing_users(seen, chunk_size)
+        record_sync(newest, stats)
+    return stats
+
+def mixitup_client() -> MixItUpClient:
+    return MixItUpClient(API_URL, max_workers=MIXITUP_MAX_WORKERS, rate=MIXITUP_RATE_LIMIT, retries=MIXITUP_RETRIES)
+
+def refresh_users(user_ids: List[str], client: Optional[MixItUpClient] = None) -> dict:
+    # Re-reads the given users through /users/{userId} concurrently and writes the changed ones
+    owned = client is None
+    client = client or mixitup_client()
+    try:
+        records = [record for record in client.fetch_users(user_ids).values() if record]
+        stats = bulk_upsert_users(validate_users(records), incremental=True)
+        stats['fetch'] = client.stats.snapshot()
+    finally:
+        if owned:
+            client.close()
+    return stats
+
+def sync_active_users(client: Optional[MixItUpClient] = None) -> dict:
+    # Writes the changed users among those /users/active lists; a partial sync, so no watermark or missing flags
+    owned = client is None
+    client = client or mixitup_client()
+    try:
+        stats = bulk_upsert_users(validate_users(client.get_active_users()), incremental=True)
+        stats['fetch'] = client.stats.snapshot()
+    finally:
+        if owned:
+            client.close()
+    return stats
+
+def fetch_and_upsert_users(mode: str = 'bulk', chunk_size: int = UPSERT_CHUNK_SIZE, flag_missing: bool = False,
+                           stream: bool = False) -> dict:
+    # An incremental sync trusts LastUpdated: users not updated upstream since the last complete sync are left alone
+    state = SyncState.objects.filter(name=SYNC_NAME).first()
+    watermark = None
+    if state is not None:
+        logging.info(f"Last sync finished at {state.synced_at}, newest upstream change {state.source_updated_at}.")
+        if mode == 'incremental':
+            watermark = state.source_updated_at
+    if stream:
+        return stream_and_upsert_users(mode=mode, chunk_size=chunk_size, flag_missing=flag_missing, watermark=watermark)
+
+    users = fetch_all_users()
+    logging.info(f"Upserting {len(users)} users into the database ({mode}).")
+    if mode == 'row':
+        stats = row_upsert_users(users)
+    else:
+        stats = bulk_upsert_users(users, chunk_size=chunk_size, incremental=mode == 'incremental', watermark=watermark)
+    # An empty list is also what a failed fetch returns, so it neither flags users nor moves the watermark
+    if users:
+        if flag_missing:
+            stats['missing'] = flag_missing_users([user['mixitup_user_id'] for user in users], chunk_size)
+        record_sync(newest_update(users), stats)
+    return stats
 
 if __name__ == "__main__":
     fetch_and_upsert_users()
@@ -1,8 +1,30 @@
-from flask import Flask, request, jsonify
-from transformers import AutoModelForCausalLM, AutoTokenizer, DistilBertForSequenceClassification, DistilBertTokenizer
+import time
+IMPORT_STARTED_AT = time.perf_counter()  # Import time of this module is logged once it finishes
+
+from flask import Flask, Response, abort, g, request, jsonify, send_file, stream_with_context
 import torch
 import os
+import json
+import concurrent.futures
 import logging
+import random
+from contextlib import closing, contextmanager
+from batching import GenerationBatcher
+from scheduler import CancelStoppingCriteria, DeadlineExceeded, GenerationScheduler, grace_cutoff, wait_for, wait_until
+from sessions import SessionStore
+from inference_profile import apply_profile, configure_threads, load_profiles, resolve_profile
+from serving import memory_report
+from response_cache import ResponseCache, normalize_text
+from semantic_cache import SemanticCache
+from fast_router import FastRouter
+from assisted import AssistedDecoding, count_forwards, draft_view, truncated_draft
+from prefix_cache import PrefixCache
+from tokenization import TokenMemo, load_tokenizer
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, TOKEN_BUCKETS, MetricsRegistry
+import profiling
+from profiling import PROFILE_HEADER, ProfileStore, RequestProfiler
+from model_registry import DEFAULT_ALLOWLIST, MB, ModelNotAllowedError, ModelRegistry, parse_allowlist
+from warmup import Warmup
 
 #logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logging.basicConfig(
@@ -14,16 +36,14 @@ logging.basicConfig(
 )
 
 # Determine base model path based on OS
-model_base_path = "C:\\wamp64\\www\\Droid7\\webhook-message\\models" if os.name == "nt" else "/app/models"
+model_base_path = os.environ.get('MODEL_BASE_PATH') or ("C:\\wamp64\\www\\Droid7\\webhook-message\\models" if os.name == "nt" else "/app/models")
 #model_base_path = "\\app\\models"
 logging.info(f"Model base path: {model_base_path}")
 
-print(torch.cuda.is_available())
-print(torch.__version__)
-
 # Set device automatically
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-print("Using device:", device)
+logging.info(f"torch {torch.__version__}, CUDA available: {torch.cuda.is_available()}, using device: {device}")
+configure_threads()
 
 # Set environment variables for CUDA debugging
 os.environ["CUDA_LAUNCH_BLOCKING"] = "1"
@@ -32,133 +52,746 @@ os.environ["USE_FLASH_ATTENTION"] = "1"
 
 app = Flask(__name__)
 
-# Global cache for loaded models and tokenizers
-model_cache = {}
+# Per-model dtype/quantization settings, see inference_profile.py
+inference_profiles = load_profiles()
+
+def release_model_state(name):
+    # Conversation sessions and stored prompt prefixes hold the evicted model's keys/values; drop them with it
+    session_store.drop_model(name)
+    prefix_cache.drop_scope(name)
+
+# Global cache for loaded models and tokenizers: only allowlisted models, LRU-evicted to stay
+# within MODEL_MEMORY_BUDGET_MB. MODEL_ALLOWLIST adds "name" or "name:MB" entries.
+model_registry = ModelRegistry(
+    model_base_path,
+    allowlist={**DEFAULT_ALLOWLIST, **parse_allowlist(os.environ.get('MODEL_ALLOWLIST'))},
+    budget_bytes=int(float(os.environ.get('MODEL_MEMORY_BUDGET_MB', '4096')) * MB),
+    on_evict=release_model_state,
+)
 
 # Global variables to hold the model and tokenizer
 model = None
 tokenizer = None
 
-def load_model(model_info):
-    global device
+# Micro-batching settings for /generate: prompts arriving within the wait window for the
+# same model and sampling params are padded into a single model.generate() call
+GENERATE_BATCHING = os.environ.get('GENERATE_BATCHING', '1') == '1'
+GENERATE_BATCH_MAX_SIZE = int(os.environ.get('GENERATE_BATCH_MAX_SIZE', '8'))
+GENERATE_BATCH_MAX_WAIT_MS = float(os.environ.get('GENERATE_BATCH_MAX_WAIT_MS', '20'))
+DIALOGPT_MAX_LENGTH = 1000
+
+# Largest list of messages one /process/bulk request may carry
+BULK_PROCESS_MAX_MESSAGES = int(os.environ.get('BULK_PROCESS_MAX_MESSAGES', '256'))
+
+# All model execution goes through the scheduler: priority classes, deadlines, early stop on deadline.
+# One worker by default: a seeded request reseeds the process-global torch RNG (seeded_rng), so its output
+# only reproduces while no other job samples at the same time. With more workers, seeded output is not cached.
+generation_scheduler = GenerationScheduler(workers=int(os.environ.get('SCHEDULER_WORKERS', '1')), wrap_job=profiling.wrap_job)
+
+# Server-side DialoGPT conversation sessions: token history plus past_key_values per conversation_id
+session_store = SessionStore(
+    token_budget=int(os.environ.get('SESSION_TOKEN_BUDGET', '512')),
+    ttl_seconds=float(os.environ.get('SESSION_TTL_SECONDS', '1800')),
+    max_bytes=int(os.environ.get('SESSION_MAX_BYTES', str(512 * 1024 * 1024))),
+    max_sessions=int(os.environ.get('SESSION_MAX_COUNT', '1000')),
+)
+
+# Number of texts tokenized and scored per forward pass when /classify receives a list
+CLASSIFY_BATCH_SIZE = int(os.environ.get('CLASSIFY_BATCH_SIZE', '32'))
+
+# Exact-match cache for classification results and deterministic generations (greedy or seeded)
+RESPONSE_CACHE_ENABLED = os.environ.get('RESPONSE_CACHE_ENABLED', '1') == '1'
+response_cache = ResponseCache(
+    max_bytes=int(float(os.environ.get('RESPONSE_CACHE_MAX_MB', '64')) * MB),
+    ttl_seconds=float(os.environ.get('RESPONSE_CACHE_TTL_SECONDS', '600')),
+)
+
+# Optional near-duplicate reply cache: prompts embedded with the DistilBERT encoder, matched by cosine similarity
+SEMANTIC_CACHE_ENABLED = os.environ.get('SEMANTIC_CACHE_ENABLED', '0') == '1'
+SEMANTIC_CACHE_ENCODER = {'description': {'url': os.environ.get('SEMANTIC_CACHE_ENCODER', 'distilbert-base-uncased-finetuned-sst-2-english'), 'params': {}}}
+semantic_cache = SemanticCache(
+    capacity=int(os.environ.get('SEMANTIC_CACHE_CAPACITY', '2048')),
+    threshold=float(os.environ.get('SEMANTIC_CACHE_THRESHOLD', '0.95')),
+    ttl_seconds=float(os.environ.get('SEMANTIC_CACHE_TTL_SECONDS', '600')),
+)
+
+# Cascaded /process sentiment routing: a cheap first stage (trained hashed n-gram model, or a lexicon
+# when FAST_ROUTER_MODEL is unset) decides confident messages, everything else goes to DistilBERT.
+FAST_ROUTER_ENABLED = os.environ.get('FAST_ROUTER_ENABLED', '0') == '1'
+FAST_ROUTER_THRESHOLD = float(os.environ.get('FAST_ROUTER_THRESHOLD', '0.9'))
+FAST_ROUTER_SHADOW_RATE = float(os.environ.get('FAST_ROUTER_SHADOW_RATE', '0.05'))  # Fast decisions re-checked by DistilBERT
+fast_router = FastRouter.load(os.environ['FAST_ROUTER_MODEL'], FAST_ROUTER_THRESHOLD) if os.environ.get('FAST_ROUTER_MODEL') else FastRouter(threshold=FAST_ROUTER_THRESHOLD)
+
+# Tokenizers: the Rust-backed ones when they encode like the pure-Python ones (checked at load), and a
+# bounded memo of recent text -> token ids so repeated chat lines and template fragments skip tokenization
+FAST_TOKENIZERS = os.environ.get('FAST_TOKENIZERS', '1') == '1'
+TOKENIZER_EQUIVALENCE_CHECK = os.environ.get('TOKENIZER_EQUIVALENCE_CHECK', '1') == '1'
+token_memo = TokenMemo(max_entries=int(os.environ.get('TOKEN_MEMO_SIZE', '4096')))
+
+# Cross-request KV cache of prompt prefixes (shared persona/system templates): a single-prompt generate call
+# starts from the past_key_values of the longest stored prefix and only runs the model over the rest
+PREFIX_CACHE_ENABLED = os.environ.get('PREFIX_CACHE_ENABLED', '1') == '1'
+prefix_cache = PrefixCache(
+    max_bytes=int(float(os.environ.get('PREFIX_CACHE_MAX_MB', '256')) * MB),
+    min_tokens=int(os.environ.get('PREFIX_CACHE_MIN_TOKENS', '16')),
+)
+
+# Assisted (speculative) decoding: a model entry's params may name a draft model, either another allowlisted
+# model ({"assistant": {"url": "distilgpt2"}}) or the target's own first blocks ({"assistant": {"layers": 4}}).
+# Each pair falls back to plain decoding while its acceptance rate or tokens/s gain doesn't pay off.
+ASSISTED_DECODING_ENABLED = os.environ.get('ASSISTED_DECODING_ENABLED', '1') == '1'
+assisted_decoding = AssistedDecoding(
+    min_acceptance=float(os.environ.get('ASSISTED_MIN_ACCEPTANCE', '0.3')),
+    min_samples=int(os.environ.get('ASSISTED_MIN_SAMPLES', '5')),
+    probe_rate=float(os.environ.get('ASSISTED_PROBE_RATE', '0.1')),
+)
+
+# Per-stage timings, token counts, cache and queue state, served on /metrics in Prometheus text format
+metrics = MetricsRegistry()
+stage_seconds = metrics.histogram('inference_stage_seconds', 'Time spent in each inference stage.', ('stage', 'model'))
+token_counts = metrics.histogram('inference_tokens', 'Tokens per call: prompt tokens (in) and generated tokens (out).', ('direction', 'model'), buckets=TOKEN_BUCKETS)
+request_seconds = metrics.histogram('http_request_duration_seconds', 'Time until the response (or the first byte of a stream) is ready.', ('route', 'status'))
+metrics.callback('scheduler_queue_depth', 'Jobs waiting in the generation scheduler.', 'gauge', generation_scheduler.queue_depth)
+metrics.callback('model_registry_resident_bytes', 'Bytes of model weights currently resident.', 'gauge', lambda: model_registry.stats()['resident_bytes'])
+metrics.callback('model_registry_events_total', 'Model registry cache hits, misses (loads) and evictions.', 'counter', lambda: [
+    ({'model': name, 'event': event}, stats[key])
+    for name, stats in model_registry.stats()['models'].items()
+    for event, key in (('hit', 'hits'), ('miss', 'misses'), ('eviction', 'evictions'))
+])
+metrics.callback('response_cache_events_total', 'Response cache hits, misses and evictions.', 'counter', lambda: [
+    ({'event': event}, response_cache.stats()[key]) for event, key in (('hit', 'hits'), ('miss', 'misses'), ('eviction', 'evictions'))
+])
+metrics.callback('semantic_cache_events_total', 'Semantic cache hits, misses and evictions.', 'counter', lambda: [
+    ({'event': event}, semantic_cache.stats()[key]) for event, key in (('hit', 'hits'), ('miss', 'misses'), ('eviction', 'evictions'))
+])
+metrics.callback('token_memo_events_total', 'Token memo hits and misses (texts tokenized).', 'counter', lambda: [
+    ({'event': event}, token_memo.stats()[key]) for event, key in (('hit', 'hits'), ('miss', 'misses'))
+])
+metrics.callback('response_cache_bytes', 'Estimated bytes held by the response cache.', 'gauge', lambda: response_cache.stats()['bytes'])
+metrics.callback('prefix_cache_events_total', 'Prompt prefix KV cache hits, misses and evictions.', 'counter', lambda: [
+    ({'event': event}, prefix_cache.stats()[key]) for event, key in (('hit', 'hits'), ('miss', 'misses'), ('eviction', 'evictions'))
+])
+metrics.callback('prefix_cache_reused_tokens_total', 'Prompt tokens served from the prefix KV cache instead of the model.', 'counter', lambda: prefix_cache.stats()['reused_tokens'])
+metrics.callback('prefix_cache_bytes', 'Bytes of past_key_values held by the prefix cache.', 'gauge', lambda: prefix_cache.stats()['bytes'])
+metrics.callback('router_decisions_total', 'Sentiment routing decisions by stage, and shadow checks of the fast stage.', 'counter', lambda: [
+    ({'stage': stage}, fast_router.stats()[stage]) for stage in ('fast', 'model', 'shadow_checked', 'shadow_disagreed')
+])
+metrics.callback('assisted_decoding_tokens_total', 'Tokens proposed by draft models and accepted by the target, per model pair.', 'counter', lambda: [
+    ({'pair': pair, 'kind': kind}, stats[f'{kind}_tokens']) for pair, stats in assisted_decoding.stats().items() for kind in ('drafted', 'accepted')
+])
+metrics.callback('session_store_sessions', 'Conversation sessions held server-side.', 'gauge', lambda: session_store.stats()['sessions'])
+metrics.callback('session_store_bytes', 'Estimated bytes of cached conversation history and KV.', 'gauge', lambda: session_store.stats()['bytes'])
+
+# Opt-in profiling of inference requests: X-Profile header, sampling, or the request after a slow one.
+# Captures (torch.profiler trace or cProfile stats, plus tracemalloc) go to a ring of PROFILE_MAX_COUNT.
+request_profiler = RequestProfiler(
+    ProfileStore(os.environ.get('PROFILE_DIR', '/tmp/droid7-profiles'), int(os.environ.get('PROFILE_MAX_COUNT', '20'))),
+    enabled=os.environ.get('PROFILING_ENABLED', '0') == '1',
+    sample_rate=float(os.environ.get('PROFILE_SAMPLE_RATE', '0')),
+    slow_ms=float(os.environ.get('PROFILE_SLOW_MS', '0')),
+    default_mode=os.environ.get('PROFILE_MODE', 'torch'),
+)
+PROFILED_ROUTES = ('/classify', '/process', '/process/bulk', '/generate')
+
+# Models loaded and exercised in the background at startup; /readyz answers 200 once they all are
+WARMUP_MODELS = os.environ.get('WARMUP_MODELS', 'distilbert-base-uncased-finetuned-sst-2-english,gpt2,DialoGPT-medium')
+
+def model_label(model_info):
     try:
-        # Normalize the model path for compatibility
-        path = os.path.normpath(model_info['description']['url'])  # Normalize path
-        params = model_info['description'].get('params', {})
+        return model_registry.resolve(model_info['description']['url'])
+    except (ModelNotAllowedError, KeyError, TypeError):
+        return 'unknown'
 
-        # Check cache first
-        if path in model_cache:
-            logging.info(f"Model '{path}' found in cache.")
-            return model_cache[path]  # Return cached model and tokenizer
-
-        torch_dtype = torch.float32
-        if 'torch_dtype' in params:
-            dtype_str = params['torch_dtype']
-            torch_dtype = getattr(torch, dtype_str, torch.float32)
-
-        logging.info(f"Loading model from {path}.")
-
-        # Load models based on path
-        if 'distilbert' in path.lower():
-            model = DistilBertForSequenceClassification.from_pretrained(path).to(device)
-            tokenizer = DistilBertTokenizer.from_pretrained(path)
-        elif 'dialogpt' in path.lower():
-            model = AutoModelForCausalLM.from_pretrained(path, torch_dtype=torch_dtype).to(device)
-            tokenizer = AutoTokenizer.from_pretrained(path)
-        else:
-            model = AutoModelForCausalLM.from_pretrained(path, torch_dtype=torch_dtype).to(device)
-            tokenizer = AutoTokenizer.from_pretrained(path)
+def record_tokens(label, tokens_in, tokens_out):
+    token_counts.observe(tokens_in, direction='in', model=label)
+    token_counts.observe(tokens_out, direction='out', model=label)
 
-        logging.info(f"Model '{path}' loaded successfully on device: {device}.")
-        
-        # Cache the model and tokenizer
-        model_cache[path] = (model, tokenizer)
-        
-        return model, tokenizer
+def load_model(model_info):
+    try:
+        params = model_info['description'].get('params', {})
+        with stage_seconds.time(stage='load', model=model_label(model_info)):
+            return model_registry.get(model_info['description']['url'], lambda path: load_model_from_disk(path, params))
 
+    except ModelNotAllowedError:
+        raise
     except Exception as e:
         logging.error(f"Failed to load model {model_info['description']['url']}: {str(e)}")
         return None, None
 
+def load_model_from_disk(path, params):
+    global device
+    # Device-aware dtype and optional int8 quantization come from the model's inference profile
+    profile = resolve_profile(os.path.basename(path), params, device, inference_profiles)
+    torch_dtype = profile['torch_dtype']
+
+    # transformers' model classes take most of a second to import, so the process doesn't pay for them
+    # until the first model load (normally on the warm-up thread)
+    from transformers import AutoModelForCausalLM, AutoTokenizer, DistilBertForSequenceClassification, DistilBertTokenizer, DistilBertTokenizerFast
+
+    logging.info(f"Loading model from {path}.")
 
-def classify_text(input_text, model_info):  # Removed device parameter
-    logging.info(f"Classifying text with model: {model_info['description']['url']}")
+    # Load models based on path
+    if 'distilbert' in path.lower():
+        model = DistilBertForSequenceClassification.from_pretrained(path).to(device)
+        tokenizer = load_tokenizer(path, DistilBertTokenizer.from_pretrained, DistilBertTokenizerFast.from_pretrained, FAST_TOKENIZERS, TOKENIZER_EQUIVALENCE_CHECK)
+    elif 'dialogpt' in path.lower():
+        model = AutoModelForCausalLM.from_pretrained(path, torch_dtype=torch_dtype).to(device)
+        tokenizer = load_tokenizer(path, lambda p: AutoTokenizer.from_pretrained(p, use_fast=False), AutoTokenizer.from_pretrained, FAST_TOKENIZERS, TOKENIZER_EQUIVALENCE_CHECK)
+    else:
+        model = AutoModelForCausalLM.from_pretrained(path, torch_dtype=torch_dtype).to(device)
+        tokenizer = load_tokenizer(path, lambda p: AutoTokenizer.from_pretrained(p, use_fast=False), AutoTokenizer.from_pretrained, FAST_TOKENIZERS, TOKENIZER_EQUIVALENCE_CHECK)
+    model = apply_profile(model, profile)
+
+    logging.info(f"Model '{path}' loaded successfully on device: {device} (int8: {profile['quantize_int8']}).")
+    return model, tokenizer
+
+
+# (1, seq_len) token ids of text on the device, through the token memo
+def encode_ids(tokenizer, text, **kwargs):
+    return torch.tensor([token_memo.encode(tokenizer, text, **kwargs)], dtype=torch.long, device=device)
+
+# Right-padded classifier inputs through the token memo, as tokenizer(texts, padding=True, truncation=True) builds them
+def encode_padded(tokenizer, texts):
+    encoded = [token_memo.encode(tokenizer, text, truncation=True) for text in texts]
+    width = max(len(ids) for ids in encoded)
+    return {
+        'input_ids': torch.tensor([ids + [tokenizer.pad_token_id] * (width - len(ids)) for ids in encoded], dtype=torch.long, device=device),
+        'attention_mask': torch.tensor([[1] * len(ids) + [0] * (width - len(ids)) for ids in encoded], dtype=torch.long, device=device),
+    }
+
+def classify_text(input_text, model_info, use_cache=True):  # Removed device parameter
+    return classify_texts([input_text], model_info, use_cache=use_cache)[0]['predicted_class']
+
+def classify_cache_key(text, model_info):
+    # The classifier ignores whitespace runs, and case too when the model is uncased
+    name = model_label(model_info)
+    return ('classify', name, normalize_text(text, collapse_whitespace=True, lowercase='uncased' in name))
+
+# Classify a list of texts in padded chunks, returning predicted_class and softmax scores per item
+def classify_texts(texts, model_info, batch_size=None, use_cache=True):
+    logging.info(f"Classifying {len(texts)} text(s) with model: {model_info['description']['url']}")
     model, tokenizer = load_model(model_info)  # Adjusted to use global device
-    inputs = tokenizer(input_text, return_tensors='pt').to(device)  # Ensure inputs are on the same device
-    with torch.no_grad():
-        logits = model(**inputs).logits
-    predicted_class = logits.argmax().item()
+    batch_size = batch_size or CLASSIFY_BATCH_SIZE
+    label = model_label(model_info)
+
+    results = [None] * len(texts)
+    keys = [classify_cache_key(text, model_info) for text in texts] if use_cache and RESPONSE_CACHE_ENABLED else None
+    pending = range(len(texts))
+    if keys is not None:
+        for index, key in enumerate(keys):
+            cached = response_cache.get(key)
+            if cached is not None:
+                results[index] = dict(cached, scores=list(cached['scores']))
+        pending = [index for index in pending if results[index] is None]
+
+    # Sort by length so each chunk pads to a similar width, then restore the caller's order
+    order = sorted(pending, key=lambda i: len(texts[i]))
+    for start in range(0, len(order), batch_size):
+        chunk = order[start:start + batch_size]
+        with stage_seconds.time(stage='tokenize', model=label):
+            inputs = encode_padded(tokenizer, [texts[i] for i in chunk])
+        for length in inputs['attention_mask'].sum(dim=-1).tolist():
+            token_counts.observe(length, direction='in', model=label)
+        with stage_seconds.time(stage='classify', model=label), torch.no_grad():
+            logits = model(**inputs).logits
+        scores = torch.softmax(logits.float(), dim=-1)
+        predicted = logits.argmax(dim=-1)
+        for row, index in enumerate(chunk):
+            results[index] = {'predicted_class': predicted[row].item(), 'scores': scores[row].tolist()}
+            if keys is not None:
+                response_cache.put(keys[index], dict(results[index], scores=list(results[index]['scores'])))
+
     logging.info("Classification successful.")
-    return predicted_class
+    return results
 
-@app.route('/classify', methods=['POST'])
-def classify_content():
+# Priority class and absolute deadline for a request body's optional 'priority' and 'deadline_ms'
+def request_schedule(data):
+    priority = GenerationScheduler.parse_priority((data or {}).get('priority'))
+    deadline_ms = (data or {}).get('deadline_ms')
+    if deadline_ms is None:
+        return priority, None
+    if not isinstance(deadline_ms, (int, float)) or deadline_ms <= 0:
+        raise ValueError('deadline_ms must be a positive number.')
+    return priority, time.monotonic() + deadline_ms / 1000.0
+
+DEADLINE_ERROR = {'error': 'Deadline exceeded before the request could be served.'}
+
+def warm_load(name):
+    model, _ = load_model({'description': {'url': name, 'params': {}}})
+    if model is None:
+        raise RuntimeError(f"Error loading model '{name}'.")
+
+def warm_exercise(name):
+    # One short forward pass (classifier) or a few decoded tokens, queued behind real traffic
+    def run():
+        model, tokenizer = load_model({'description': {'url': name, 'params': {}}})
+        inputs = tokenizer('Warm-up message', return_tensors='pt').to(device)
+        with torch.no_grad():
+            if 'distilbert' in name.lower():
+                model(**inputs)
+            else:
+                pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+                model.generate(**inputs, max_new_tokens=4, do_sample=False, pad_token_id=pad_token_id)
+    generation_scheduler.run(run, priority='background')
+
+warmup = Warmup([name.strip() for name in WARMUP_MODELS.split(',') if name.strip()], warm_load, warm_exercise)
+
+def readiness():
+    # /readyz doubles as the trigger for warm-up when no entry point has started it
+    warmup.start()
+    status = warmup.status()
+    return {**status, 'import_s': IMPORT_SECONDS}, 200 if status['ready'] else 503
+
+# Request handlers shared by the Flask routes below and the asyncio front-end in asgi.py.
+# Each returns (payload, status); payload is a dict for JSON or a generator of SSE strings.
+def handle_classify(data):
     try:
-        data = request.json
         if not data or 'text' not in data or 'model' not in data:
-            return jsonify({'error': 'Missing required fields: text or model'}), 400
+            return {'error': 'Missing required fields: text or model'}, 400
 
         model_info = data['model']
         
         if not isinstance(model_info, dict):
-            return jsonify({'error': 'Model information must be a dictionary.'}), 400
-        
-        # Ensure classify_text receives all required arguments
-        predicted_class = classify_text(data['text'], model_info)  # Removed device parameter
-        return jsonify({'predicted_class': predicted_class}), 200
+            return {'error': 'Model information must be a dictionary.'}, 400
+        try:
+            priority, deadline = request_schedule(data)
+        except ValueError as e:
+            return {'error': str(e)}, 400
+
+        text = data['text']
+        if isinstance(text, list):
+            if not all(isinstance(item, str) for item in text):
+                return {'error': 'Every item in text must be a string.'}, 400
+            batch_size = data.get('batch_size')
+            if batch_size is not None and (not isinstance(batch_size, int) or batch_size < 1):
+                return {'error': 'batch_size must be a positive integer.'}, 400
+            return {'results': generation_scheduler.run(classify_texts, text, model_info, batch_size, request_uses_cache(data), priority=priority, deadline=deadline)}, 200
 
+        if not isinstance(text, str):
+            return {'error': 'text must be a string or a list of strings.'}, 400
+
+        # Single strings go through the same path as lists so the outputs match item for item
+        result = generation_scheduler.run(classify_texts, [text], model_info, use_cache=request_uses_cache(data), priority=priority, deadline=deadline)[0]
+        return result, 200
+
+    except ModelNotAllowedError as e:
+        return {'error': str(e)}, 403
+    except DeadlineExceeded:
+        return DEADLINE_ERROR, 504
     except Exception as e:
         logging.error(f"An error occurred: {str(e)}")
-        return jsonify({'error': f'Internal Server Error: {str(e)}'}), 500
+        return {'error': f'Internal Server Error: {str(e)}'}, 500
 
 # Generate text based on the model and user input
-def generate_text(prompt, model_info, chat_history_ids=None):
+# info, when given, receives 'prefix_cached_tokens': prompt tokens whose keys/values came from the prefix cache,
+# and 'stopped_by_deadline': whether the request's deadline cut the reply short
+def generate_text(prompt, model_info, chat_history_ids=None, info=None):
     input_text = prompt
-    try:
-        model, tokenizer = load_model(model_info)  # No need to pass device
-    except Exception as e:
-        logging.error(f"An error occurred: {str(e)}")
-        print(f"Failed to load model: {str(e)}")
-        return "Error loading model.", None
+    model, tokenizer = load_model(model_info)  # No need to pass device
+    if model is None:
+        raise RuntimeError("Error loading model.")
 
+    label = model_label(model_info)
     # Use 'url' instead of 'id' to access model information
     if 'dialogpt' in model_info['description']['url'].lower():
-        new_user_input_ids = tokenizer.encode(input_text + tokenizer.eos_token, return_tensors='pt').to(device)
+        with stage_seconds.time(stage='tokenize', model=label):
+            new_user_input_ids = encode_ids(tokenizer, input_text + tokenizer.eos_token)
         bot_input_ids = torch.cat([chat_history_ids, new_user_input_ids], dim=-1).to(device) if chat_history_ids is not None else new_user_input_ids
         attention_mask = torch.ones(bot_input_ids.shape, dtype=torch.long).to(device)
 
-        chat_history_ids = model.generate(bot_input_ids, max_length=1000, attention_mask=attention_mask, pad_token_id=tokenizer.eos_token_id)
-        generated_text = tokenizer.decode(chat_history_ids[:, bot_input_ids.shape[-1]:][0], skip_special_tokens=True)
+        with stage_seconds.time(stage='generate', model=label):
+            chat_history_ids, cached_tokens = generate_with_prefix_cache(model, model_info, bot_input_ids, max_length=DIALOGPT_MAX_LENGTH, attention_mask=attention_mask, pad_token_id=tokenizer.eos_token_id, stopping_criteria=generation_scheduler.stopping_criteria())
+        with stage_seconds.time(stage='decode', model=label):
+            generated_text = tokenizer.decode(chat_history_ids[:, bot_input_ids.shape[-1]:][0], skip_special_tokens=True)
+        record_tokens(label, bot_input_ids.shape[-1] - cached_tokens, chat_history_ids.shape[-1] - bot_input_ids.shape[-1])
+        if info is not None:
+            info['prefix_cached_tokens'] = cached_tokens
+            info['stopped_by_deadline'] = generation_scheduler.stopped_by_deadline()
 
         return generated_text, chat_history_ids
     else:
-        input_ids = tokenizer.encode(input_text, return_tensors='pt').to(device)
+        with stage_seconds.time(stage='tokenize', model=label):
+            input_ids = encode_ids(tokenizer, input_text)
         attention_mask = torch.ones(input_ids.shape, dtype=torch.long).to(device)
         pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
 
-        output = model.generate(
-            input_ids,
-            max_length=model_info['description']['params'].get('max_length', 50),
-            num_return_sequences=1,
-            do_sample=True,
-            temperature=model_info['description']['params'].get('temperature', 0.7),
-            top_k=model_info['description']['params'].get('top_k', 50),
-            top_p=model_info['description']['params'].get('top_p', 0.95),
-            attention_mask=attention_mask,
-        )
+        with stage_seconds.time(stage='generate', model=label), seeded_rng(model_info['description']['params'].get('seed')):
+            output, cached_tokens = generate_with_prefix_cache(
+                model,
+                model_info,
+                input_ids,
+                max_length=model_info['description']['params'].get('max_length', 50),
+                attention_mask=attention_mask,
+                stopping_criteria=generation_scheduler.stopping_criteria(),
+                **sampling_kwargs(model_info),
+            )
+        with stage_seconds.time(stage='decode', model=label):
+            generated_text = tokenizer.decode(output[0], skip_special_tokens=True)
+        record_tokens(label, input_ids.shape[-1] - cached_tokens, output.shape[-1] - input_ids.shape[-1])
+        if info is not None:
+            info['prefix_cached_tokens'] = cached_tokens
+            info['stopped_by_deadline'] = generation_scheduler.stopped_by_deadline()
 
-        return tokenizer.decode(output[0], skip_special_tokens=True), None
+        return generated_text, None
 
-@app.route('/process', methods=['POST'])
-def process_content():
-    data = request.json
-    input_text = data.get('text')
+# Draft model for the entry's params['assistant'] as (model, label), or None to decode without one
+def load_assistant(model_info, model):
+    params = model_info['description'].get('params', {})
+    spec = params.get('assistant')
+    if not ASSISTED_DECODING_ENABLED or not spec:
+        return None
+    try:
+        if spec.get('layers'):
+            draft = truncated_draft(model, spec['layers'])
+            draft_label = f"{model_label(model_info)}[:{int(spec['layers'])}]"
+        else:
+            draft_info = {'description': {'url': spec['url'], 'params': {'torch_dtype': params.get('torch_dtype', 'float32')}}}
+            draft, _ = load_model(draft_info)
+            draft_label = model_label(draft_info)
+            if draft is None:
+                return None
+        # transformers 4.45 verifies draft tokens by id, so both models need the same vocabulary
+        if draft.config.vocab_size != model.config.vocab_size:
+            raise ValueError(f"vocabulary size {draft.config.vocab_size} differs from the target's {model.config.vocab_size}")
+    except (ModelNotAllowedError, ValueError, TypeError, AttributeError, KeyError) as e:
+        logging.warning(f"Assistant {spec} unusable for {model_label(model_info)}, decoding without it: {str(e)}")
+        return None
+    # The shared draft model is never changed: each call gets its own generation config
+    return draft_view(draft, spec.get('num_assistant_tokens')), draft_label
 
-    if not input_text:
-        return jsonify({"error": "Input text is required"}), 400
+# model.generate for one sequence, with the entry's draft model while assisted decoding is paying off.
+# Acceptance comes from forward passes: one per drafted token, one per verification step.
+def generate_with_assistant(model, model_info, input_ids, **generate_kwargs):
+    assistant = load_assistant(model_info, model) if input_ids.shape[0] == 1 else None
+    if assistant is None:
+        return model.generate(input_ids, **generate_kwargs)
 
-    # First classify the text using DistilBERT
-    sentiment_model_info = {
+    draft, draft_label = assistant
+    key = (model_label(model_info), draft_label)
+    started = time.perf_counter()
+    if not assisted_decoding.use_assistant(key):
+        output = model.generate(input_ids, **generate_kwargs)
+        sequences = getattr(output, 'sequences', output)
+        assisted_decoding.record(key, sequences.shape[-1] - input_ids.shape[-1], time.perf_counter() - started)
+        return output
+    with count_forwards(model, draft) as passes:
+        output = model.generate(input_ids, assistant_model=draft, **generate_kwargs)
+    sequences = getattr(output, 'sequences', output)
+    assisted_decoding.record(key, sequences.shape[-1] - input_ids.shape[-1], time.perf_counter() - started, drafted=passes[draft], target_passes=passes[model])
+    return output
+
+# generate_with_assistant starting from the keys/values of the longest cached prefix of the prompt, which
+# then stores this prompt's own. Returns (output ids, number of prompt tokens taken from the cache).
+def generate_with_prefix_cache(model, model_info, input_ids, **generate_kwargs):
+    if not PREFIX_CACHE_ENABLED or input_ids.shape[0] != 1:
+        return generate_with_assistant(model, model_info, input_ids, **generate_kwargs), 0
+    scope = model_label(model_info)
+    tokens = input_ids[0].tolist()
+    past_key_values, cached_tokens = prefix_cache.lookup(scope, tokens)
+    output = generate_with_assistant(model, model_info, input_ids, past_key_values=past_key_values, return_dict_in_generate=True, **generate_kwargs)
+    prefix_cache.insert(scope, tokens, output.past_key_values)
+    return output.sequences, cached_tokens
+
+def sampling_kwargs(model_info):
+    params = model_info['description'].get('params', {})
+    if params.get('do_sample') is False:
+        return {'num_return_sequences': 1, 'do_sample': False}
+    return {
+        'num_return_sequences': 1,
+        'do_sample': True,
+        'temperature': params.get('temperature', 0.7),
+        'top_k': params.get('top_k', 50),
+        'top_p': params.get('top_p', 0.95),
+    }
+
+@contextmanager
+def seeded_rng(seed):
+    # A request's 'seed' param fixes sampling for its generate call; the global RNG is restored afterwards
+    if seed is None:
+        yield
+        return
+    with torch.random.fork_rng(devices=[torch.cuda.current_device()] if device.type == 'cuda' else []):
+        torch.manual_seed(seed)
+        yield
+
+def batch_key(model_info):
+    # Prompts only share a batch when they hit the same model with the same sampling params
+    path = model_registry.resolve(model_info['description']['url'])
+    if 'dialogpt' in path.lower():
+        return (path,)
+    params = model_info['description'].get('params', {})
+    sampling = sampling_kwargs(model_info)
+    return (path, params.get('max_length', 50), sampling['do_sample'], sampling.get('temperature'), sampling.get('top_k'), sampling.get('top_p'))
+
+def generation_cache_key(prompt, model_info):
+    # Only deterministic generations are cached: DialoGPT (greedy), do_sample false, or a fixed seed
+    # while a single scheduler worker keeps other jobs from drawing on the shared RNG
+    params = model_info['description'].get('params', {})
+    seeded = params.get('seed') is not None and generation_scheduler.workers == 1
+    if not (is_dialogpt(model_info) or params.get('do_sample') is False or seeded):
+        return None
+    return ('generate', batch_key(model_info), params.get('seed'), normalize_text(prompt))
+
+def request_uses_cache(data):
+    # "cache": false bypasses the response cache for one request, both reading and storing
+    return RESPONSE_CACHE_ENABLED and (data or {}).get('cache', True) is not False
+
+def embed_text(text):
+    # Mean-pooled last hidden state of the DistilBERT encoder. Runs on the request thread: one short
+    # encoder pass, cheap next to queueing behind generate jobs.
+    model, tokenizer = load_model(SEMANTIC_CACHE_ENCODER)
+    if model is None:
+        raise RuntimeError("Error loading semantic cache encoder.")
+    with stage_seconds.time(stage='embed', model=model_label(SEMANTIC_CACHE_ENCODER)), torch.no_grad():
+        inputs = encode_padded(tokenizer, [text])
+        hidden = model.base_model(**inputs).last_hidden_state
+        mask = inputs['attention_mask'].unsqueeze(-1).to(hidden.dtype)
+        return ((hidden * mask).sum(dim=1) / mask.sum(dim=1))[0].float().cpu().numpy()
+
+def cached_generate_text(prompt, model_info, use_cache, generate):
+    # generate() -> (generated text, generation info); returns (generated text, cache fields for the response).
+    # A reply the deadline cut short is returned but not cached.
+    key = generation_cache_key(prompt, model_info) if use_cache else None
+    if key is not None:
+        cached = response_cache.get(key)
+        if cached is not None:
+            return cached, {'cached': True}
+
+    # GPT-2 output starts with the prompt, so only the continuation is shared between paraphrases
+    keeps_prompt = not is_dialogpt(model_info)
+    semantic = use_cache and SEMANTIC_CACHE_ENABLED
+    if semantic:
+        scope = batch_key(model_info)
+        vector = embed_text(prompt)
+        match = semantic_cache.lookup(scope, vector)
+        if match is not None:
+            reply, similarity = match
+            return (prompt + reply if keeps_prompt else reply), {'cached': True, 'similarity': round(similarity, 4)}
+
+    generated_text, info = generate()
+    complete = not info.get('stopped_by_deadline')
+    if key is not None and complete:
+        response_cache.put(key, generated_text)
+    if semantic and complete and (not keeps_prompt or generated_text.startswith(prompt)):
+        semantic_cache.add(scope, vector, generated_text[len(prompt):] if keeps_prompt else generated_text)
+    return generated_text, {'cached': False}
+
+# Generate text for several prompts with one padded model.generate() call. Only a lone prompt can start
+# from the prefix cache: left padding shifts every row's positions.
+def generate_text_batch(prompts, model_info, infos=None):
+    if len(prompts) == 1:
+        generated_text, _ = generate_text(prompts[0], model_info, info=infos[0] if infos else None)
+        return [generated_text]
+    for info in infos or []:
+        info['prefix_cached_tokens'] = 0
+
+    model, tokenizer = load_model(model_info)
+    if model is None:
+        raise RuntimeError("Error loading model.")
+
+    label = model_label(model_info)
+    is_dialogpt = 'dialogpt' in model_info['description']['url'].lower()
+    pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+    with stage_seconds.time(stage='tokenize', model=label):
+        if is_dialogpt:
+            encoded = [token_memo.encode(tokenizer, prompt + tokenizer.eos_token) for prompt in prompts]
+            max_length = DIALOGPT_MAX_LENGTH
+        else:
+            encoded = [token_memo.encode(tokenizer, prompt) for prompt in prompts]
+            max_length = model_info['description']['params'].get('max_length', 50)
+
+    # Left-pad so every prompt ends at the same position and generation continues from it
+    width = max(len(ids) for ids in encoded)
+    input_ids = torch.tensor([[pad_token_id] * (width - len(ids)) + ids for ids in encoded], dtype=torch.long).to(device)
+    attention_mask = torch.tensor([[0] * (width - len(ids)) + [1] * len(ids) for ids in encoded], dtype=torch.long).to(device)
+
+    # max_length counts prompt tokens, so generate for the shortest prompt's budget and
+    # cut every row back to what it would have received on its own
+    max_new_tokens = max(1, max_length - min(len(ids) for ids in encoded))
+    with stage_seconds.time(stage='generate', model=label):
+        if is_dialogpt:
+            output = model.generate(input_ids, attention_mask=attention_mask, max_new_tokens=max_new_tokens, pad_token_id=pad_token_id, stopping_criteria=generation_scheduler.stopping_criteria())
+        else:
+            output = model.generate(
+                input_ids,
+                attention_mask=attention_mask,
+                max_new_tokens=max_new_tokens,
+                pad_token_id=pad_token_id,
+                stopping_criteria=generation_scheduler.stopping_criteria(),
+                **sampling_kwargs(model_info),
+            )
+
+    # Every row shares the job's deadline criteria, so a triggered deadline marks the whole batch
+    for info in infos or []:
+        info['stopped_by_deadline'] = generation_scheduler.stopped_by_deadline()
+
+    generated_texts = []
+    with stage_seconds.time(stage='decode', model=label):
+        for row, ids in zip(output, encoded):
+            new_tokens = row[width:width + max(0, max_length - len(ids))]
+            record_tokens(label, len(ids), len(new_tokens))
+            if is_dialogpt:
+                generated_texts.append(tokenizer.decode(new_tokens, skip_special_tokens=True))
+            else:
+                generated_texts.append(tokenizer.decode(ids + new_tokens.tolist(), skip_special_tokens=True))
+    return generated_texts
+
+# Batched generation that also reports per-prompt generation info: [(generated text, info), ...]
+def generate_text_batch_with_info(prompts, model_info):
+    infos = [{} for _ in prompts]
+    return list(zip(generate_text_batch(prompts, model_info, infos), infos))
+
+generation_batcher = GenerationBatcher(
+    generate_text_batch_with_info,
+    batch_key,
+    max_batch_size=GENERATE_BATCH_MAX_SIZE,
+    max_wait_ms=GENERATE_BATCH_MAX_WAIT_MS,
+    submit_job=lambda job, priority, deadline: generation_scheduler.submit(job, priority=priority, deadline=deadline),
+)
+metrics.callback('generation_batcher_pending', 'Prompts waiting to join a generation batch.', 'gauge', generation_batcher.pending_count)
+
+def is_dialogpt(model_info):
+    return 'dialogpt' in model_info['description']['url'].lower()
+
+# Run one DialoGPT turn inside a server-side conversation. Only the new user tokens (plus the
+# last history token) go through the model; earlier turns come from the cached past_key_values.
+def generate_session_turn(prompt, model_info, conversation_id, streamer=None, stopping_criteria=()):
+    model, tokenizer = load_model(model_info)
+    if model is None:
+        raise RuntimeError("Error loading model.")
+
+    label = model_label(model_info)
+    session = session_store.get((conversation_id, model_registry.resolve(model_info['description']['url'])))
+    with session.lock:
+        with stage_seconds.time(stage='tokenize', model=label):
+            new_user_input_ids = encode_ids(tokenizer, prompt + tokenizer.eos_token)
+        history_ids, trimmed = session_store.trim(session.history_ids, tokenizer.eos_token_id, new_user_input_ids.shape[-1])
+        # Trimming shifts every position, so the cached keys/values no longer line up
+        past_key_values = None if trimmed else session.past_key_values
+        cached_tokens = history_ids.shape[-1] - 1 if past_key_values is not None else 0
+
+        bot_input_ids = torch.cat([history_ids, new_user_input_ids], dim=-1) if history_ids is not None else new_user_input_ids
+        attention_mask = torch.ones(bot_input_ids.shape, dtype=torch.long).to(device)
+        with stage_seconds.time(stage='generate', model=label):
+            output = model.generate(
+                bot_input_ids,
+                attention_mask=attention_mask,
+                past_key_values=past_key_values,
+                max_length=max(DIALOGPT_MAX_LENGTH, bot_input_ids.shape[-1] + 1),
+                pad_token_id=tokenizer.eos_token_id,
+                return_dict_in_generate=True,
+                streamer=streamer,
+                stopping_criteria=generation_scheduler.stopping_criteria() + list(stopping_criteria),
+            )
+
+        chat_history_ids = output.sequences
+        session_store.update(session, chat_history_ids, output.past_key_values)
+        with stage_seconds.time(stage='decode', model=label):
+            generated_text = tokenizer.decode(chat_history_ids[:, bot_input_ids.shape[-1]:][0], skip_special_tokens=True)
+        # Only the uncached part of the prompt goes through the model
+        record_tokens(label, bot_input_ids.shape[-1] - cached_tokens, chat_history_ids.shape[-1] - bot_input_ids.shape[-1])
+        return generated_text, {
+            'conversation_id': conversation_id,
+            'history_tokens': chat_history_ids.shape[-1],
+            'cached_tokens': cached_tokens,
+            'history_trimmed': trimmed,
+        }
+
+# Stream decoded text as model.generate produces tokens. Yields text chunks; the
+# non-streaming formatting of generate_text is applied by the caller on the joined chunks.
+# Closing the generator early (the client went away) drops the job if still queued and stops its decoding.
+def stream_generate_text(prompt, model_info, conversation_id=None, priority='default', deadline=None):
+    model, tokenizer = load_model(model_info)
+    if model is None:
+        raise RuntimeError("Error loading model.")
+
+    from transformers import TextIteratorStreamer
+
+    streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+    cancel = CancelStoppingCriteria()
+    input_ids = None
+    if conversation_id and is_dialogpt(model_info):
+        run = lambda: generate_session_turn(prompt, model_info, conversation_id, streamer=streamer, stopping_criteria=[cancel])
+    elif is_dialogpt(model_info):
+        input_ids = encode_ids(tokenizer, prompt + tokenizer.eos_token)
+        generate_kwargs = {'max_length': DIALOGPT_MAX_LENGTH, 'pad_token_id': tokenizer.eos_token_id}
+    else:
+        input_ids = encode_ids(tokenizer, prompt)
+        generate_kwargs = {'max_length': model_info['description']['params'].get('max_length', 50), **sampling_kwargs(model_info)}
+    if input_ids is not None:
+        attention_mask = torch.ones(input_ids.shape, dtype=torch.long).to(device)
+        run = lambda: generate_with_assistant(model, model_info, input_ids, attention_mask=attention_mask, streamer=streamer, stopping_criteria=generation_scheduler.stopping_criteria() + [cancel], **generate_kwargs)
+
+    errors = []
+    def run_generate():
+        try:
+            with stage_seconds.time(stage='generate_stream', model=model_label(model_info)):
+                run()
+        except Exception as e:
+            errors.append(e)
+            streamer.end()  # Unblock the consumer loop below
+
+    def on_done(job):
+        # A job the scheduler dropped never ran, so the streamer still needs its end signal
+        if job.cancelled() or job.exception() is not None:
+            errors.append(job.exception() if not job.cancelled() else DeadlineExceeded('Request was cancelled.'))
+            streamer.end()
+
+    job = generation_scheduler.submit(run_generate, priority=priority, deadline=deadline)
+    job.add_done_callback(on_done)
+    try:
+        for text in streamer:
+            if text:
+                yield text
+    finally:
+        job.cancel()
+        cancel.cancel()
+    if errors:
+        raise errors[0]
+
+def sse_event(data, event=None):
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data)}\n\n"
+
+# Wrap stream_generate_text as Server-Sent Events: one event per text chunk, then a
+# 'done' event carrying the full response plus time-to-first-token and total time
+def sse_generation(prompt, model_info, started_at, extra=None, conversation_id=None, priority='default', deadline=None):
+    extra = extra or {}
+    if conversation_id and is_dialogpt(model_info):
+        extra = {**extra, 'conversation_id': conversation_id}
+    if extra:
+        yield sse_event(extra, event='start')
+    chunks = []
+    first_token_at = None
+    try:
+        with closing(stream_generate_text(prompt, model_info, conversation_id, priority, deadline)) as texts:
+            for text in texts:
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                chunks.append(text)
+                yield sse_event({'text': text})
+    except Exception as e:
+        logging.error(f"An error occurred: {str(e)}")
+        yield sse_event({'error': f'Text generation error: {str(e)}'}, event='error')
+        return
+
+    generated_text = "".join(chunks)
+    if not is_dialogpt(model_info):
+        generated_text = prompt + generated_text  # Match the non-streaming response, which includes the prompt
+    finished_at = time.perf_counter()
+    yield sse_event({
+        **extra,
+        'generated_text': generated_text,
+        'time_to_first_token_ms': round(((first_token_at or finished_at) - started_at) * 1000, 2),
+        'total_time_ms': round((finished_at - started_at) * 1000, 2),
+    }, event='done')
+
+def sse_response(events):
+    return Response(stream_with_context(events), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# Model /process classifies with, and the model it answers with for each predicted class
+def process_sentiment_model_info():
+    return {
         "description": {
             "url": f"{model_base_path}\\distilbert-base-uncased-finetuned-sst-2-english",
             #"url": os.path.join(model_base_path, "distilbert-base-uncased-finetuned-sst-2-english"),
@@ -175,15 +808,9 @@ def process_content():
         }
     }
 
-    try:
-        predicted_class = classify_text(input_text, sentiment_model_info)  # Removed device parameter
-    except Exception as e:
-        logging.error(f"An error occurred: {str(e)}")
-        return jsonify({"error": f"Classification error: {str(e)}"}), 500
-
-    # Determine which model to use based on the predicted class
+def process_response_model_info(predicted_class):
     if predicted_class == 1:  # Assuming 1 means positive sentiment
-        response_model_info = {
+        return {
             "description": {
                 #"url": os.path.join(model_base_path, "DialoGPT-medium"),
                 "url": f"{model_base_path}\\DialoGPT-medium",
@@ -200,7 +827,7 @@ def process_content():
             }
         }
     else:  # For negative or neutral sentiment
-        response_model_info = {
+        return {
             "description": {
                 #"url": os.path.join(model_base_path, "gpt2"),
                 "url": f"{model_base_path}\\gpt2",
@@ -214,43 +841,414 @@ def process_content():
             }
         }
 
+# Sentiment for /process: the fast router when it is confident, DistilBERT otherwise.
+# Returns (predicted_class, stage) with stage 'fast' or 'model'.
+def route_sentiment(input_text, sentiment_model_info, use_cache, priority, deadline):
+    if FAST_ROUTER_ENABLED:
+        with stage_seconds.time(stage='route_fast', model=fast_router.source):
+            predicted_class, _ = fast_router.route(input_text)
+        if predicted_class is not None:
+            fast_router.record('fast')
+            if random.random() < FAST_ROUTER_SHADOW_RATE:
+                # Check the fast decision against DistilBERT off the request path
+                def record_shadow(done):
+                    if done.exception() is None:
+                        fast_router.record_shadow(predicted_class, done.result())
+                generation_scheduler.submit(classify_text, input_text, sentiment_model_info, use_cache, priority='background').add_done_callback(record_shadow)
+            return predicted_class, 'fast'
+        fast_router.record('model')
+
+    with stage_seconds.time(stage='process_classify', model=model_label(sentiment_model_info)):
+        return generation_scheduler.run(classify_text, input_text, sentiment_model_info, use_cache, priority=priority, deadline=deadline), 'model'
+
+def handle_process(data, started_at):
+    if not isinstance(data, dict):
+        return {"error": "Request body must be a JSON object"}, 400
+    input_text = data.get('text')
+    conversation_id = data.get('conversation_id')
+
+    if not input_text:
+        return {"error": "Input text is required"}, 400
+    try:
+        priority, deadline = request_schedule(data)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+
+    # First classify the text using DistilBERT
+    sentiment_model_info = process_sentiment_model_info()
+
+    try:
+        predicted_class, router_stage = route_sentiment(input_text, sentiment_model_info, request_uses_cache(data), priority, deadline)
+    except DeadlineExceeded:
+        return DEADLINE_ERROR, 504
+    except Exception as e:
+        logging.error(f"An error occurred: {str(e)}")
+        return {"error": f"Classification error: {str(e)}"}, 500
+
+    # Determine which model to use based on the predicted class
+    response_model_info = process_response_model_info(predicted_class)
+
+    if data.get('stream'):
+        return sse_generation(input_text, response_model_info, started_at, {'input': input_text, 'predicted_class': predicted_class, 'router_stage': router_stage}, conversation_id, priority, deadline), 200
+
     # Generate text using the appropriate model
     try:
-        generated_text, chat_history_ids = generate_text(input_text, response_model_info)  # Removed device parameter
-        return jsonify({
+        session_info = {}
+        with stage_seconds.time(stage='process_generate', model=model_label(response_model_info)):
+            if conversation_id and is_dialogpt(response_model_info):
+                generated_text, session_info = generation_scheduler.run(generate_session_turn, input_text, response_model_info, conversation_id, priority=priority, deadline=deadline)
+            else:
+                generation_info = {}
+                generated_text, session_info = cached_generate_text(
+                    input_text, response_model_info, request_uses_cache(data),
+                    lambda: (generation_scheduler.run(generate_text, input_text, response_model_info, info=generation_info, priority=priority, deadline=deadline)[0], generation_info),
+                )
+                session_info['prefix_cached_tokens'] = generation_info.get('prefix_cached_tokens', 0)
+        return {
             "input": input_text,
             "predicted_class": predicted_class,
-            "generated_text": generated_text
-        }), 200
+            "router_stage": router_stage,
+            "generated_text": generated_text,
+            **session_info
+        }, 200
+    except DeadlineExceeded:
+        return DEADLINE_ERROR, 504
     except Exception as e:
         logging.error(f"An error occurred: {str(e)}")
-        return jsonify({"error": f"Text generation error: {str(e)}"}), 500
+        return {"error": f"Text generation error: {str(e)}"}, 500
 
-@app.route('/generate', methods=['POST'])
-def generate_content():
+# /process for a list of messages. Messages the fast router is sure of start generating while DistilBERT
+# classifies the rest in one batch; each group of messages routed to the same response model is then
+# generated in padded chunks of GENERATE_BATCH_MAX_SIZE, one scheduler job per chunk.
+# Returns (results in input order, [(future, indices, response model info)] for the chunks still running).
+def start_bulk_process(texts, use_cache, priority, deadline):
+    results = [{'input': text} for text in texts]
+    jobs = []
+
+    def submit_groups(indices):
+        groups = {}
+        for index in indices:
+            groups.setdefault(results[index]['predicted_class'], []).append(index)
+        for predicted_class, members in groups.items():
+            response_model_info = process_response_model_info(predicted_class)
+            pending = []
+            for index in members:
+                key = generation_cache_key(texts[index], response_model_info) if use_cache else None
+                cached = response_cache.get(key) if key is not None else None
+                if cached is not None:
+                    results[index].update(generated_text=cached, cached=True, prefix_cached_tokens=0)
+                else:
+                    pending.append(index)
+            for start in range(0, len(pending), GENERATE_BATCH_MAX_SIZE):
+                chunk = pending[start:start + GENERATE_BATCH_MAX_SIZE]
+                future = generation_scheduler.submit(generate_text_batch_with_info, [texts[i] for i in chunk], response_model_info, priority=priority, deadline=deadline)
+                jobs.append((future, chunk, response_model_info))
+
+    undecided = list(range(len(texts)))
+    if FAST_ROUTER_ENABLED:
+        undecided = []
+        with stage_seconds.time(stage='route_fast', model=fast_router.source):
+            routed = [fast_router.route(text)[0] for text in texts]
+        for index, predicted_class in enumerate(routed):
+            if predicted_class is None:
+                fast_router.record('model')
+                undecided.append(index)
+            else:
+                fast_router.record('fast')
+                results[index].update(predicted_class=predicted_class, router_stage='fast')
+        submit_groups([index for index, predicted_class in enumerate(routed) if predicted_class is not None])
+
+    if undecided:
+        sentiment_model_info = process_sentiment_model_info()
+        try:
+            with stage_seconds.time(stage='process_classify', model=model_label(sentiment_model_info)):
+                classified = generation_scheduler.run(classify_texts, [texts[i] for i in undecided], sentiment_model_info, None, use_cache, priority=priority, deadline=deadline)
+        except Exception:
+            # The request fails as a whole, so the fast-routed chunks already queued would only hold up others
+            for future, _, _ in jobs:
+                future.cancel()
+            raise
+        for index, result in zip(undecided, classified):
+            results[index].update(predicted_class=result['predicted_class'], router_stage='model')
+        submit_groups(undecided)
+    return results, jobs
+
+def finish_bulk_chunk(results, texts, future, chunk, response_model_info, use_cache, cutoff):
+    # Fill in one finished chunk's results; a failed chunk marks only its own messages.
+    # A reply the deadline cut short is returned but not cached.
+    try:
+        with stage_seconds.time(stage='process_generate', model=model_label(response_model_info)):
+            outputs = wait_until(future, cutoff)
+    except DeadlineExceeded:
+        error = DEADLINE_ERROR['error']
+    except Exception as e:
+        logging.error(f"An error occurred: {str(e)}")
+        error = f"Text generation error: {str(e)}"
+    else:
+        for index, (generated_text, info) in zip(chunk, outputs):
+            complete = not info.pop('stopped_by_deadline', False)
+            results[index].update(generated_text=generated_text, cached=False, **info)
+            key = generation_cache_key(texts[index], response_model_info) if use_cache else None
+            if key is not None and complete:
+                response_cache.put(key, generated_text)
+        return
+    for index in chunk:
+        results[index]['error'] = error
+
+def bulk_summary(results):
+    groups = {}
+    for result in results:
+        if 'predicted_class' in result:
+            name = model_label(process_response_model_info(result['predicted_class']))
+            groups[name] = groups.get(name, 0) + 1
+    return {'count': len(results), 'groups': groups, 'errors': sum('error' in result for result in results)}
+
+def handle_process_bulk(data, started_at):
+    if not isinstance(data, dict):
+        return {"error": "Request body must be a JSON object"}, 400
+    texts = data.get('texts')
+    if not isinstance(texts, list) or not texts or not all(isinstance(text, str) and text for text in texts):
+        return {"error": "texts must be a non-empty list of non-empty strings"}, 400
+    if len(texts) > BULK_PROCESS_MAX_MESSAGES:
+        return {"error": f"At most {BULK_PROCESS_MAX_MESSAGES} messages per request"}, 400
+    try:
+        priority, deadline = request_schedule(data)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    use_cache = request_uses_cache(data)
+
+    try:
+        results, jobs = start_bulk_process(texts, use_cache, priority, deadline)
+    except DeadlineExceeded:
+        return DEADLINE_ERROR, 504
+    except Exception as e:
+        logging.error(f"An error occurred: {str(e)}")
+        return {"error": f"Classification error: {str(e)}"}, 500
+
+    if data.get('stream'):
+        return sse_bulk_process(texts, results, jobs, use_cache, started_at, deadline), 200
+
+    cutoff = grace_cutoff(deadline)
+    for future, chunk, response_model_info in jobs:
+        finish_bulk_chunk(results, texts, future, chunk, response_model_info, use_cache, cutoff)
+    return {'results': results, **bulk_summary(results), 'total_time_ms': round((time.perf_counter() - started_at) * 1000, 2)}, 200
+
+# Server-Sent Events for /process/bulk: a 'result' event per message, tagged with its index, as soon as
+# its chunk finishes (cache hits first), then a 'done' event with the per-model counts
+def sse_bulk_process(texts, results, jobs, use_cache, started_at, deadline):
+    running = {future: (chunk, response_model_info) for future, chunk, response_model_info in jobs}
+    waiting = {index for chunk, _ in running.values() for index in chunk}
+    for index, result in enumerate(results):
+        if index not in waiting:
+            yield sse_event({'index': index, **result}, event='result')
+
+    cutoff = grace_cutoff(deadline)
+    remaining = set(running)
+    while remaining:
+        timeout = None if cutoff is None else max(0.0, cutoff - time.monotonic())
+        done, remaining = concurrent.futures.wait(remaining, timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED)
+        # Past the cutoff every chunk still running is finished as expired, without waiting any longer
+        for future in (done or set(remaining)):
+            chunk, response_model_info = running[future]
+            finish_bulk_chunk(results, texts, future, chunk, response_model_info, use_cache, cutoff)
+            for index in chunk:
+                yield sse_event({'index': index, **results[index]}, event='result')
+        if not done:
+            break
+
+    yield sse_event({**bulk_summary(results), 'total_time_ms': round((time.perf_counter() - started_at) * 1000, 2)}, event='done')
+
+def handle_generate(data, started_at):
     logging.info("generating content...")
     try:
         # Extract input data from request
-        data = request.json
         if not data or 'text' not in data or 'model' not in data:
-            return jsonify({'error': 'Missing required fields: text or model'}), 400
+            return {'error': 'Missing required fields: text or model'}, 400
 
         # Extract model information
         model_info = data.get('model', {})
         model_id = model_info.get('id', None)
+        conversation_id = data.get('conversation_id')
+        try:
+            priority, deadline = request_schedule(data)
+        except ValueError as e:
+            return {'error': str(e)}, 400
+
+        # Opt-in token streaming as Server-Sent Events; the JSON response stays the default
+        if data.get('stream'):
+            return sse_generation(data['text'], model_info, started_at, conversation_id=conversation_id, priority=priority, deadline=deadline), 200
 
-        # Generate text using the specified model
-        generated_text, _ = generate_text(data['text'], model_info)  # Removed device parameter
+        # DialoGPT conversations keep their history and KV cache server-side between turns
+        if conversation_id and is_dialogpt(model_info):
+            generated_text, session_info = generation_scheduler.run(generate_session_turn, data['text'], model_info, conversation_id, priority=priority, deadline=deadline)
+            logging.info(f"generated_text: {generated_text}")
+            return {'generated_text': generated_text, 'batch_size': 1, **session_info}, 200
+
+        seed = model_info.get('description', {}).get('params', {}).get('seed')
+        if seed is not None and (not isinstance(seed, int) or isinstance(seed, bool)):
+            return {'error': 'seed must be an integer.'}, 400
+
+        # Generate text using the specified model, sharing a forward pass with concurrent requests.
+        # A profiled or seeded request runs on its own: its trace or RNG state covers only its own work.
+        batch_size = 1
+        generation_info = {}
+        def generate():
+            nonlocal batch_size
+            if GENERATE_BATCHING and profiling.current() is None and seed is None:
+                (generated_text, info), batch_size = wait_for(generation_batcher.submit(data['text'], model_info, group=priority, deadline=deadline), deadline)
+                generation_info.update(info)
+                return generated_text, generation_info
+            return generation_scheduler.run(generate_text, data['text'], model_info, info=generation_info, priority=priority, deadline=deadline)[0], generation_info
+        generated_text, cache_info = cached_generate_text(data['text'], model_info, request_uses_cache(data), generate)
 
         logging.info(f"generated_text: {generated_text}")
         #logging.info("generated_text:\n" + "-" * 50 + "\n" + generated_text + "\n" + "-" * 50)
-        return jsonify({'generated_text': generated_text}), 200
+        return {
+            'generated_text': generated_text,
+            'batch_size': 0 if cache_info['cached'] else batch_size,
+            'prefix_cached_tokens': generation_info.get('prefix_cached_tokens', 0),
+            **cache_info,
+        }, 200
 
+    except ModelNotAllowedError as e:
+        return {'error': str(e)}, 403
+    except DeadlineExceeded:
+        return DEADLINE_ERROR, 504
     except Exception as e:
         logging.error(f"An error occurred: {str(e)}")
-        return jsonify({'error': f'Internal Server Error: {str(e)}'}), 500
+        return {'error': f'Internal Server Error: {str(e)}'}, 500
+
+def to_flask_response(result):
+    payload, status = result
+    if isinstance(payload, dict):
+        return jsonify(payload), status
+    return sse_response(payload)
+
+@app.before_request
+def start_request_timer():
+    g.request_started_at = time.perf_counter()
+    g.profile_capture = None
+    if request.url_rule is not None and request.url_rule.rule in PROFILED_ROUTES:
+        g.profile_capture = request_profiler.begin(request.url_rule.rule, request.headers.get(PROFILE_HEADER))
+
+@app.after_request
+def observe_request(response):
+    if request.url_rule is None or request.url_rule.rule in ('/metrics', '/healthz', '/readyz'):
+        return response
+    route, status = request.url_rule.rule, response.status_code
+    request_seconds.observe(time.perf_counter() - g.request_started_at, route=route, status=status)
+
+    # Profiles and the slow-request check cover the whole response, including a streamed body
+    started_at, capture = g.request_started_at, g.profile_capture
+    def on_close():
+        latency_ms = (time.perf_counter() - started_at) * 1000
+        if capture is not None:
+            request_profiler.end(capture, status, latency_ms)
+        elif route in PROFILED_ROUTES:
+            request_profiler.observe(route, latency_ms)
+    response.call_on_close(on_close)
+    if capture is not None:
+        response.headers['X-Profile-Id'] = capture.id
+    return response
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    # Liveness only: the process is up and serving, whether or not models are warm yet
+    return jsonify({'status': 'ok', 'pid': os.getpid()}), 200
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    payload, status = readiness()
+    return jsonify(payload), status
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+@app.route('/classify', methods=['POST'])
+def classify_content():
+    return to_flask_response(handle_classify(request.json))
+
+@app.route('/process', methods=['POST'])
+def process_content():
+    return to_flask_response(handle_process(request.json, time.perf_counter()))
+
+@app.route('/process/bulk', methods=['POST'])
+def process_bulk_content():
+    return to_flask_response(handle_process_bulk(request.json, time.perf_counter()))
+
+@app.route('/generate', methods=['POST'])
+def generate_content():
+    return to_flask_response(handle_generate(request.json, time.perf_counter()))
+
+@app.route('/profiles', methods=['GET'])
+def list_profiles():
+    return jsonify({'enabled': request_profiler.enabled, 'profiles': request_profiler.store.list()}), 200
+
+@app.route('/profiles/<profile_id>/<filename>', methods=['GET'])
+def download_profile(profile_id, filename):
+    path = request_profiler.store.file_path(profile_id, filename)
+    if path is None:
+        abort(404)
+    return send_file(path, as_attachment=True, download_name=f'{profile_id}-{filename}')
+
+def cache_stats():
+    return {
+        **response_cache.stats(),
+        'semantic': {'enabled': SEMANTIC_CACHE_ENABLED, **semantic_cache.stats()},
+        'prefix': {'enabled': PREFIX_CACHE_ENABLED, **prefix_cache.stats()},
+        'tokens': {'fast_tokenizers': FAST_TOKENIZERS, **token_memo.stats()},
+    }
+
+@app.route('/cache', methods=['GET'])
+def response_cache_stats():
+    return jsonify(cache_stats()), 200
+
+@app.route('/cache', methods=['DELETE'])
+def clear_response_cache():
+    response_cache.clear()
+    semantic_cache.clear()
+    prefix_cache.clear()
+    token_memo.clear()
+    return jsonify(cache_stats()), 200
+
+@app.route('/router', methods=['GET'])
+def router_stats():
+    # Share of /process traffic decided by each stage, and shadow disagreement of the fast stage
+    return jsonify({'enabled': FAST_ROUTER_ENABLED, 'shadow_rate': FAST_ROUTER_SHADOW_RATE, **fast_router.stats()}), 200
+
+@app.route('/assisted', methods=['GET'])
+def assisted_stats():
+    return jsonify({'enabled': ASSISTED_DECODING_ENABLED, 'pairs': assisted_decoding.stats()}), 200
+
+@app.route('/models', methods=['GET'])
+def model_stats():
+    return jsonify(model_registry.stats()), 200
+
+@app.route('/scheduler', methods=['GET'])
+def scheduler_stats():
+    # Per priority class: queue wait, drops for expired deadlines and mid-decode stops
+    return jsonify(generation_scheduler.stats()), 200
+
+@app.route('/memory', methods=['GET'])
+def worker_memory():
+    # Unique vs shared resident memory of the worker answering this request
+    return jsonify(memory_report()), 200
+
+@app.route('/sessions/<conversation_id>', methods=['DELETE'])
+def delete_session(conversation_id):
+    deleted = session_store.drop_conversation(conversation_id)
+    return jsonify({'conversation_id': conversation_id, 'deleted': deleted}), 200
+
+@app.route('/sessions', methods=['GET'])
+def session_stats():
+    return jsonify(session_store.stats()), 200
+
+IMPORT_SECONDS = round(time.perf_counter() - IMPORT_STARTED_AT, 3)
+logging.info(f"Inference app imported in {IMPORT_SECONDS:.2f}s.")
 
 if __name__ == '__main__':
+    warmup.start()
     app.run(
         debug=True,
         use_reloader=False,
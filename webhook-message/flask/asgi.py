@@ -0,0 +1,225 @@
+# Asyncio (ASGI) front-end for the inference API. Serves the same /generate, /classify and
+# /process contracts as the Flask app, but model calls run on a bounded thread pool behind an
+# admission controller, so overload is rejected fast instead of stalling everything queued.
+#
+#   uvicorn asgi:application --host 0.0.0.0 --port 5000
+import asyncio
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import app as inference
+
+ASGI_MAX_IN_FLIGHT = int(os.environ.get('ASGI_MAX_IN_FLIGHT', '8'))  # Model calls running at once
+ASGI_MAX_QUEUE = int(os.environ.get('ASGI_MAX_QUEUE', '32'))  # Requests allowed to wait for a slot
+ASGI_QUEUE_TIMEOUT_S = float(os.environ.get('ASGI_QUEUE_TIMEOUT_S', '10'))  # Longest wait for a slot
+ASGI_RETRY_AFTER_S = int(os.environ.get('ASGI_RETRY_AFTER_S', '2'))
+
+
+class Rejected(Exception):
+    def __init__(self, status, reason):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+
+
+class AdmissionController:
+    """Caps concurrent model calls and the queue in front of them.
+
+    A request arriving when every slot is busy and the queue is full gets 429 immediately;
+    a queued request that can't get a slot within the queue timeout gets 503.
+    """
+
+    def __init__(self, max_in_flight, max_queue, queue_timeout):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+        self._semaphore = None
+
+    async def acquire(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        if self._semaphore.locked() and self.waiting >= self.max_queue:
+            self.rejected_queue_full += 1
+            raise Rejected(429, 'Too many requests queued, retry later.')
+
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected_timeout += 1
+            raise Rejected(503, 'Server overloaded, retry later.')
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        self.admitted += 1
+
+    def release(self):
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    def stats(self):
+        return {
+            'in_flight': self.in_flight,
+            'waiting': self.waiting,
+            'max_in_flight': self.max_in_flight,
+            'max_queue': self.max_queue,
+            'admitted': self.admitted,
+            'rejected_queue_full': self.rejected_queue_full,
+            'rejected_timeout': self.rejected_timeout,
+        }
+
+
+admission = AdmissionController(ASGI_MAX_IN_FLIGHT, ASGI_MAX_QUEUE, ASGI_QUEUE_TIMEOUT_S)
+executor = ThreadPoolExecutor(max_workers=ASGI_MAX_IN_FLIGHT, thread_name_prefix='inference')
+
+INFERENCE_ROUTES = {
+    '/classify': lambda data, started_at: inference.handle_classify(data),
+    '/generate': inference.handle_generate,
+    '/process': inference.handle_process,
+    '/process/bulk': inference.handle_process_bulk,
+}
+
+STATUS_ROUTES = {
+    '/models': inference.model_registry.stats,
+    '/sessions': inference.session_store.stats,
+    '/scheduler': inference.generation_scheduler.stats,
+    '/cache': inference.cache_stats,
+    '/assisted': lambda: {'enabled': inference.ASSISTED_DECODING_ENABLED, 'pairs': inference.assisted_decoding.stats()},
+    '/router': lambda: {'enabled': inference.FAST_ROUTER_ENABLED, 'shadow_rate': inference.FAST_ROUTER_SHADOW_RATE, **inference.fast_router.stats()},
+    '/memory': inference.memory_report,
+    '/admission': admission.stats,
+}
+
+
+async def read_json(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            break
+    return json.loads(body) if body else None
+
+
+async def send_json(send, payload, status, headers=()):
+    body = json.dumps(payload).encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode()), *headers],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def send_events(send, receive, events, loop):
+    # Pull each SSE chunk from the (blocking) generator on the executor and forward it. When the client
+    # disconnects or a send fails, the generator is closed, which cancels its generation job.
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache'), (b'x-accel-buffering', b'no')],
+    })
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    finished = object()
+    pending = None
+    try:
+        while True:
+            pending = loop.run_in_executor(executor, next, events, finished)
+            await asyncio.wait({pending, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+            if not pending.done():
+                logging.info("Client disconnected, stopping its event stream.")
+                return
+            chunk, pending = pending.result(), None
+            if chunk is finished:
+                break
+            await send({'type': 'http.response.body', 'body': chunk.encode(), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        disconnected.cancel()
+        if pending is not None:
+            await asyncio.wait({pending})  # A generator can only be closed once its running next() returns
+        events.close()
+
+
+async def handle_inference(scope, receive, send, handler):
+    started_at = time.perf_counter()
+    try:
+        data = await read_json(receive)
+    except ValueError:
+        await send_json(send, {'error': 'Request body must be JSON.'}, 400)
+        return
+
+    try:
+        await admission.acquire()
+    except Rejected as e:
+        logging.warning(f"Rejected {scope['path']} with {e.status}: {e.reason}")
+        await send_json(send, {'error': e.reason}, e.status, [(b'retry-after', str(ASGI_RETRY_AFTER_S).encode())])
+        return
+
+    loop = asyncio.get_running_loop()
+    try:
+        payload, status = await loop.run_in_executor(executor, handler, data, started_at)
+        inference.request_seconds.observe(time.perf_counter() - started_at, route=scope['path'], status=status)
+        if isinstance(payload, dict):
+            await send_json(send, payload, status)
+        else:
+            await send_events(send, receive, payload, loop)  # The slot stays held until the stream finishes
+    finally:
+        admission.release()
+
+
+async def handle_lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            inference.warmup.start()
+            logging.info(f"ASGI front-end ready: {ASGI_MAX_IN_FLIGHT} in flight, queue depth {ASGI_MAX_QUEUE}.")
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            executor.shutdown(wait=False, cancel_futures=True)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await handle_lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    path, method = scope['path'], scope['method']
+    if method == 'POST' and path in INFERENCE_ROUTES:
+        await handle_inference(scope, receive, send, INFERENCE_ROUTES[path])
+    elif method == 'GET' and path == '/healthz':
+        await send_json(send, {'status': 'ok', 'pid': os.getpid()}, 200)
+    elif method == 'GET' and path == '/readyz':
+        payload, status = inference.readiness()
+        await send_json(send, payload, status)
+    elif method == 'GET' and path in STATUS_ROUTES:
+        await send_json(send, STATUS_ROUTES[path](), 200)
+    elif method == 'GET' and path == '/metrics':
+        body = inference.metrics.render().encode()
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [(b'content-type', inference.METRICS_CONTENT_TYPE.encode())]})
+        await send({'type': 'http.response.body', 'body': body})
+    else:
+        await send_json(send, {'error': 'Not Found'}, 404)
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    uvicorn.run(application, host='0.0.0.0', port=int(os.environ.get('PORT', '5000')))
@@ -0,0 +1,170 @@
+import copy
+import random
+import threading
+import weakref
+
+import torch
+from torch import nn
+
+_local = threading.local()
+_counted_lock = threading.Lock()
+_truncated = weakref.WeakKeyDictionary()  # target model -> {layers: draft}
+_truncated_lock = threading.Lock()
+
+
+def truncated_draft(model, layers):
+    """Draft model made of the target's first ``layers`` transformer blocks.
+
+    Embeddings, blocks, final norm and LM head are the target's own modules, so the draft costs no
+    extra weight memory and always shares its tokenizer. GPT-2 layout only (gpt2, DialoGPT).
+    """
+    transformer = getattr(model, 'transformer', None)
+    if transformer is None or not hasattr(transformer, 'h'):
+        raise ValueError(f"Cannot truncate {type(model).__name__}: expected a GPT-2 style model.")
+    layers = int(layers)
+    if not 0 < layers < len(transformer.h):
+        raise ValueError(f"Draft layers must be between 1 and {len(transformer.h) - 1}.")
+
+    with _truncated_lock:
+        drafts = _truncated.setdefault(model, {})
+        if layers not in drafts:
+            config = copy.deepcopy(model.config)
+            config.n_layer = layers
+            with torch.device('meta'):
+                draft = type(model)(config)
+            draft.transformer.wte = transformer.wte
+            draft.transformer.wpe = transformer.wpe
+            draft.transformer.drop = transformer.drop
+            draft.transformer.h = nn.ModuleList(transformer.h[:layers])
+            draft.transformer.ln_f = transformer.ln_f
+            draft.lm_head = model.lm_head
+            draft.generation_config = copy.deepcopy(model.generation_config)
+            drafts[layers] = draft.eval()
+        return drafts[layers]
+
+
+def draft_view(draft, num_assistant_tokens=None):
+    """``draft`` with a GenerationConfig of its own, for one assisted generate call.
+
+    transformers reads num_assistant_tokens from the draft's generation_config and writes the
+    target's eos and its adjusted token count back to it, so concurrent calls must not share one.
+    The view is a shallow copy: weights, submodules and hooks stay the draft's own.
+    """
+    view = copy.copy(draft)
+    view.generation_config = copy.deepcopy(draft.generation_config)
+    if num_assistant_tokens:
+        view.generation_config.num_assistant_tokens = int(num_assistant_tokens)
+    return view
+
+
+def _count_forward(module, args, output):
+    counts = getattr(_local, 'counts', None)
+    if counts is not None and id(module) in counts:
+        counts[id(module)] += 1
+
+
+class count_forwards:
+    """Counts forward passes of the given models made on this thread while the block runs.
+
+    The hook stays installed (other threads' passes are ignored), so concurrent scheduler workers
+    never see hooks added or removed under them. A draft_view shares its draft's hooks, so it finds
+    the hook already there.
+    """
+
+    def __init__(self, *models):
+        self.models = models
+        self.counts = {}
+
+    def __enter__(self):
+        with _counted_lock:
+            for model in self.models:
+                if _count_forward not in model._forward_hooks.values():
+                    model.register_forward_hook(_count_forward)
+        self.counts = {id(model): 0 for model in self.models}
+        _local.counts = self.counts
+        return self
+
+    def __exit__(self, *exc):
+        _local.counts = None
+        return False
+
+    def __getitem__(self, model):
+        return self.counts[id(model)]
+
+
+class _Pair:
+    __slots__ = ('assisted', 'plain', 'drafted', 'accepted', 'assisted_tps', 'plain_tps')
+
+    def __init__(self):
+        self.assisted = 0
+        self.plain = 0
+        self.drafted = 0
+        self.accepted = 0
+        self.assisted_tps = None  # Exponential moving averages of generated tokens/s
+        self.plain_tps = None
+
+
+def _ewma(previous, value, alpha=0.2):
+    return value if previous is None else previous + alpha * (value - previous)
+
+
+class AssistedDecoding:
+    """Decides per (target, draft) pair whether a generate call uses the draft model, and keeps the
+    acceptance rate and tokens/s of assisted and plain decoding.
+
+    A ``probe_rate`` share of calls takes the other path so both tokens/s figures stay current.
+    After ``min_samples`` assisted calls, a pair whose acceptance rate is below ``min_acceptance``
+    or whose assisted tokens/s is not above plain falls back to plain decoding, apart from probes.
+    """
+
+    def __init__(self, min_acceptance=0.3, min_samples=5, probe_rate=0.1):
+        self.min_acceptance = min_acceptance
+        self.min_samples = min_samples
+        self.probe_rate = probe_rate
+        self._pairs = {}
+        self._lock = threading.Lock()
+
+    def _worth_it(self, pair):
+        if pair.assisted < self.min_samples:
+            return True
+        if pair.drafted and pair.accepted / pair.drafted < self.min_acceptance:
+            return False
+        return pair.plain_tps is None or pair.assisted_tps > pair.plain_tps
+
+    def use_assistant(self, key):
+        with self._lock:
+            pair = self._pairs.setdefault(key, _Pair())
+            worth_it = self._worth_it(pair)
+        return worth_it != (random.random() < self.probe_rate)
+
+    def record(self, key, new_tokens, seconds, drafted=None, target_passes=None):
+        # drafted: draft forward passes (one per proposed token); target_passes: verification passes,
+        # each of which keeps the accepted draft tokens plus one token of the target's own
+        tokens_per_s = new_tokens / seconds if seconds > 0 else 0.0
+        with self._lock:
+            pair = self._pairs.setdefault(key, _Pair())
+            if drafted is None:
+                pair.plain += 1
+                pair.plain_tps = _ewma(pair.plain_tps, tokens_per_s)
+                return
+            pair.assisted += 1
+            pair.assisted_tps = _ewma(pair.assisted_tps, tokens_per_s)
+            pair.drafted += drafted
+            pair.accepted += min(drafted, max(0, new_tokens - target_passes))
+
+    def stats(self):
+        with self._lock:
+            report = {}
+            for (target, draft), pair in self._pairs.items():
+                report[f'{target} <- {draft}'] = {
+                    'active': self._worth_it(pair),
+                    'assisted_calls': pair.assisted,
+                    'plain_calls': pair.plain,
+                    'drafted_tokens': pair.drafted,
+                    'accepted_tokens': pair.accepted,
+                    'acceptance_rate': round(pair.accepted / pair.drafted, 4) if pair.drafted else 0.0,
+                    'assisted_tokens_per_s': round(pair.assisted_tps, 2) if pair.assisted_tps is not None else None,
+                    'plain_tokens_per_s': round(pair.plain_tps, 2) if pair.plain_tps is not None else None,
+                    'speedup': round(pair.assisted_tps / pair.plain_tps, 3) if pair.assisted_tps and pair.plain_tps else None,
+                }
+            return report
@@ -0,0 +1,127 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+
+
+class _PendingPrompt:
+    __slots__ = ('prompt', 'model_info', 'deadline', 'future', 'enqueued_at')
+
+    def __init__(self, prompt, model_info, deadline):
+        self.prompt = prompt
+        self.model_info = model_info
+        self.deadline = deadline
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class GenerationBatcher:
+    """Collects concurrent prompts for a short window and runs them as one padded batch.
+
+    Prompts are grouped by ``key_fn(model_info)`` (and the caller's group, e.g. priority class)
+    so only requests for the same model with compatible sampling params share a ``generate``
+    call. ``run_batch(prompts, model_info)`` must return one output per prompt, in order.
+    ``submit_job(job, group, deadline)``, when given, hands each formed batch to an executor such
+    as a scheduler instead of running it on the dispatcher thread.
+    """
+
+    def __init__(self, run_batch, key_fn, max_batch_size=8, max_wait_ms=20, submit_job=None):
+        self.run_batch = run_batch
+        self.key_fn = key_fn
+        self.submit_job = submit_job
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+
+        self._pending = {}  # key -> list of _PendingPrompt, oldest first
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pid = None
+
+    def submit(self, prompt, model_info, group=None, deadline=None):
+        # Returns a Future resolving to (output, batch_size); cancel it to drop the prompt before it runs
+        item = _PendingPrompt(prompt, model_info, deadline)
+        key = (group, self.key_fn(model_info))
+        with self._cond:
+            self._ensure_started()
+            self._pending.setdefault(key, []).append(item)
+            self._cond.notify()
+        return item.future
+
+    def pending_count(self):
+        with self._cond:
+            return sum(len(items) for items in self._pending.values())
+
+    def _ensure_started(self):
+        # Threads do not survive fork(), so (re)start the dispatcher lazily per process
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._dispatch_loop, name='generation-batcher', daemon=True)
+        self._thread.start()
+
+    def _take_ready_batch(self):
+        # Returns (key, items) for the first group that is full or has waited long enough,
+        # otherwise (None, seconds until the next group becomes due)
+        now = time.monotonic()
+        next_due = None
+        for key, items in self._pending.items():
+            due_at = items[0].enqueued_at + self.max_wait
+            if len(items) >= self.max_batch_size or due_at <= now:
+                batch = items[:self.max_batch_size]
+                remaining = items[self.max_batch_size:]
+                if remaining:
+                    self._pending[key] = remaining
+                else:
+                    del self._pending[key]
+                return key, batch
+            next_due = due_at if next_due is None else min(next_due, due_at)
+        return None, (None if next_due is None else max(0.0, next_due - now))
+
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                key, batch = self._take_ready_batch()
+                while key is None:
+                    self._cond.wait(timeout=batch)
+                    key, batch = self._take_ready_batch()
+            self._execute(key[0], batch)
+
+    def _execute(self, group, batch):
+        def job():
+            # Callers that gave up (cancelled futures) are left out of the forward pass
+            live = [item for item in batch if item.future.set_running_or_notify_cancel()]
+            if not live:
+                return
+            try:
+                outputs = self.run_batch([item.prompt for item in live], live[0].model_info)
+            except Exception as e:
+                logging.error(f"Batched generation failed for {len(live)} prompt(s): {str(e)}")
+                for item in live:
+                    item.future.set_exception(e)
+                return
+
+            logging.info(f"Generated batch of {len(live)} prompt(s).")
+            for item, output in zip(live, outputs):
+                item.future.set_result((output, len(live)))
+
+        if self.submit_job is None:
+            job()
+            return
+        # The batch may run until its latest caller's deadline; a dropped batch fails every prompt
+        deadlines = [item.deadline for item in batch]
+        deadline = None if None in deadlines else max(deadlines)
+        future = self.submit_job(job, group, deadline)
+        future.add_done_callback(lambda done: self._fail_unresolved(batch, done))
+
+    @staticmethod
+    def _fail_unresolved(batch, done):
+        exception = None if done.cancelled() else done.exception()
+        if exception is None:
+            return
+        for item in batch:
+            if not item.future.done():
+                try:
+                    item.future.set_exception(exception)
+                except InvalidStateError:
+                    pass
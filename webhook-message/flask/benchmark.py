@@ -0,0 +1,300 @@
+# Inference benchmark against tiny, randomly initialised stand-ins for GPT-2 and DistilBERT, so it
+# runs anywhere without network access or a GPU. Drives load_model/classify_text/generate_text
+# directly and the /classify and /generate endpoints through the Flask test client, at fixed
+# concurrency levels, and writes latency percentiles, throughput and peak RSS as JSON.
+#
+#   python benchmark.py --output bench.json
+#   python benchmark.py --output new.json --baseline bench.json   # exits 1 on regression
+#   python benchmark.py --tokenizers --scenarios none              # tokenization cost only
+import argparse
+import json
+import os
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+GPT2_NAME = 'gpt2'
+DISTILBERT_NAME = 'distilbert-base-uncased-finetuned-sst-2-english'
+
+PROMPTS = [
+    "Hello chat, how is everyone", "what game are we playing today", "thanks for the raid",
+    "is the giveaway still open", "that boss fight was brutal", "play the song again",
+    "who is winning", "good morning streamer",
+]
+
+TEXTS = [
+    "gg", "lol", "that was amazing!", "this stream is so boring", "I love this song",
+    "worst play ever", "hi streamer", "can't believe you missed that", "so hyped for the raid",
+    "please stop", "best community on twitch", "ugh lag again",
+]
+
+
+def build_tiny_models(base_path, seed=0):
+    # Same directory names as the allowlisted models, so the app loads them unchanged
+    from transformers import (
+        DistilBertConfig, DistilBertForSequenceClassification, DistilBertTokenizer,
+        GPT2Config, GPT2LMHeadModel, GPT2Tokenizer,
+    )
+    from transformers.models.gpt2.tokenization_gpt2 import bytes_to_unicode
+
+    torch.manual_seed(seed)
+
+    gpt2_path = os.path.join(base_path, GPT2_NAME)
+    os.makedirs(gpt2_path, exist_ok=True)
+    # Printable ASCII only and no merges: every generated token decodes to one character, so
+    # re-encoding the output counts generated tokens exactly
+    byte_encoder = bytes_to_unicode()
+    vocab = {byte_encoder[b]: index for index, b in enumerate(range(32, 127))}
+    vocab['<|endoftext|>'] = len(vocab)
+    with open(os.path.join(gpt2_path, 'vocab.json'), 'w') as f:
+        json.dump(vocab, f)
+    with open(os.path.join(gpt2_path, 'merges.txt'), 'w') as f:
+        f.write('#version: 0.2\n')
+    GPT2Tokenizer(os.path.join(gpt2_path, 'vocab.json'), os.path.join(gpt2_path, 'merges.txt')).save_pretrained(gpt2_path)
+    eos = vocab['<|endoftext|>']
+    config = GPT2Config(vocab_size=len(vocab), n_positions=256, n_embd=64, n_layer=2, n_head=2, bos_token_id=eos, eos_token_id=eos)
+    GPT2LMHeadModel(config).save_pretrained(gpt2_path)
+
+    distilbert_path = os.path.join(base_path, DISTILBERT_NAME)
+    os.makedirs(distilbert_path, exist_ok=True)
+    words = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]'] + list("abcdefghijklmnopqrstuvwxyz0123456789!?.,'")
+    words += ['##' + c for c in 'abcdefghijklmnopqrstuvwxyz']
+    with open(os.path.join(distilbert_path, 'vocab.txt'), 'w') as f:
+        f.write('\n'.join(words) + '\n')
+    DistilBertTokenizer(os.path.join(distilbert_path, 'vocab.txt')).save_pretrained(distilbert_path)
+    config = DistilBertConfig(vocab_size=len(words), dim=64, hidden_dim=128, n_layers=2, n_heads=2, num_labels=2)
+    DistilBertForSequenceClassification(config).save_pretrained(distilbert_path)
+
+
+def model_info(name, **params):
+    return {'description': {'url': f'/app/models/{name}', 'params': params}}
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kB on Linux (bytes on macOS); it is the process-wide peak so far
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def run_level(call, concurrency, requests):
+    # call(i) returns the number of tokens it produced (or consumed, for classification)
+    def timed(i):
+        started = time.perf_counter()
+        tokens = call(i)
+        return (time.perf_counter() - started) * 1000, tokens
+
+    call(0)  # Warm-up: model load and first-call allocations stay out of the numbers
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(timed, range(requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies = [latency for latency, _ in results]
+    tokens = sum(count for _, count in results)
+    return {
+        'concurrency': concurrency,
+        'requests': requests,
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'mean_ms': round(statistics.mean(latencies), 3),
+        'requests_per_s': round(requests / elapsed, 2),
+        'tokens_per_s': round(tokens / elapsed, 2),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def scenarios(inference, max_length):
+    gpt2 = model_info(GPT2_NAME, max_length=max_length)
+    distilbert = model_info(DISTILBERT_NAME)
+    _, gpt2_tokenizer = inference.load_model(gpt2)
+    _, distilbert_tokenizer = inference.load_model(distilbert)
+    client = inference.app.test_client()
+
+    def generated_tokens(prompt, output):
+        return max(0, len(gpt2_tokenizer.encode(output)) - len(gpt2_tokenizer.encode(prompt)))
+
+    def input_tokens(text):
+        return len(distilbert_tokenizer.encode(text))
+
+    # The response cache would answer every repeat of TEXTS, so the classification scenarios bypass it;
+    # 'classify_text (cache hit)' times the cache on its own
+    def classify_function(i):
+        text = TEXTS[i % len(TEXTS)]
+        inference.classify_text(text, distilbert, use_cache=False)
+        return input_tokens(text)
+
+    def classify_cache_hit(i):
+        text = TEXTS[i % len(TEXTS)]
+        inference.classify_text(text, distilbert)
+        return input_tokens(text)
+
+    def generate_function(i):
+        prompt = PROMPTS[i % len(PROMPTS)]
+        output, _ = inference.generate_text(prompt, gpt2)
+        return generated_tokens(prompt, output)
+
+    def classify_endpoint(i):
+        text = TEXTS[i % len(TEXTS)]
+        response = client.post('/classify', json={'text': text, 'model': distilbert, 'cache': False})
+        if response.status_code != 200:
+            raise RuntimeError(f"/classify returned {response.status_code}: {response.get_json()}")
+        return input_tokens(text)
+
+    def generate_endpoint(i):
+        prompt = PROMPTS[i % len(PROMPTS)]
+        response = client.post('/generate', json={'text': prompt, 'model': gpt2})
+        if response.status_code != 200:
+            raise RuntimeError(f"/generate returned {response.status_code}: {response.get_json()}")
+        return generated_tokens(prompt, response.get_json()['generated_text'])
+
+    selected = {
+        'classify_text': classify_function,
+        'generate_text': generate_function,
+        'POST /classify': classify_endpoint,
+        'POST /generate': generate_endpoint,
+    }
+    if inference.RESPONSE_CACHE_ENABLED:
+        for text in TEXTS:
+            inference.classify_text(text, distilbert)
+        selected['classify_text (cache hit)'] = classify_cache_hit
+    return selected
+
+
+def tokenizer_benchmark(base_path, rounds):
+    # Microseconds per encode over a chat-like stream where lines repeat, for the pure-Python tokenizer,
+    # the Rust-backed one, and the Rust-backed one behind the app's token memo
+    from transformers import AutoTokenizer, DistilBertTokenizer, DistilBertTokenizerFast
+    from tokenization import TokenMemo
+
+    texts = (TEXTS + PROMPTS) * rounds
+    loaders = {
+        DISTILBERT_NAME: (DistilBertTokenizer.from_pretrained, DistilBertTokenizerFast.from_pretrained),
+        GPT2_NAME: (lambda path: AutoTokenizer.from_pretrained(path, use_fast=False), AutoTokenizer.from_pretrained),
+    }
+
+    def per_call_us(encode):
+        started = time.perf_counter()
+        for text in texts:
+            encode(text)
+        return round((time.perf_counter() - started) / len(texts) * 1e6, 2)
+
+    results = {}
+    for name, (load_slow, load_fast) in loaders.items():
+        path = os.path.join(base_path, name)
+        slow, fast = load_slow(path), load_fast(path)
+        memo = TokenMemo()
+        results[name] = {
+            'texts': len(texts),
+            'slow_us': per_call_us(slow.encode),
+            'fast_us': per_call_us(fast.encode),
+            'fast_memo_us': per_call_us(lambda text: memo.encode(fast, text)),
+            'memo_hit_rate': memo.stats()['hit_rate'],
+        }
+    return results
+
+
+def compare(report, baseline, tolerance_pct):
+    # A scenario regresses when its p95 grows, or its requests/s drops, by more than the tolerance
+    regressions = []
+    for name, levels in report['scenarios'].items():
+        previous = {level['concurrency']: level for level in baseline.get('scenarios', {}).get(name, [])}
+        for level in levels:
+            before = previous.get(level['concurrency'])
+            if before is None:
+                continue
+            p95_change = (level['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100 if before['p95_ms'] else 0.0
+            rps_change = (level['requests_per_s'] - before['requests_per_s']) / before['requests_per_s'] * 100 if before['requests_per_s'] else 0.0
+            level['vs_baseline'] = {'p95_change_pct': round(p95_change, 1), 'requests_per_s_change_pct': round(rps_change, 1)}
+            if p95_change > tolerance_pct or rps_change < -tolerance_pct:
+                regressions.append(f"{name} @ concurrency {level['concurrency']}: p95 {p95_change:+.1f}%, requests/s {rps_change:+.1f}%")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the inference functions and endpoints on tiny local models.')
+    parser.add_argument('--model-base-path', help='Use models from this directory instead of building tiny ones')
+    parser.add_argument('--concurrency', default='1,4,8', help='Comma-separated concurrency levels')
+    parser.add_argument('--requests', type=int, default=32, help='Requests per concurrency level')
+    parser.add_argument('--max-length', type=int, default=48, help='max_length passed to GPT-2 generation')
+    parser.add_argument('--scenarios', help='Comma-separated subset of scenarios to run')
+    parser.add_argument('--output', help='Write the report as JSON to this file')
+    parser.add_argument('--baseline', help='Earlier report to compare against')
+    parser.add_argument('--tolerance', type=float, default=10.0, help='Allowed p95/requests-per-second change in percent')
+    parser.add_argument('--tokenizers', action='store_true', help='Also time slow vs fast tokenizers and the token memo')
+    parser.add_argument('--tokenizer-rounds', type=int, default=200, help='Passes over the sample texts per tokenizer')
+    args = parser.parse_args()
+
+    base_path = args.model_base_path
+    if base_path is None:
+        base_path = tempfile.mkdtemp(prefix='droid7-bench-')
+        build_tiny_models(base_path)
+    # app reads its configuration at import time
+    os.environ['MODEL_BASE_PATH'] = base_path
+    import app as inference
+
+    levels = [int(level) for level in args.concurrency.split(',') if level.strip()]
+    report = {
+        'torch': torch.__version__,
+        'threads': torch.get_num_threads(),
+        'device': str(inference.device),
+        'model_base_path': args.model_base_path,
+        'tiny_models': args.model_base_path is None,
+        'generate_batching': inference.GENERATE_BATCHING,
+        'response_cache': inference.RESPONSE_CACHE_ENABLED,
+        'requests_per_level': args.requests,
+        'max_length': args.max_length,
+        'scenarios': {},
+    }
+    if args.tokenizers:
+        report['tokenizers'] = tokenizer_benchmark(base_path, args.tokenizer_rounds)
+        for name, result in report['tokenizers'].items():
+            print(f"tokenize {name}: slow {result['slow_us']} us, fast {result['fast_us']} us, "
+                  f"fast + memo {result['fast_memo_us']} us per text (memo hit rate {result['memo_hit_rate']})")
+
+    selected = scenarios(inference, args.max_length)
+    if args.scenarios:
+        wanted = [name.strip() for name in args.scenarios.split(',')]
+        selected = {name: call for name, call in selected.items() if name in wanted}
+
+    for name, call in selected.items():
+        report['scenarios'][name] = []
+        for concurrency in levels:
+            result = run_level(call, concurrency, args.requests)
+            report['scenarios'][name].append(result)
+            print(f"{name} @ {concurrency}: p50 {result['p50_ms']} ms, p95 {result['p95_ms']} ms, p99 {result['p99_ms']} ms, "
+                  f"{result['requests_per_s']} req/s, {result['tokens_per_s']} tok/s, peak RSS {result['peak_rss_mb']} MB")
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        report['regressions'] = regressions
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if not regressions:
+            print(f"No regressions beyond {args.tolerance}% against {args.baseline}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+    if args.model_base_path is None:
+        shutil.rmtree(base_path, ignore_errors=True)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,123 @@
+# Compare the fp32 CPU baseline against the int8 inference profile for each model:
+# latency, sentiment agreement (DistilBERT) and perplexity (GPT-2 / DialoGPT).
+#
+#   python compare_profiles.py --model-base-path /app/models --output profile_report.json
+import argparse
+import copy
+import json
+import math
+import os
+import statistics
+import time
+
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer, DistilBertForSequenceClassification, DistilBertTokenizer
+
+from inference_profile import configure_threads, quantize_int8
+
+SAMPLE_TEXTS = [
+    "gg", "lol", "that was amazing!", "this stream is so boring", "I love this song",
+    "worst play ever", "hi streamer", "can't believe you missed that", "so hyped for the raid",
+    "please stop", "best community on twitch", "ugh lag again", "thank you for the sub!",
+    "that boss fight was brutal", "you're doing great", "nobody asked",
+]
+
+SAMPLE_CORPUS = (
+    "Welcome back to the stream everyone. Today we are going to finish the last dungeon and then "
+    "open the raffle for the new emotes. Thanks for all the follows and subs while we were away, "
+    "and remember to keep chat friendly so everyone can enjoy the show."
+)
+
+
+def timed(fn, repeats):
+    fn()  # Warm-up
+    samples = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return {'mean_ms': round(statistics.mean(samples), 3), 'median_ms': round(statistics.median(samples), 3)}
+
+
+def compare_classifier(path, texts, repeats):
+    tokenizer = DistilBertTokenizer.from_pretrained(path)
+    baseline = DistilBertForSequenceClassification.from_pretrained(path).eval()
+    quantized = quantize_int8(copy.deepcopy(baseline)).eval()
+    inputs = tokenizer(texts, padding=True, truncation=True, return_tensors='pt')
+
+    def classify(model):
+        with torch.no_grad():
+            return torch.softmax(model(**inputs).logits, dim=-1)
+
+    base_scores, quant_scores = classify(baseline), classify(quantized)
+    agreement = (base_scores.argmax(dim=-1) == quant_scores.argmax(dim=-1)).float().mean().item()
+    return {
+        'fp32': timed(lambda: classify(baseline), repeats),
+        'int8': timed(lambda: classify(quantized), repeats),
+        'sentiment_agreement': round(agreement, 4),
+        'max_score_drift': round((base_scores - quant_scores).abs().max().item(), 5),
+    }
+
+
+def perplexity(model, tokenizer, text):
+    input_ids = tokenizer.encode(text, return_tensors='pt')
+    with torch.no_grad():
+        loss = model(input_ids, labels=input_ids).loss
+    return math.exp(loss.item())
+
+
+def compare_causal(path, prompt, corpus, repeats, new_tokens):
+    tokenizer = AutoTokenizer.from_pretrained(path)
+    baseline = AutoModelForCausalLM.from_pretrained(path, torch_dtype=torch.float32).eval()
+    quantized = quantize_int8(copy.deepcopy(baseline)).eval()
+    input_ids = tokenizer.encode(prompt, return_tensors='pt')
+    attention_mask = torch.ones(input_ids.shape, dtype=torch.long)
+
+    def generate(model):
+        with torch.no_grad():
+            return model.generate(
+                input_ids, attention_mask=attention_mask, do_sample=False,
+                min_new_tokens=new_tokens, max_new_tokens=new_tokens, pad_token_id=tokenizer.eos_token_id,
+            )
+
+    base_ppl, quant_ppl = perplexity(baseline, tokenizer, corpus), perplexity(quantized, tokenizer, corpus)
+    report = {
+        'fp32': timed(lambda: generate(baseline), repeats),
+        'int8': timed(lambda: generate(quantized), repeats),
+        'perplexity_fp32': round(base_ppl, 3),
+        'perplexity_int8': round(quant_ppl, 3),
+        'perplexity_drift_pct': round((quant_ppl - base_ppl) / base_ppl * 100, 2),
+        'greedy_tokens_match': generate(baseline).tolist() == generate(quantized).tolist(),
+    }
+    for key in ('fp32', 'int8'):
+        report[key]['tokens_per_s'] = round(new_tokens / (report[key]['mean_ms'] / 1000), 2)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare fp32 and int8 CPU inference profiles.')
+    parser.add_argument('--model-base-path', default=os.environ.get('MODEL_BASE_PATH', '/app/models'))
+    parser.add_argument('--models', default='distilbert-base-uncased-finetuned-sst-2-english,gpt2,DialoGPT-medium')
+    parser.add_argument('--repeats', type=int, default=10)
+    parser.add_argument('--new-tokens', type=int, default=32)
+    parser.add_argument('--output', help='Write the report as JSON to this file')
+    args = parser.parse_args()
+
+    configure_threads()
+    report = {'torch': torch.__version__, 'threads': torch.get_num_threads(), 'models': {}}
+    for name in [name.strip() for name in args.models.split(',') if name.strip()]:
+        path = os.path.join(args.model_base_path, name)
+        if 'distilbert' in name.lower():
+            report['models'][name] = compare_classifier(path, SAMPLE_TEXTS, args.repeats)
+        else:
+            report['models'][name] = compare_causal(path, "Hello chat, how is everyone", SAMPLE_CORPUS, args.repeats, args.new_tokens)
+        print(f"{name}: {json.dumps(report['models'][name])}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
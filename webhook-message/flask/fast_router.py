@@ -0,0 +1,110 @@
+import json
+import math
+import re
+import threading
+import zlib
+
+import numpy as np
+
+N_FEATURES = 2 ** 18
+
+# Fallback first stage when no trained model is configured: chat words with a clear polarity.
+# Positive scores lean towards class 1 (positive), matching the DistilBERT SST-2 labels.
+DEFAULT_LEXICON = {
+    'gg': 2.0, 'ggs': 2.0, 'love': 2.5, 'loved': 2.5, 'great': 2.5, 'awesome': 3.0, 'amazing': 3.0,
+    'nice': 2.0, 'hype': 2.0, 'pog': 2.5, 'poggers': 2.5, 'thanks': 2.0, 'thank': 2.0, 'ty': 1.5,
+    'best': 2.5, 'good': 2.0, 'wow': 1.5, 'lol': 1.0, 'lmao': 1.0, 'congrats': 2.5, 'beautiful': 2.5,
+    'hate': -3.0, 'awful': -3.0, 'terrible': -3.0, 'worst': -3.0, 'boring': -2.5, 'bad': -2.5,
+    'trash': -3.0, 'lag': -2.0, 'ugh': -2.0, 'stop': -1.5, 'sucks': -3.0, 'stupid': -3.0,
+    'annoying': -2.5, 'cringe': -2.5, 'sad': -2.0, 'rip': -1.5, 'wtf': -2.0,
+}
+
+_TOKEN = re.compile(r"[a-z0-9']+|[^\sa-z0-9]")
+
+
+def tokenize(text):
+    return _TOKEN.findall(' '.join(text.lower().split()))
+
+
+def feature_indices(text, n_features=N_FEATURES):
+    # Hashed word unigrams, word bigrams and in-word character trigrams. crc32 keeps the hashing
+    # stable across processes, unlike hash().
+    tokens = tokenize(text)
+    grams = ['w:' + token for token in tokens]
+    grams += ['b:' + a + ' ' + b for a, b in zip(tokens, tokens[1:])]
+    for token in tokens:
+        padded = f'<{token}>'
+        grams += ['c:' + padded[i:i + 3] for i in range(len(padded) - 2)]
+    return np.fromiter((zlib.crc32(gram.encode()) % n_features for gram in grams), dtype=np.int64, count=len(grams))
+
+
+def _sigmoid(value):
+    return 1.0 / (1.0 + math.exp(-max(-30.0, min(30.0, value))))
+
+
+class FastRouter:
+    """First stage of the /process sentiment cascade.
+
+    Scores a message with a hashed n-gram logistic model trained offline on DistilBERT labels
+    (train_fast_router.py), or with DEFAULT_LEXICON when no model is loaded. Messages whose
+    probability is at least ``threshold`` away from the undecided middle are routed here; the rest
+    go to DistilBERT. Shadow checks compare fast decisions against DistilBERT on live traffic.
+    """
+
+    def __init__(self, weights=None, bias=0.0, n_features=N_FEATURES, threshold=0.9, lexicon=None):
+        self.weights = weights
+        self.bias = bias
+        self.n_features = n_features
+        self.threshold = threshold
+        self.lexicon = DEFAULT_LEXICON if lexicon is None else lexicon
+        self._lock = threading.Lock()
+        self._counts = {'fast': 0, 'model': 0, 'shadow_checked': 0, 'shadow_disagreed': 0}
+
+    @classmethod
+    def load(cls, path, threshold=0.9):
+        with np.load(path) as data:
+            return cls(weights=data['weights'], bias=float(data['bias']), n_features=int(data['n_features']), threshold=threshold)
+
+    def save(self, path, report=None):
+        np.savez_compressed(path, weights=self.weights, bias=self.bias, n_features=self.n_features, report=json.dumps(report or {}))
+
+    @property
+    def source(self):
+        return 'hashed-ngram' if self.weights is not None else 'lexicon'
+
+    def probability(self, text):
+        # P(class 1) for the message
+        if self.weights is not None:
+            return _sigmoid(float(self.weights[feature_indices(text, self.n_features)].sum()) + self.bias)
+        scores = [self.lexicon[token] for token in tokenize(text) if token in self.lexicon]
+        return _sigmoid(sum(scores)) if scores else 0.5
+
+    def route(self, text):
+        # Returns (predicted_class, confidence); predicted_class is None when DistilBERT must decide
+        positive = self.probability(text)
+        predicted_class = 1 if positive >= 0.5 else 0
+        confidence = positive if predicted_class == 1 else 1.0 - positive
+        return (predicted_class if confidence >= self.threshold else None), confidence
+
+    def record(self, stage):
+        with self._lock:
+            self._counts[stage] += 1
+
+    def record_shadow(self, fast_class, model_class):
+        with self._lock:
+            self._counts['shadow_checked'] += 1
+            if fast_class != model_class:
+                self._counts['shadow_disagreed'] += 1
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._counts)
+        routed = counts['fast'] + counts['model']
+        return {
+            'source': self.source,
+            'threshold': self.threshold,
+            **counts,
+            'fast_fraction': round(counts['fast'] / routed, 4) if routed else 0.0,
+            'model_fraction': round(counts['model'] / routed, 4) if routed else 0.0,
+            'shadow_disagreement_rate': round(counts['shadow_disagreed'] / counts['shadow_checked'], 4) if counts['shadow_checked'] else 0.0,
+        }
@@ -0,0 +1,43 @@
+# Production serving mode: several worker processes sharing the preloaded model weights.
+#
+#   gunicorn -c gunicorn.conf.py app:app
+#
+# preload_app imports app.py once in the master; when_ready then loads PRELOAD_MODELS there, and
+# the workers fork afterwards, so their weights stay shared copy-on-write pages instead of N copies.
+import logging
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_WORKERS', '2'))
+threads = int(os.environ.get('WEB_THREADS', '4'))
+worker_class = 'gthread'
+timeout = int(os.environ.get('WEB_TIMEOUT', '120'))
+preload_app = True
+
+PRELOAD_MODELS = os.environ.get('PRELOAD_MODELS', 'distilbert-base-uncased-finetuned-sst-2-english,gpt2,DialoGPT-medium')
+
+
+def when_ready(server):
+    import app
+    import serving
+
+    names = [name.strip() for name in PRELOAD_MODELS.split(',') if name.strip()]
+    serving.preload_models(app.load_model, names, app.device)
+
+
+def post_fork(server, worker):
+    import torch
+    import serving
+
+    torch.set_num_threads(serving.worker_threads(workers))
+
+
+def post_worker_init(worker):
+    import app
+    import serving
+
+    # Each worker exercises the preloaded models once in the background; /readyz waits for it
+    app.warmup.start()
+
+    # Startup check: how much of this worker is its own memory versus pages shared with the master
+    logging.info(f"Worker memory at startup: {serving.format_memory_report(serving.memory_report())}")
@@ -0,0 +1,92 @@
+import json
+import logging
+import os
+
+import torch
+
+# Per-model inference profiles. Keys are allowlisted model names ("*" applies to every model):
+#   cpu_dtype      dtype used on CPU; fp16 requests are ignored there because CPU fp16 matmuls are slow
+#   quantize_int8  apply dynamic int8 quantization to Linear layers when running on CPU
+# INFERENCE_PROFILES (JSON) overrides these, e.g. '{"*": {"quantize_int8": true}}'.
+# CPU_QUANTIZE_INT8=1 is a shortcut that turns quantization on for every model.
+DEFAULT_PROFILES = {
+    '*': {'cpu_dtype': 'float32', 'quantize_int8': False},
+}
+
+CPU_DTYPES = {'float32', 'bfloat16'}
+
+
+def load_profiles():
+    profiles = {name: dict(profile) for name, profile in DEFAULT_PROFILES.items()}
+    overrides = os.environ.get('INFERENCE_PROFILES')
+    if overrides:
+        for name, profile in json.loads(overrides).items():
+            profiles.setdefault(name, {}).update(profile)
+    if os.environ.get('CPU_QUANTIZE_INT8') == '1':
+        profiles['*']['quantize_int8'] = True
+    return profiles
+
+
+def resolve_profile(name, params, device, profiles=None):
+    # Merge the "*" profile with the model's own entry and pick a dtype suited to the device
+    profiles = load_profiles() if profiles is None else profiles
+    profile = {**profiles.get('*', {}), **profiles.get(name, {})}
+
+    requested = params.get('torch_dtype', 'float32')
+    if device.type == 'cpu':
+        dtype_name = profile.get('cpu_dtype', 'float32')
+        if dtype_name not in CPU_DTYPES:
+            dtype_name = 'float32'
+        if requested != dtype_name:
+            logging.info(f"Model '{name}': using {dtype_name} on CPU instead of requested {requested}.")
+        quantize = bool(profile.get('quantize_int8')) and dtype_name == 'float32'
+    else:
+        dtype_name = requested
+        quantize = False  # Dynamic quantization kernels are CPU-only
+
+    return {
+        'torch_dtype': getattr(torch, dtype_name, torch.float32),
+        'quantize_int8': quantize,
+    }
+
+
+def configure_threads():
+    # Intra-op threads drive matmul parallelism; inter-op can only be set before any parallel work runs
+    num_threads = os.environ.get('TORCH_NUM_THREADS')
+    if num_threads:
+        torch.set_num_threads(int(num_threads))
+    interop_threads = os.environ.get('TORCH_NUM_INTEROP_THREADS')
+    if interop_threads:
+        try:
+            torch.set_num_interop_threads(int(interop_threads))
+        except RuntimeError as e:
+            logging.warning(f"Could not set inter-op threads: {str(e)}")
+    logging.info(f"Torch threads: intra-op {torch.get_num_threads()}, inter-op {torch.get_num_interop_threads()}.")
+
+
+def _conv1d_to_linear(model):
+    # GPT-2 and DialoGPT use transformers' Conv1D (a transposed Linear), which quantize_dynamic skips
+    from transformers.pytorch_utils import Conv1D
+
+    for parent in list(model.modules()):
+        for child_name, child in list(parent.named_children()):
+            if isinstance(child, Conv1D):
+                in_features, out_features = child.weight.shape
+                linear = torch.nn.Linear(in_features, out_features, bias=child.bias is not None)
+                linear.weight = torch.nn.Parameter(child.weight.data.t().contiguous(), requires_grad=False)
+                if child.bias is not None:
+                    linear.bias = torch.nn.Parameter(child.bias.data, requires_grad=False)
+                setattr(parent, child_name, linear)
+    return model
+
+
+def quantize_int8(model):
+    model = _conv1d_to_linear(model)
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def apply_profile(model, profile):
+    model.eval()
+    if profile['quantize_int8']:
+        model = quantize_int8(model)
+    return model
@@ -0,0 +1,209 @@
+import gc
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+MB = 1024 * 1024
+
+# Models the service may load, with an estimated resident footprint (fp32 weights) used to make
+# room before a load. The measured size replaces the estimate once the model is resident.
+DEFAULT_ALLOWLIST = {
+    'distilbert-base-uncased-finetuned-sst-2-english': 270 * MB,
+    'DialoGPT-medium': 1450 * MB,
+    'gpt2': 500 * MB,
+}
+
+
+class ModelNotAllowedError(Exception):
+    pass
+
+
+def parse_allowlist(value):
+    # "name" or "name:MB" entries separated by commas, e.g. "gpt2,distilgpt2:330"
+    allowlist = {}
+    for entry in (value or '').split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        name, _, size_mb = entry.partition(':')
+        allowlist[name.strip()] = int(float(size_mb) * MB) if size_mb else None
+    return allowlist
+
+
+def _state_tensors(value):
+    # Dynamically quantized layers keep packed weights in state_dict entries that are tuples
+    if isinstance(value, (tuple, list)):
+        for item in value:
+            yield from _state_tensors(item)
+    elif hasattr(value, 'element_size') and hasattr(value, 'numel'):
+        yield value
+
+
+def estimate_model_bytes(model):
+    # Every tensor in the state dict (covers quantized packed weights), counting tied weights once
+    seen = set()
+    total = 0
+    for value in list(model.state_dict(keep_vars=True).values()) + list(model.buffers()):
+        for tensor in _state_tensors(value):
+            key = (tensor.data_ptr(), tensor.numel())
+            if key in seen:
+                continue
+            seen.add(key)
+            total += tensor.numel() * tensor.element_size()
+    return total
+
+
+class _ResidentModel:
+    __slots__ = ('model', 'tokenizer', 'nbytes', 'loaded_at', 'last_used')
+
+    def __init__(self, model, tokenizer, nbytes):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.nbytes = nbytes
+        self.loaded_at = time.time()
+        self.last_used = time.time()
+
+
+class ModelRegistry:
+    """Allowlisted (model, tokenizer) cache with an LRU memory budget and per-model load locks."""
+
+    def __init__(self, base_path, allowlist=None, budget_bytes=4096 * MB, on_evict=None):
+        self.base_path = base_path
+        self.allowlist = dict(DEFAULT_ALLOWLIST if allowlist is None else allowlist)
+        self.budget_bytes = budget_bytes
+        self.on_evict = on_evict
+
+        self._resident = OrderedDict()  # name -> _ResidentModel, least recently used first
+        self._resident_bytes = 0
+        self._load_locks = {}
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def resolve(self, requested_path):
+        # Clients send a path (Windows or POSIX style); only its final component selects the model,
+        # and the weights are always read from base_path.
+        name = [part for part in re.split(r'[\\/]+', requested_path or '') if part]
+        name = name[-1] if name else ''
+        if name not in self.allowlist:
+            raise ModelNotAllowedError(f"Model '{requested_path}' is not in the allowlist.")
+        return name
+
+    def path_for(self, name):
+        return os.path.join(self.base_path, name)
+
+    def get(self, requested_path, load):
+        # load(path) -> (model, tokenizer); only called once per name even under concurrent misses
+        name = self.resolve(requested_path)
+        with self._lock:
+            entry = self._hit(name)
+            if entry is not None:
+                return entry.model, entry.tokenizer
+            load_lock = self._load_locks.setdefault(name, threading.Lock())
+
+        with load_lock:
+            with self._lock:
+                entry = self._hit(name)
+                if entry is not None:
+                    return entry.model, entry.tokenizer
+                self._stat(name)['misses'] += 1
+                evicted = self._make_room(self.allowlist.get(name) or 0)
+            self._after_evict(evicted)
+
+            started = time.perf_counter()
+            model, tokenizer = load(self.path_for(name))
+            nbytes = estimate_model_bytes(model)
+            logging.info(f"Model '{name}' resident: {nbytes / MB:.1f} MB, loaded in {time.perf_counter() - started:.2f}s.")
+
+            with self._lock:
+                self._resident[name] = _ResidentModel(model, tokenizer, nbytes)
+                self._resident_bytes += nbytes
+                self._stat(name)['load_seconds'] = round(time.perf_counter() - started, 3)
+                evicted = self._make_room(0, keep=name)
+            self._after_evict(evicted)
+            return model, tokenizer
+
+    def is_resident(self, requested_path):
+        with self._lock:
+            return self.resolve(requested_path) in self._resident
+
+    def evict(self, name):
+        with self._lock:
+            if name not in self._resident:
+                return False
+            self._evict(name)
+        self._after_evict([name])
+        return True
+
+    def stats(self):
+        with self._lock:
+            resident = {
+                name: {'size_bytes': entry.nbytes, 'loaded_at': entry.loaded_at, 'last_used': entry.last_used}
+                for name, entry in self._resident.items()
+            }
+            models = {}
+            for name in self.allowlist:
+                counters = self._stat(name)
+                models[name] = {
+                    'resident': name in resident,
+                    'estimated_bytes': self.allowlist[name],
+                    **resident.get(name, {}),
+                    **counters,
+                }
+            return {
+                'budget_bytes': self.budget_bytes,
+                'resident_bytes': self._resident_bytes,
+                'resident_models': list(resident),
+                'models': models,
+            }
+
+    def _hit(self, name):
+        entry = self._resident.get(name)
+        if entry is not None:
+            self._resident.move_to_end(name)
+            entry.last_used = time.time()
+            self._stat(name)['hits'] += 1
+        return entry
+
+    def _stat(self, name):
+        return self._stats.setdefault(name, {'hits': 0, 'misses': 0, 'evictions': 0, 'load_seconds': None})
+
+    def _make_room(self, incoming_bytes, keep=None):
+        # Evict least recently used models until the incoming model fits; a model larger than
+        # the whole budget still loads, it just ends up alone. Returns the evicted names.
+        evicted = []
+        for name in list(self._resident):
+            if self._resident_bytes + incoming_bytes <= self.budget_bytes:
+                break
+            if name == keep:
+                continue
+            self._evict(name)
+            evicted.append(name)
+        return evicted
+
+    def _evict(self, name):
+        entry = self._resident.pop(name)
+        self._resident_bytes -= entry.nbytes
+        self._stat(name)['evictions'] += 1
+        logging.info(f"Evicted model '{name}' ({entry.nbytes / MB:.1f} MB) to stay within the memory budget.")
+
+    def _after_evict(self, names):
+        # Runs without the registry lock: on_evict drops whatever else holds on to the evicted models'
+        # tensors, then a full collection frees them without stalling other lookups
+        if not names:
+            return
+        if self.on_evict is not None:
+            for name in names:
+                self.on_evict(name)
+        self._release_memory()
+
+    def _release_memory(self):
+        gc.collect()
+        try:
+            import torch
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        except ImportError:
+            pass
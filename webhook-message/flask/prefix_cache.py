@@ -0,0 +1,171 @@
+import threading
+from collections import OrderedDict
+
+
+def _legacy(past_key_values):
+    # Tuple of (key, value) per layer, each (batch, heads, seq_len, head_dim)
+    if hasattr(past_key_values, 'to_legacy_cache'):
+        past_key_values = past_key_values.to_legacy_cache()
+    return past_key_values
+
+
+def _kv_bytes(past_key_values):
+    return sum(tensor.element_size() * tensor.numel() for layer in past_key_values for tensor in layer)
+
+
+class _Node:
+    __slots__ = ('children', 'entries')
+
+    def __init__(self):
+        self.children = {}  # token id -> _Node
+        self.entries = set()  # Entries whose tokens pass through this node
+
+
+class _Entry:
+    __slots__ = ('scope', 'tokens', 'past_key_values', 'nbytes')
+
+    def __init__(self, scope, tokens, past_key_values):
+        self.scope = scope
+        self.tokens = tokens
+        self.past_key_values = past_key_values
+        self.nbytes = _kv_bytes(past_key_values)
+
+
+class PrefixCache:
+    """past_key_values of recent prompts, reused by later prompts that start with the same tokens.
+
+    Each scope (model) has a trie over prompt token ids; every node lists the stored prompts that
+    pass through it. Attention is causal, so the cache of a stored prompt sliced to the first n
+    tokens is the cache of any prompt sharing those n tokens. Entries are evicted LRU under
+    ``max_bytes``, and prompts shorter than ``min_tokens`` are neither stored nor reused.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, min_tokens=16):
+        self.max_bytes = max_bytes
+        self.min_tokens = max(1, int(min_tokens))
+
+        self._roots = {}  # scope -> _Node
+        self._entries = OrderedDict()  # _Entry -> None, least recently used first
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.reused_tokens = 0
+        self.evictions = 0
+
+    def lookup(self, scope, tokens):
+        # Returns (past_key_values covering the longest cached prefix, its length), or (None, 0).
+        # At least one token is left for the model to run, so it has logits to sample from.
+        with self._lock:
+            node, depth = self._roots.get(scope), 0
+            while node is not None and depth < len(tokens) - 1:
+                child = node.children.get(tokens[depth])
+                if child is None:
+                    break
+                node, depth = child, depth + 1
+            if node is None or depth < self.min_tokens:
+                self.misses += 1
+                return None, 0
+            entry = next(iter(node.entries))
+            self._entries.move_to_end(entry)
+            self.hits += 1
+            self.reused_tokens += depth
+        # Slices are views: generate() concatenates new keys/values into fresh tensors
+        return tuple((key[:, :, :depth], value[:, :, :depth]) for key, value in entry.past_key_values), depth
+
+    def insert(self, scope, tokens, past_key_values):
+        # past_key_values may run past the prompt (it usually covers the generated tokens too)
+        if len(tokens) < self.min_tokens:
+            return
+        past_key_values = _legacy(past_key_values)
+        if past_key_values is None or past_key_values[0][0].shape[0] != 1 or past_key_values[0][0].shape[2] < len(tokens):
+            return
+        with self._lock:
+            if self._touch_covering(scope, tokens):
+                return
+
+        entry = _Entry(scope, tuple(tokens), tuple(
+            (key[:, :, :len(tokens)].clone(), value[:, :, :len(tokens)].clone()) for key, value in past_key_values
+        ))
+        if entry.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if self._touch_covering(scope, tokens):
+                return
+            # Stored prompts that are prefixes of this one add nothing once it is stored
+            shorter = []
+            node = self._roots.setdefault(scope, _Node())
+            for depth, token in enumerate(tokens, start=1):
+                node = node.children.setdefault(token, _Node())
+                shorter += [other for other in node.entries if len(other.tokens) == depth]
+                node.entries.add(entry)
+            for other in shorter:
+                self._remove(other)
+            self._entries[entry] = None
+            self._total_bytes += entry.nbytes
+            while self._total_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._roots.clear()
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def drop_scope(self, scope):
+        # Forget every stored prompt of one scope (a model that is no longer loaded)
+        with self._lock:
+            entries = [entry for entry in self._entries if entry.scope == scope]
+            for entry in entries:
+                del self._entries[entry]
+                self._total_bytes -= entry.nbytes
+            self._roots.pop(scope, None)
+            return len(entries)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+                'min_tokens': self.min_tokens,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'reused_tokens': self.reused_tokens,
+                'evictions': self.evictions,
+            }
+
+    def _touch_covering(self, scope, tokens):
+        # True (and the entry refreshed) when a stored prompt already starts with all of these tokens
+        node = self._roots.get(scope)
+        for token in tokens:
+            node = node.children.get(token) if node is not None else None
+        if node is None or not node.entries:
+            return False
+        self._entries.move_to_end(next(iter(node.entries)))
+        return True
+
+    def _remove(self, entry):
+        # Unlink the entry from its trie path, dropping nodes no stored prompt passes through any more
+        if entry in self._entries:
+            del self._entries[entry]
+            self._total_bytes -= entry.nbytes
+        parent = self._roots.get(entry.scope)
+        path = []
+        for token in entry.tokens:
+            node = parent.children.get(token) if parent is not None else None
+            if node is None:
+                break
+            node.entries.discard(entry)
+            path.append((parent, token, node))
+            parent = node
+        for parent, token, node in reversed(path):
+            if node.entries:
+                break
+            del parent.children[token]
+        root = self._roots.get(entry.scope)
+        if root is not None and not root.children:
+            del self._roots[entry.scope]
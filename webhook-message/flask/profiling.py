@@ -0,0 +1,254 @@
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import re
+import shutil
+import threading
+import time
+import tracemalloc
+
+from torch.profiler import ProfilerActivity, profile as torch_profile
+
+PROFILE_MODES = ('torch', 'cprofile')
+PROFILE_HEADER = 'X-Profile'
+SEGMENT_WAIT_S = 30.0
+
+_local = threading.local()
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_users = 0
+
+
+def current():
+    # Capture of the request being handled on this thread, if it is being profiled
+    return getattr(_local, 'capture', None)
+
+
+def wrap_job(fn):
+    # Scheduler hook: work submitted while a capture is active is profiled on the thread that runs it
+    capture = current()
+    return capture.wrap(fn) if capture is not None else fn
+
+
+def _start_tracemalloc():
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        _tracemalloc_users += 1
+
+
+def _stop_tracemalloc():
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0:
+            tracemalloc.stop()
+
+
+class Capture:
+    """One profiled request: a torch.profiler trace or cProfile stats per profiled segment, plus
+    the tracemalloc allocations made while the request ran."""
+
+    def __init__(self, mode, route, reason):
+        self.mode = mode
+        self.route = route
+        self.reason = reason
+        self.id = f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{route.strip('/').replace('/', '_') or 'root'}-{random.randrange(16 ** 6):06x}"
+        self.started_at = time.perf_counter()
+        self._segments = []  # (label, torch profiler or cProfile.Profile, seconds)
+        self._running = 0
+        self._cond = threading.Condition()
+        self._baseline = None
+
+    def start(self):
+        _start_tracemalloc()
+        self._baseline = tracemalloc.take_snapshot()
+        _local.capture = self
+
+    def wrap(self, fn):
+        def profiled(*args, **kwargs):
+            return self.run_segment(getattr(fn, '__name__', 'job'), fn, *args, **kwargs)
+        return profiled
+
+    def run_segment(self, label, fn, *args, **kwargs):
+        # torch.profiler and cProfile only see the thread they are started on, so each scheduled job
+        # is profiled where it runs
+        with self._cond:
+            self._running += 1
+        started = time.perf_counter()
+        try:
+            if self.mode == 'torch':
+                profiler = torch_profile(activities=[ProfilerActivity.CPU], record_shapes=True, profile_memory=True, with_stack=False)
+                with profiler:
+                    return fn(*args, **kwargs)
+            profiler = cProfile.Profile()
+            return profiler.runcall(fn, *args, **kwargs)
+        finally:
+            with self._cond:
+                self._segments.append((label, profiler, time.perf_counter() - started))
+                self._running -= 1
+                self._cond.notify_all()
+
+    def finish(self, directory, status, latency_ms):
+        if getattr(_local, 'capture', None) is self:
+            _local.capture = None
+        try:
+            allocations = tracemalloc.take_snapshot().compare_to(self._baseline, 'lineno')
+        finally:
+            _stop_tracemalloc()
+
+        os.makedirs(directory, exist_ok=True)
+        files = []
+        summary = io.StringIO()
+        # A streamed response can close while its generate job is still stopping its profiler
+        with self._cond:
+            self._cond.wait_for(lambda: self._running == 0, timeout=SEGMENT_WAIT_S)
+            segments = list(self._segments)
+        for index, (label, profiler, seconds) in enumerate(segments, start=1):
+            summary.write(f"== segment {index}: {label} ({seconds * 1000:.1f} ms)\n")
+            if self.mode == 'torch':
+                name = f'trace-{index}.json'
+                profiler.export_chrome_trace(os.path.join(directory, name))
+                summary.write(profiler.key_averages().table(sort_by='self_cpu_time_total', row_limit=25))
+            else:
+                name = f'profile-{index}.prof'
+                profiler.dump_stats(os.path.join(directory, name))
+                pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(25)
+            summary.write('\n')
+            files.append(name)
+
+        with open(os.path.join(directory, 'summary.txt'), 'w') as f:
+            f.write(summary.getvalue())
+        with open(os.path.join(directory, 'tracemalloc.txt'), 'w') as f:
+            f.write("Largest allocation changes during the request (tracemalloc, top 25):\n")
+            for stat in allocations[:25]:
+                f.write(f"{stat}\n")
+        files += ['summary.txt', 'tracemalloc.txt']
+
+        meta = {
+            'id': self.id,
+            'route': self.route,
+            'mode': self.mode,
+            'reason': self.reason,
+            'status': status,
+            'latency_ms': round(latency_ms, 2),
+            'segments': len(segments),
+            'created_at': time.time(),
+            'files': files,
+        }
+        with open(os.path.join(directory, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+        return meta
+
+
+class ProfileStore:
+    # Keeps the most recent captures as directories under base_dir, dropping the oldest past max_profiles
+    _ID_PATTERN = re.compile(r'^[A-Za-z0-9_-][A-Za-z0-9_.-]*$')
+
+    def __init__(self, base_dir, max_profiles=20):
+        self.base_dir = base_dir
+        self.max_profiles = max(1, int(max_profiles))
+        self._lock = threading.Lock()
+
+    def directory_for(self, profile_id):
+        return os.path.join(self.base_dir, profile_id)
+
+    def save(self, capture, status, latency_ms):
+        meta = capture.finish(self.directory_for(capture.id), status, latency_ms)
+        self._prune()
+        logging.info(f"Saved {capture.mode} profile {capture.id} for {capture.route} ({meta['latency_ms']} ms, {capture.reason}).")
+        return meta
+
+    def list(self):
+        profiles = []
+        for profile_id in self._ids():
+            try:
+                with open(os.path.join(self.directory_for(profile_id), 'meta.json')) as f:
+                    profiles.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return sorted(profiles, key=lambda meta: meta['created_at'], reverse=True)
+
+    def file_path(self, profile_id, filename):
+        # Only names written by Capture.finish, inside a known profile directory
+        if not self._ID_PATTERN.match(profile_id) or not self._ID_PATTERN.match(filename):
+            return None
+        path = os.path.join(self.directory_for(profile_id), filename)
+        return path if os.path.isfile(path) else None
+
+    def _ids(self):
+        try:
+            return [name for name in os.listdir(self.base_dir) if os.path.isfile(os.path.join(self.base_dir, name, 'meta.json'))]
+        except OSError:
+            return []
+
+    def _prune(self):
+        with self._lock:
+            ids = sorted(self._ids(), key=lambda name: os.path.getmtime(self.directory_for(name)))
+            for profile_id in ids[:max(0, len(ids) - self.max_profiles)]:
+                shutil.rmtree(self.directory_for(profile_id), ignore_errors=True)
+
+
+class RequestProfiler:
+    """Decides which requests to profile: an explicit header, random sampling, or the request after
+    one that exceeded slow_ms on the same route (a finished request can't be profiled after the fact).
+    Only one capture runs at a time per process."""
+
+    def __init__(self, store, enabled=False, sample_rate=0.0, slow_ms=0.0, default_mode='torch', slow_cooldown_s=60.0):
+        if default_mode not in PROFILE_MODES:
+            raise ValueError(f"Profile mode must be one of: {', '.join(PROFILE_MODES)}")
+        self.store = store
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.default_mode = default_mode
+        self.slow_cooldown_s = slow_cooldown_s
+        self._armed = {}  # route -> reason
+        self._last_armed = {}  # route -> monotonic time
+        self._active = threading.Lock()
+
+    def begin(self, route, header_value=None):
+        if not self.enabled:
+            return None
+        mode, reason = self._decide(route, header_value)
+        if mode is None or not self._active.acquire(blocking=False):
+            return None
+        self._armed.pop(route, None)
+        capture = Capture(mode, route, reason)
+        capture.start()
+        return capture
+
+    def end(self, capture, status, latency_ms):
+        try:
+            if self.slow_ms and latency_ms >= self.slow_ms and capture.reason != 'slow request':
+                capture.reason += f', slow ({latency_ms:.0f} ms)'
+            return self.store.save(capture, status, latency_ms)
+        except Exception as e:
+            logging.error(f"Failed to save profile {capture.id}: {str(e)}")
+        finally:
+            self._active.release()
+
+    def observe(self, route, latency_ms):
+        # Unprofiled request finished: arm a capture of the route's next request if this one was slow
+        if not self.enabled or not self.slow_ms or latency_ms < self.slow_ms:
+            return
+        now = time.monotonic()
+        if now - self._last_armed.get(route, -self.slow_cooldown_s) < self.slow_cooldown_s:
+            return
+        self._last_armed[route] = now
+        self._armed[route] = 'slow request'
+        logging.info(f"{route} took {latency_ms:.0f} ms (threshold {self.slow_ms:.0f} ms); profiling its next request.")
+
+    def _decide(self, route, header_value):
+        if header_value:
+            value = header_value.strip().lower()
+            return (value if value in PROFILE_MODES else self.default_mode), 'requested'
+        if route in self._armed:
+            return self.default_mode, self._armed[route]
+        if self.sample_rate and random.random() < self.sample_rate:
+            return self.default_mode, 'sampled'
+        return None, None
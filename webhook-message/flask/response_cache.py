@@ -0,0 +1,93 @@
+import json
+import sys
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+
+def normalize_text(text, collapse_whitespace=False, lowercase=False):
+    # NFC so visually identical strings share an entry; whitespace and case only where the model ignores them
+    text = unicodedata.normalize('NFC', text)
+    if collapse_whitespace:
+        text = ' '.join(text.split())
+    if lowercase:
+        text = text.lower()
+    return text
+
+
+def _entry_bytes(key, value):
+    # Rough footprint: the key tuple's strings plus the value as JSON
+    return sum(sys.getsizeof(part) for part in key) + len(json.dumps(value))
+
+
+class _CachedResponse:
+    __slots__ = ('value', 'nbytes', 'stored_at')
+
+    def __init__(self, value, nbytes):
+        self.value = value
+        self.nbytes = nbytes
+        self.stored_at = time.monotonic()
+
+
+class ResponseCache:
+    """Exact-match cache of model outputs keyed by tuples, evicted by LRU, TTL and a byte budget."""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl_seconds=600):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry.stored_at > self.ttl_seconds:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.value
+
+    def put(self, key, value):
+        nbytes = _entry_bytes(key, value)
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key).nbytes
+            self._entries[key] = _CachedResponse(value, nbytes)
+            self._total_bytes += nbytes
+            while self._total_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+            }
+
+    def _remove(self, key):
+        self._total_bytes -= self._entries.pop(key).nbytes
@@ -0,0 +1,216 @@
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from concurrent.futures import CancelledError, Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import torch
+
+# Lower rank runs first. Interactive replies (streamer-triggered chat) beat default API traffic,
+# which beats background batch jobs such as backfills.
+PRIORITY_CLASSES = {'interactive': 0, 'default': 1, 'background': 2}
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class DeadlineStoppingCriteria:
+    # Stopping criterion for model.generate: ends decoding once the request's deadline has passed
+    def __init__(self, deadline):
+        self.deadline = deadline
+        self.triggered = False
+
+    def __call__(self, input_ids, scores, **kwargs):
+        if time.monotonic() >= self.deadline:
+            self.triggered = True
+        return torch.full((input_ids.shape[0],), self.triggered, dtype=torch.bool, device=input_ids.device)
+
+
+class CancelStoppingCriteria:
+    # Stopping criterion for model.generate: ends decoding once cancel() is called from any thread,
+    # such as when the client of a streamed reply goes away
+    def __init__(self):
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full((input_ids.shape[0],), self._cancelled.is_set(), dtype=torch.bool, device=input_ids.device)
+
+
+class _Job:
+    __slots__ = ('fn', 'args', 'kwargs', 'priority', 'deadline', 'future', 'enqueued_at')
+
+    def __init__(self, fn, args, kwargs, priority, deadline):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.deadline = deadline
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class GenerationScheduler:
+    """Runs model work in priority order, earliest deadline first within a class.
+
+    Queued jobs whose deadline has passed are dropped without running, and jobs that are running
+    when their deadline arrives stop decoding through stopping_criteria(). ``wrap_job(fn)``, when
+    given, is called on the submitting thread and returns the callable the worker runs instead.
+    """
+
+    def __init__(self, workers=1, wrap_job=None):
+        self.workers = max(1, int(workers))
+        self.wrap_job = wrap_job
+        self._heap = []
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._pid = None
+        self._local = threading.local()
+        self._stats = {name: self._empty_stats() for name in PRIORITY_CLASSES}
+
+    @staticmethod
+    def _empty_stats():
+        return {
+            'queued': 0, 'submitted': 0, 'completed': 0, 'failed': 0,
+            'dropped_deadline': 0, 'dropped_cancelled': 0, 'stopped_mid_decode': 0,
+            'wait_count': 0, 'wait_ms_total': 0.0, 'wait_ms_max': 0.0,
+        }
+
+    @staticmethod
+    def parse_priority(value):
+        value = value or 'default'
+        if value not in PRIORITY_CLASSES:
+            raise ValueError(f"priority must be one of: {', '.join(PRIORITY_CLASSES)}")
+        return value
+
+    def submit(self, fn, *args, priority='default', deadline=None, **kwargs):
+        if self.wrap_job is not None:
+            fn = self.wrap_job(fn)
+        job = _Job(fn, args, kwargs, self.parse_priority(priority), deadline)
+        key = (PRIORITY_CLASSES[job.priority], deadline if deadline is not None else float('inf'), next(self._sequence))
+        with self._cond:
+            self._ensure_started()
+            heapq.heappush(self._heap, (key, job))
+            self._stats[job.priority]['queued'] += 1
+            self._stats[job.priority]['submitted'] += 1
+            self._cond.notify()
+        return job.future
+
+    def run(self, fn, *args, priority='default', deadline=None, **kwargs):
+        # Submit and wait; a caller whose deadline passes stops waiting and cancels the queued job
+        return wait_for(self.submit(fn, *args, priority=priority, deadline=deadline, **kwargs), deadline)
+
+    def stopping_criteria(self):
+        # Criteria for the job running on this worker thread (empty when it has no deadline)
+        criteria = getattr(self._local, 'criteria', None)
+        return [criteria] if criteria is not None else []
+
+    def stopped_by_deadline(self):
+        # True once the deadline criteria of the job running on this thread has cut its decoding short
+        criteria = getattr(self._local, 'criteria', None)
+        return criteria is not None and criteria.triggered
+
+    def queue_depth(self):
+        with self._cond:
+            return len(self._heap)
+
+    def stats(self):
+        with self._cond:
+            report = {}
+            for name, stats in self._stats.items():
+                report[name] = {key: value for key, value in stats.items() if not key.startswith('wait_')}
+                report[name]['wait_ms_avg'] = round(stats['wait_ms_total'] / stats['wait_count'], 3) if stats['wait_count'] else 0.0
+                report[name]['wait_ms_max'] = round(stats['wait_ms_max'], 3)
+            return {'workers': self.workers, 'queue_depth': len(self._heap), 'classes': report}
+
+    def _ensure_started(self):
+        # Threads do not survive fork(), so start the workers lazily in each process
+        if self._pid == os.getpid() and all(thread.is_alive() for thread in self._threads):
+            return
+        self._pid = os.getpid()
+        self._threads = [
+            threading.Thread(target=self._worker_loop, name=f'generation-scheduler-{index}', daemon=True)
+            for index in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _next_job(self):
+        with self._cond:
+            while not self._heap:
+                self._cond.wait()
+            _, job = heapq.heappop(self._heap)
+            stats = self._stats[job.priority]
+            stats['queued'] -= 1
+
+            if not job.future.set_running_or_notify_cancel():
+                stats['dropped_cancelled'] += 1
+                return None
+            if job.deadline is not None and time.monotonic() >= job.deadline:
+                stats['dropped_deadline'] += 1
+                job.future.set_exception(DeadlineExceeded('Deadline passed while the request was queued.'))
+                return None
+
+            wait_ms = (time.monotonic() - job.enqueued_at) * 1000
+            stats['wait_count'] += 1
+            stats['wait_ms_total'] += wait_ms
+            stats['wait_ms_max'] = max(stats['wait_ms_max'], wait_ms)
+            return job
+
+    def _worker_loop(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                continue
+
+            criteria = DeadlineStoppingCriteria(job.deadline) if job.deadline is not None else None
+            self._local.criteria = criteria
+            try:
+                result = job.fn(*job.args, **job.kwargs)
+            except Exception as e:
+                logging.error(f"Scheduled {job.priority} job failed: {str(e)}")
+                outcome = 'failed'
+                job.future.set_exception(e)
+            else:
+                outcome = 'completed'
+                job.future.set_result(result)
+            finally:
+                self._local.criteria = None
+
+            with self._cond:
+                self._stats[job.priority][outcome] += 1
+                if criteria is not None and criteria.triggered:
+                    self._stats[job.priority]['stopped_mid_decode'] += 1
+
+
+# Extra time a caller keeps waiting past its deadline, so a job that stopped decoding right at the
+# deadline can still hand back its partial output
+DEADLINE_GRACE_S = 0.5
+
+
+def grace_cutoff(deadline):
+    # Moment to stop waiting for jobs with this deadline. Jobs waited on one after another share it,
+    # so together they get one grace period rather than one each.
+    return None if deadline is None else deadline + DEADLINE_GRACE_S
+
+
+def wait_until(future, cutoff):
+    if cutoff is None:
+        return future.result()
+    try:
+        return future.result(timeout=max(0.0, cutoff - time.monotonic()))
+    except (FutureTimeoutError, CancelledError):
+        future.cancel()
+        raise DeadlineExceeded('Deadline passed before the request finished.')
+
+
+def wait_for(future, deadline):
+    return wait_until(future, None if deadline is None else max(deadline, time.monotonic()) + DEADLINE_GRACE_S)
+
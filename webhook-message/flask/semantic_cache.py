@@ -0,0 +1,102 @@
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+
+class SemanticCache:
+    """Replies for recent prompts, returned for new prompts whose embedding is close enough.
+
+    Embeddings are L2-normalised rows of a fixed-size float32 matrix, so a lookup is one
+    matrix-vector product (cosine similarity) over the rows in the same scope (model and sampling
+    params). When full, the least recently used row is overwritten.
+    """
+
+    def __init__(self, capacity=2048, threshold=0.95, ttl_seconds=600):
+        self.capacity = max(1, int(capacity))
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+
+        self._vectors = None  # (capacity, dim), allocated on the first insert
+        self._scopes = np.full(self.capacity, -1, dtype=np.int64)  # -1 marks an empty row
+        self._stored_at = np.zeros(self.capacity)
+        self._last_used = np.zeros(self.capacity)
+        self._replies = [None] * self.capacity
+        self._scope_ids = {}
+        self._lock = threading.Lock()
+        self._lookup_ms = deque(maxlen=1000)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, scope, vector):
+        # Returns (reply, similarity) for the closest live row in scope at or above the threshold, else None
+        started = time.perf_counter()
+        query = self.normalize(vector)
+        with self._lock:
+            match = None
+            scope_id = self._scope_ids.get(scope)
+            if scope_id is not None and self._vectors is not None:
+                now = time.monotonic()
+                live = (self._scopes == scope_id) & (now - self._stored_at <= self.ttl_seconds)
+                if live.any():
+                    similarities = np.where(live, self._vectors @ query, -np.inf)
+                    row = int(np.argmax(similarities))
+                    if similarities[row] >= self.threshold:
+                        self._last_used[row] = now
+                        match = (self._replies[row], float(similarities[row]))
+            if match is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            self._lookup_ms.append((time.perf_counter() - started) * 1000)
+            return match
+
+    def add(self, scope, vector, reply):
+        vector = self.normalize(vector)
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.capacity, vector.shape[0]), dtype=np.float32)
+            scope_id = self._scope_ids.setdefault(scope, len(self._scope_ids))
+            now = time.monotonic()
+            free = np.flatnonzero((self._scopes == -1) | (now - self._stored_at > self.ttl_seconds))
+            if free.size:
+                row = int(free[0])
+            else:
+                row = int(np.argmin(self._last_used))
+                self.evictions += 1
+            self._vectors[row] = vector
+            self._scopes[row] = scope_id
+            self._stored_at[row] = now
+            self._last_used[row] = now
+            self._replies[row] = reply
+
+    def clear(self):
+        with self._lock:
+            self._scopes[:] = -1
+            self._replies = [None] * self.capacity
+            self._scope_ids.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            latencies = sorted(self._lookup_ms)
+            return {
+                'entries': int((self._scopes != -1).sum()),
+                'capacity': self.capacity,
+                'threshold': self.threshold,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'lookup_ms_avg': round(sum(latencies) / len(latencies), 4) if latencies else 0.0,
+                'lookup_ms_p95': round(latencies[int(0.95 * (len(latencies) - 1))], 4) if latencies else 0.0,
+            }
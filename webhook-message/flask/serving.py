@@ -0,0 +1,71 @@
+import gc
+import logging
+import os
+
+# Fields of /proc/<pid>/smaps_rollup, in kB. Pages still shared with the master after fork show up
+# as Shared_*; pages a worker has written to (or allocated itself) show up as Private_*.
+SMAPS_FIELDS = ('Rss', 'Pss', 'Shared_Clean', 'Shared_Dirty', 'Private_Clean', 'Private_Dirty')
+
+
+def memory_report(pid=None):
+    pid = pid or os.getpid()
+    fields = {}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key in SMAPS_FIELDS:
+                    fields[key] = int(value.split()[0]) * 1024
+    except OSError:
+        return {'pid': pid, 'available': False}
+
+    return {
+        'pid': pid,
+        'available': True,
+        'rss_bytes': fields.get('Rss', 0),
+        'pss_bytes': fields.get('Pss', 0),
+        'shared_bytes': fields.get('Shared_Clean', 0) + fields.get('Shared_Dirty', 0),
+        'unique_bytes': fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0),
+    }
+
+
+def format_memory_report(report):
+    if not report.get('available'):
+        return f"pid {report['pid']}: memory report unavailable (no /proc/<pid>/smaps_rollup)"
+    mb = 1024 * 1024
+    return (
+        f"pid {report['pid']}: rss {report['rss_bytes'] / mb:.1f} MB, "
+        f"unique {report['unique_bytes'] / mb:.1f} MB, shared {report['shared_bytes'] / mb:.1f} MB, "
+        f"pss {report['pss_bytes'] / mb:.1f} MB"
+    )
+
+
+def preload_models(load_model, names, device):
+    # Load weights in the master before workers fork so every worker maps the same pages
+    # copy-on-write. CUDA cannot be initialised before fork, so GPU workers load their own copy.
+    if device.type != 'cpu':
+        logging.info(f"Skipping model preload: device is {device}, each worker will load its own models.")
+        return []
+
+    loaded = []
+    for name in names:
+        model, _ = load_model({'description': {'url': name, 'params': {}}})
+        if model is None:
+            logging.error(f"Preload of model '{name}' failed.")
+            continue
+        loaded.append(name)
+
+    # Move everything allocated so far out of the cyclic GC's reach: collections in the workers would
+    # otherwise write to these objects' headers and un-share their pages.
+    gc.collect()
+    gc.freeze()
+    logging.info(f"Preloaded models before fork: {', '.join(loaded) or 'none'}. {format_memory_report(memory_report())}")
+    return loaded
+
+
+def worker_threads(workers):
+    # Split the machine's cores between workers so they don't oversubscribe each other
+    configured = os.environ.get('TORCH_NUM_THREADS')
+    if configured:
+        return int(configured)
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
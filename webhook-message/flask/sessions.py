@@ -0,0 +1,150 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+
+def _tensor_bytes(value):
+    # Sum the storage of every tensor inside nested tuples/lists (legacy past_key_values) or Cache objects
+    if value is None:
+        return 0
+    if hasattr(value, 'to_legacy_cache'):
+        value = value.to_legacy_cache()
+    if isinstance(value, (tuple, list)):
+        return sum(_tensor_bytes(item) for item in value)
+    if hasattr(value, 'element_size') and hasattr(value, 'numel'):
+        return value.element_size() * value.numel()
+    return 0
+
+
+class ConversationSession:
+    __slots__ = ('key', 'history_ids', 'past_key_values', 'last_used', 'nbytes', 'lock')
+
+    def __init__(self, key):
+        self.key = key
+        self.history_ids = None  # (1, seq_len) token ids of every turn so far
+        self.past_key_values = None  # KV cache covering history_ids[:, :-1]
+        self.last_used = time.monotonic()
+        self.nbytes = 0
+        self.lock = threading.Lock()  # Serializes turns within one conversation
+
+
+class SessionStore:
+    """Conversation sessions keyed by (conversation id, model path), evicted by LRU, TTL and memory cap."""
+
+    def __init__(self, token_budget=512, ttl_seconds=1800, max_bytes=512 * 1024 * 1024, max_sessions=1000):
+        self.token_budget = token_budget
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.max_sessions = max_sessions
+
+        self._sessions = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            self._evict_expired()
+            session = self._sessions.get(key)
+            if session is None:
+                session = ConversationSession(key)
+                self._sessions[key] = session
+            self._sessions.move_to_end(key)
+            session.last_used = time.monotonic()
+            return session
+
+    def update(self, session, history_ids, past_key_values):
+        # Store the turn's result and re-apply the memory cap, never evicting the session just written
+        nbytes = _tensor_bytes(history_ids) + _tensor_bytes(past_key_values)
+        with self._lock:
+            if self._sessions.get(session.key) is session:
+                self._total_bytes -= session.nbytes
+            self._sessions[session.key] = session
+            self._sessions.move_to_end(session.key)
+            session.history_ids = history_ids
+            session.past_key_values = past_key_values
+            session.nbytes = nbytes
+            session.last_used = time.monotonic()
+            self._total_bytes += nbytes
+            self._evict_over_capacity(keep=session.key)
+
+    def drop(self, key):
+        with self._lock:
+            session = self._sessions.pop(key, None)
+            if session is not None:
+                self._total_bytes -= session.nbytes
+            return session is not None
+
+    def drop_conversation(self, conversation_id):
+        # A conversation may have sessions for several models; drop them all
+        with self._lock:
+            keys = [key for key in self._sessions if key[0] == conversation_id]
+            for key in keys:
+                self._total_bytes -= self._sessions.pop(key).nbytes
+            return len(keys)
+
+    def drop_model(self, model_name):
+        # Sessions of a model the registry evicted: their past_key_values are of no use to a reload
+        with self._lock:
+            keys = [key for key in self._sessions if key[1] == model_name]
+            for key in keys:
+                self._total_bytes -= self._sessions.pop(key).nbytes
+            return len(keys)
+
+    def trim(self, history_ids, boundary_token_id, incoming_length):
+        # Drop the oldest turns so history plus the incoming message fits the token budget.
+        # Cuts land just after a turn separator when possible. Returns (history_ids, trimmed).
+        if history_ids is None:
+            return None, False
+        allowed = self.token_budget - incoming_length
+        length = history_ids.shape[-1]
+        if length <= allowed:
+            return history_ids, False
+        if allowed <= 0:
+            return None, True
+
+        start = length - allowed
+        tokens = history_ids[0].tolist()
+        for index in range(start, length):
+            if tokens[index - 1] == boundary_token_id:
+                start = index
+                break
+        return history_ids[:, start:], True
+
+    def stats(self):
+        with self._lock:
+            return {
+                'sessions': len(self._sessions),
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+                'max_sessions': self.max_sessions,
+                'token_budget': self.token_budget,
+                'ttl_seconds': self.ttl_seconds,
+                'evictions': self.evictions,
+            }
+
+    def _evict_expired(self):
+        cutoff = time.monotonic() - self.ttl_seconds
+        while self._sessions:
+            key, session = next(iter(self._sessions.items()))
+            if session.last_used >= cutoff:
+                break
+            self._remove(key, 'expired')
+
+    def _evict_over_capacity(self, keep):
+        self._evict_expired()
+        while self._sessions and (self._total_bytes > self.max_bytes or len(self._sessions) > self.max_sessions):
+            key = next(iter(self._sessions))
+            if key == keep:
+                if len(self._sessions) == 1:
+                    break
+                self._sessions.move_to_end(key)
+                continue
+            self._remove(key, 'over capacity')
+
+    def _remove(self, key, reason):
+        session = self._sessions.pop(key)
+        self._total_bytes -= session.nbytes
+        self.evictions += 1
+        logging.info(f"Evicted conversation session {key[0]!r} ({reason}).")
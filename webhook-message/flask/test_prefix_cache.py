@@ -0,0 +1,100 @@
+import unittest
+
+import torch
+
+from prefix_cache import PrefixCache
+
+
+def fake_kv(tokens, layers=2, heads=2, head_dim=4, extra=0):
+    # Legacy past_key_values whose every position holds its token id, so slices are easy to check
+    length = len(tokens) + extra
+    values = torch.tensor(list(tokens) + [-1] * extra, dtype=torch.float32).view(1, 1, length, 1)
+    layer = values.expand(1, heads, length, head_dim).contiguous()
+    return tuple((layer.clone(), layer.clone() + 0.5) for _ in range(layers))
+
+
+def kv_bytes(tokens, layers=2, heads=2, head_dim=4):
+    return layers * 2 * heads * len(tokens) * head_dim * 4
+
+
+class PrefixCacheTests(unittest.TestCase):
+
+    def test_lookup_leaves_one_token_uncached(self):
+        cache = PrefixCache(min_tokens=2)
+        tokens = [5, 6, 7, 8]
+        cache.insert('m', tokens, fake_kv(tokens))
+        past_key_values, cached = cache.lookup('m', tokens)
+        self.assertEqual(cached, 3)
+        self.assertEqual(past_key_values[0][0].shape[2], 3)
+        self.assertEqual(past_key_values[0][0][0, 0, :, 0].tolist(), [5, 6, 7])
+
+    def test_longest_prefix_wins(self):
+        cache = PrefixCache(min_tokens=2)
+        cache.insert('m', [1, 2, 3], fake_kv([1, 2, 3]))
+        cache.insert('m', [1, 2, 9, 9, 9], fake_kv([1, 2, 9, 9, 9]))
+        cache.insert('m', [1, 2, 3, 4, 5], fake_kv([1, 2, 3, 4, 5]))
+        past_key_values, cached = cache.lookup('m', [1, 2, 3, 4, 7, 8])
+        self.assertEqual(cached, 4)
+        self.assertEqual(past_key_values[0][0][0, 0, :, 0].tolist(), [1, 2, 3, 4])
+        # [1, 2, 3] is a prefix of [1, 2, 3, 4, 5], so storing the longer prompt replaced it
+        self.assertEqual(cache.stats()['entries'], 2)
+
+    def test_short_prompts_and_other_scopes_miss(self):
+        cache = PrefixCache(min_tokens=3)
+        cache.insert('m', [1, 2], fake_kv([1, 2]))
+        cache.insert('m', [1, 2, 3, 4], fake_kv([1, 2, 3, 4]))
+        self.assertEqual(cache.lookup('m', [1, 2, 9])[1], 0)
+        self.assertEqual(cache.lookup('other', [1, 2, 3, 4, 5])[1], 0)
+        self.assertEqual(cache.stats()['entries'], 1)
+
+    def test_eviction_respects_byte_budget(self):
+        prompts = [[index, 1, 2, 3] for index in range(10)]
+        cache = PrefixCache(max_bytes=3 * kv_bytes(prompts[0]), min_tokens=2)
+        for tokens in prompts[:3]:
+            cache.insert('m', tokens, fake_kv(tokens, extra=5))  # Generated positions are not stored
+        self.assertEqual(cache.stats()['bytes'], 3 * kv_bytes(prompts[0]))
+
+        cache.lookup('m', prompts[0] + [9])  # Most recently used now, so prompts[1] goes first
+        for tokens in prompts[3:]:
+            cache.insert('m', tokens, fake_kv(tokens))
+            self.assertLessEqual(cache.stats()['bytes'], cache.max_bytes)
+        stats = cache.stats()
+        self.assertEqual((stats['entries'], stats['evictions']), (3, 7))
+        self.assertEqual(cache.lookup('m', prompts[1] + [9])[1], 0)
+        self.assertEqual(cache.lookup('m', prompts[9] + [9])[1], 4)
+
+    def test_drop_scope(self):
+        cache = PrefixCache(min_tokens=2)
+        cache.insert('a', [1, 2, 3], fake_kv([1, 2, 3]))
+        cache.insert('b', [1, 2, 3], fake_kv([1, 2, 3]))
+        self.assertEqual(cache.drop_scope('a'), 1)
+        self.assertEqual(cache.lookup('a', [1, 2, 3, 4])[1], 0)
+        self.assertEqual(cache.lookup('b', [1, 2, 3, 4])[1], 3)
+        self.assertEqual(cache.stats()['bytes'], kv_bytes([1, 2, 3]))
+
+    def test_entry_survives_generate_extending_it(self):
+        from transformers import GPT2Config, GPT2LMHeadModel
+
+        torch.manual_seed(0)
+        model = GPT2LMHeadModel(GPT2Config(vocab_size=50, n_positions=64, n_embd=32, n_layer=2, n_head=2)).eval()
+        cache = PrefixCache(min_tokens=4)
+        prompt = list(range(1, 9))
+        output = model.generate(torch.tensor([prompt]), max_new_tokens=5, do_sample=False, pad_token_id=0,
+                                return_dict_in_generate=True)
+        cache.insert('m', prompt, output.past_key_values)
+        stored = [tensor.clone() for layer in next(iter(cache._entries)).past_key_values for tensor in layer]
+
+        extended = prompt + [20, 21, 22]
+        past_key_values, cached = cache.lookup('m', extended)
+        self.assertEqual(cached, len(prompt))
+        with_cache = model.generate(torch.tensor([extended]), past_key_values=past_key_values, max_new_tokens=5,
+                                    do_sample=False, pad_token_id=0)
+        without_cache = model.generate(torch.tensor([extended]), max_new_tokens=5, do_sample=False, pad_token_id=0)
+
+        self.assertTrue(torch.equal(with_cache, without_cache))
+        after = [tensor for layer in next(iter(cache._entries)).past_key_values for tensor in layer]
+        self.assertTrue(all(torch.equal(before, now) for before, now in zip(stored, after)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+import threading
+import time
+import unittest
+from concurrent.futures import Future
+
+from scheduler import DEADLINE_GRACE_S, DeadlineExceeded, GenerationScheduler, grace_cutoff, wait_for, wait_until
+
+
+class GenerationSchedulerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = GenerationScheduler(workers=1)
+        self.ran = []
+        self.gate = None
+
+    def tearDown(self):
+        if self.gate is not None:
+            self.gate.set()
+
+    def block_worker(self):
+        # Occupies the single worker until the returned event is set, so later jobs stay queued
+        started, self.gate = threading.Event(), threading.Event()
+        future = self.scheduler.submit(lambda: (started.set(), self.gate.wait()), priority='interactive')
+        self.assertTrue(started.wait(5))
+        return future
+
+    def job(self, name):
+        return lambda: self.ran.append(name) or name
+
+    def test_higher_priority_runs_first(self):
+        blocker = self.block_worker()
+        futures = [
+            self.scheduler.submit(self.job('background'), priority='background'),
+            self.scheduler.submit(self.job('default'), priority='default'),
+            self.scheduler.submit(self.job('interactive'), priority='interactive'),
+        ]
+        self.assertEqual(self.scheduler.queue_depth(), 3)
+        self.gate.set()
+        blocker.result(5)
+        for future in futures:
+            future.result(5)
+        self.assertEqual(self.ran, ['interactive', 'default', 'background'])
+
+    def test_earliest_deadline_first_within_a_class(self):
+        blocker = self.block_worker()
+        now = time.monotonic()
+        futures = [
+            self.scheduler.submit(self.job('none')),
+            self.scheduler.submit(self.job('late'), deadline=now + 60),
+            self.scheduler.submit(self.job('soon'), deadline=now + 30),
+        ]
+        self.gate.set()
+        blocker.result(5)
+        for future in futures:
+            future.result(5)
+        self.assertEqual(self.ran, ['soon', 'late', 'none'])
+
+    def test_expired_queued_job_is_dropped_without_running(self):
+        blocker = self.block_worker()
+        expired = self.scheduler.submit(self.job('expired'), deadline=time.monotonic() + 0.05)
+        time.sleep(0.1)
+        self.gate.set()
+        blocker.result(5)
+        with self.assertRaises(DeadlineExceeded):
+            expired.result(5)
+        self.assertEqual(self.ran, [])
+        stats = self.scheduler.stats()['classes']['default']
+        self.assertEqual((stats['dropped_deadline'], stats['completed'], stats['queued']), (1, 0, 0))
+
+    def test_counters(self):
+        blocker = self.block_worker()
+        cancelled = self.scheduler.submit(self.job('cancelled'), priority='background')
+        self.assertTrue(cancelled.cancel())
+        waited = self.scheduler.submit(self.job('waited'))
+        failing = self.scheduler.submit(lambda: 1 / 0)
+        time.sleep(0.05)
+        self.gate.set()
+        blocker.result(5)
+        self.assertEqual(waited.result(5), 'waited')
+        with self.assertRaises(ZeroDivisionError), self.assertLogs(level='ERROR'):
+            failing.result(5)
+            time.sleep(0.05)  # The failure is logged on the worker thread
+
+        classes = self.scheduler.stats()['classes']
+        self.assertEqual(classes['background']['dropped_cancelled'], 1)
+        default = classes['default']
+        self.assertEqual((default['submitted'], default['completed'], default['failed']), (2, 1, 1))
+        self.assertGreaterEqual(default['wait_ms_max'], 40)
+        self.assertGreater(default['wait_ms_avg'], 0)
+        self.assertEqual(classes['interactive']['completed'], 1)
+
+    def test_running_job_sees_its_deadline_criteria(self):
+        def decode():
+            criteria = self.scheduler.stopping_criteria()
+            stopped_before = self.scheduler.stopped_by_deadline()
+            while not criteria[0].triggered:
+                criteria[0](_Ids(), None)
+            return len(criteria), stopped_before, self.scheduler.stopped_by_deadline()
+
+        self.assertEqual(self.scheduler.run(decode, deadline=time.monotonic() + 0.05), (1, False, True))
+        self.assertEqual(self.scheduler.run(self.scheduler.stopping_criteria), [])
+        self.assertEqual(self.scheduler.stats()['classes']['default']['stopped_mid_decode'], 1)
+
+    def test_unknown_priority(self):
+        with self.assertRaises(ValueError):
+            self.scheduler.submit(self.job('x'), priority='urgent')
+
+
+class _Ids:
+    # Enough of an input_ids tensor for DeadlineStoppingCriteria
+    shape = (1, 1)
+    device = 'cpu'
+
+
+class WaitTests(unittest.TestCase):
+
+    def test_wait_for_returns_result(self):
+        future = Future()
+        future.set_result(7)
+        self.assertEqual(wait_for(future, None), 7)
+        self.assertEqual(wait_for(future, time.monotonic() - 10), 7)
+
+    def test_wait_for_gives_up_after_grace_and_cancels(self):
+        future = Future()
+        started = time.monotonic()
+        with self.assertRaises(DeadlineExceeded):
+            wait_for(future, started + 0.05)
+        self.assertGreaterEqual(time.monotonic() - started, 0.05 + DEADLINE_GRACE_S - 0.01)
+        self.assertTrue(future.cancelled())
+
+    def test_shared_cutoff_bounds_the_total_wait(self):
+        deadline = time.monotonic() + 0.05
+        cutoff = grace_cutoff(deadline)
+        self.assertEqual(cutoff, deadline + DEADLINE_GRACE_S)
+        self.assertIsNone(grace_cutoff(None))
+        futures = [Future() for _ in range(4)]
+        for future in futures:
+            with self.assertRaises(DeadlineExceeded):
+                wait_until(future, cutoff)
+        self.assertLess(time.monotonic() - cutoff, 0.1)
+        self.assertTrue(all(future.cancelled() for future in futures))
+
+
+if __name__ == '__main__':
+    unittest.main()
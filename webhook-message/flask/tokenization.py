@@ -0,0 +1,92 @@
+import logging
+import threading
+from collections import OrderedDict
+
+# Chat-like strings the fast tokenizer must encode and decode exactly like the slow one before it is used
+EQUIVALENCE_SAMPLES = [
+    "gg", "Hello chat, how is everyone?", "  leading and trailing spaces  ", "double  space\tand\ttabs",
+    "line one\nline two", "CAPS LOCK HYPE!!!", "can't won't it's y'all", "numbers 1234567890 and 3.14",
+    "café naïve résumé", "emoji 😂🔥 pog", "日本語のメッセージ", "@streamer check https://example.com/clip?id=42",
+    "!!!???...,,,", "a" * 300,
+]
+
+
+def first_mismatch(slow, fast, samples=EQUIVALENCE_SAMPLES):
+    # First sample whose ids or decoded text differ between the two tokenizers, or None
+    for text in samples:
+        slow_ids, fast_ids = slow.encode(text, truncation=True), fast.encode(text, truncation=True)
+        if slow_ids != fast_ids or slow.decode(slow_ids, skip_special_tokens=True) != fast.decode(fast_ids, skip_special_tokens=True):
+            return text
+    return None
+
+
+def load_tokenizer(path, load_slow, load_fast, prefer_fast=True, check=True):
+    """The Rust-backed tokenizer for ``path`` when one loads and (with ``check``) encodes every
+    equivalence sample exactly like the pure-Python one; the pure-Python tokenizer otherwise."""
+    if not prefer_fast:
+        return load_slow(path)
+    try:
+        fast = load_fast(path)
+    except Exception as e:
+        logging.warning(f"No fast tokenizer for {path}, using the slow one: {str(e)}")
+        return load_slow(path)
+    if not getattr(fast, 'is_fast', False):
+        return fast
+    if check:
+        slow = load_slow(path)
+        mismatch = first_mismatch(slow, fast)
+        if mismatch is not None:
+            logging.warning(f"Fast tokenizer for {path} differs from the slow one on {mismatch[:40]!r}; using the slow one.")
+            return slow
+    logging.info(f"Using fast tokenizer {type(fast).__name__} for {path}.")
+    return fast
+
+
+class TokenMemo:
+    """Bounded LRU of recent encodings, keyed by tokenizer path, encode() options and text.
+
+    Repeated chat lines and template fragments skip tokenization. Texts longer than
+    ``max_text_chars`` are encoded without being stored.
+    """
+
+    def __init__(self, max_entries=4096, max_text_chars=2048):
+        self.max_entries = max(0, int(max_entries))
+        self.max_text_chars = max_text_chars
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def encode(self, tokenizer, text, **kwargs):
+        # Same ids as tokenizer.encode(text, **kwargs), as a new list the caller may modify
+        if not self.max_entries or len(text) > self.max_text_chars:
+            return tokenizer.encode(text, **kwargs)
+        key = (tokenizer.name_or_path, tuple(sorted(kwargs.items())), text)
+        with self._lock:
+            ids = self._entries.get(key)
+            if ids is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return list(ids)
+            self.misses += 1
+        ids = tuple(tokenizer.encode(text, **kwargs))
+        with self._lock:
+            self._entries[key] = ids
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return list(ids)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,131 @@
+# Train the hashed n-gram first stage of the /process sentiment router from DistilBERT's own labels,
+# then report on a held-out split how much traffic it would take and how often it disagrees.
+#
+#   python train_fast_router.py --input chat_messages.txt --output fast_router.npz
+import argparse
+import json
+import math
+import os
+import random
+
+import numpy as np
+import torch
+from transformers import DistilBertForSequenceClassification, DistilBertTokenizer
+
+from fast_router import N_FEATURES, FastRouter, feature_indices
+from inference_profile import configure_threads
+
+THRESHOLDS = (0.6, 0.7, 0.8, 0.85, 0.9, 0.95, 0.98)
+
+
+def read_messages(path):
+    # One chat message per line; duplicates are kept once so frequent spam doesn't dominate
+    seen = set()
+    messages = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            text = line.strip()
+            if text and text not in seen:
+                seen.add(text)
+                messages.append(text)
+    return messages
+
+
+def teacher_labels(path, texts, batch_size):
+    tokenizer = DistilBertTokenizer.from_pretrained(path)
+    model = DistilBertForSequenceClassification.from_pretrained(path).eval()
+    labels = []
+    for start in range(0, len(texts), batch_size):
+        inputs = tokenizer(texts[start:start + batch_size], padding=True, truncation=True, return_tensors='pt')
+        with torch.no_grad():
+            labels += model(**inputs).logits.argmax(dim=-1).tolist()
+    return labels
+
+
+def train(features, labels, n_features, epochs, learning_rate, l2, seed):
+    # Logistic regression with per-feature AdaGrad steps over the sparse hashed rows
+    weights = np.zeros(n_features)
+    squared = np.full(n_features, 1e-8)
+    bias, bias_squared = 0.0, 1e-8
+    order = list(range(len(features)))
+    rng = random.Random(seed)
+    for _ in range(epochs):
+        rng.shuffle(order)
+        for i in order:
+            indices = features[i]
+            logit = max(-30.0, min(30.0, weights[indices].sum() + bias))
+            error = 1.0 / (1.0 + math.exp(-logit)) - labels[i]
+            gradient = error + l2 * weights[indices]
+            np.add.at(squared, indices, gradient * gradient)
+            np.add.at(weights, indices, -learning_rate * gradient / np.sqrt(squared[indices]))
+            bias_squared += error * error
+            bias -= learning_rate * error / math.sqrt(bias_squared)
+    return weights, bias
+
+
+def evaluate(router, texts, labels):
+    # Agreement with DistilBERT overall, and coverage/disagreement of the fast path per threshold
+    results = []
+    for text, label in zip(texts, labels):
+        positive = router.probability(text)
+        predicted = 1 if positive >= 0.5 else 0
+        results.append((predicted, max(positive, 1.0 - positive), label))
+
+    report = {
+        'samples': len(results),
+        'agreement': round(sum(p == l for p, _, l in results) / len(results), 4) if results else 0.0,
+        'thresholds': {},
+    }
+    for threshold in THRESHOLDS:
+        routed = [(p, l) for p, c, l in results if c >= threshold]
+        report['thresholds'][str(threshold)] = {
+            'fast_fraction': round(len(routed) / len(results), 4) if results else 0.0,
+            'disagreement_rate': round(sum(p != l for p, l in routed) / len(routed), 4) if routed else 0.0,
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Train the hashed n-gram fast path of the /process sentiment router.')
+    parser.add_argument('--input', required=True, help='Text file with one chat message per line')
+    parser.add_argument('--output', default='fast_router.npz')
+    parser.add_argument('--model-base-path', default=os.environ.get('MODEL_BASE_PATH', '/app/models'))
+    parser.add_argument('--teacher', default='distilbert-base-uncased-finetuned-sst-2-english')
+    parser.add_argument('--holdout', type=float, default=0.2, help='Fraction of messages kept out of training')
+    parser.add_argument('--epochs', type=int, default=5)
+    parser.add_argument('--learning-rate', type=float, default=0.5)
+    parser.add_argument('--l2', type=float, default=1e-6)
+    parser.add_argument('--n-features', type=int, default=N_FEATURES)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    configure_threads()
+    texts = read_messages(args.input)
+    labels = teacher_labels(os.path.join(args.model_base_path, args.teacher), texts, args.batch_size)
+    print(f"Labelled {len(texts)} message(s) with {args.teacher}: {sum(labels)} positive.")
+
+    pairs = list(zip(texts, labels))
+    random.Random(args.seed).shuffle(pairs)
+    split = int(len(pairs) * (1 - args.holdout))
+    train_pairs, held_out = pairs[:split], pairs[split:]
+
+    features = [feature_indices(text, args.n_features) for text, _ in train_pairs]
+    weights, bias = train(features, [label for _, label in train_pairs], args.n_features, args.epochs, args.learning_rate, args.l2, args.seed)
+    router = FastRouter(weights=weights, bias=bias, n_features=args.n_features)
+
+    held_out_texts = [text for text, _ in held_out]
+    held_out_labels = [label for _, label in held_out]
+    report = {
+        'teacher': args.teacher,
+        'train_samples': len(train_pairs),
+        'held_out': evaluate(router, held_out_texts, held_out_labels),
+        'lexicon_baseline': evaluate(FastRouter(), held_out_texts, held_out_labels),
+    }
+    router.save(args.output, report)
+    print(json.dumps(report, indent=2))
+    print(f"Router written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+import logging
+import os
+import threading
+import time
+
+
+class Warmup:
+    """Loads and exercises a list of models on a background thread so the first real request pays
+    neither the model load nor first-call costs (allocator growth, thread pools, lazy kernels).
+
+    ``load(name)`` brings a model into memory, ``exercise(name)`` runs a small dummy inference on it.
+    start() is idempotent per process: a forked worker runs its own warm-up (with preloaded weights,
+    its loads are registry hits). ready is true once every model has been loaded and exercised here.
+    """
+
+    def __init__(self, names, load, exercise):
+        self.names = list(names)
+        self.load = load
+        self.exercise = exercise
+        self._lock = threading.Lock()
+        self._pid = None
+        self._models = {}
+        self._started_at = None
+        self._finished_at = None
+
+    def start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._models = {name: {'state': 'pending'} for name in self.names}
+            self._started_at = time.perf_counter()
+            self._finished_at = None
+            threading.Thread(target=self._run, name='model-warmup', daemon=True).start()
+
+    def _run(self):
+        for name in self.names:
+            state = self._models[name]
+            try:
+                state['state'] = 'loading'
+                started = time.perf_counter()
+                self.load(name)
+                state['load_ms'] = round((time.perf_counter() - started) * 1000, 1)
+
+                state['state'] = 'warming'
+                started = time.perf_counter()
+                self.exercise(name)
+                state['warm_ms'] = round((time.perf_counter() - started) * 1000, 1)
+                state['state'] = 'ready'
+                logging.info(f"Warmed up '{name}': load {state['load_ms']} ms, first inference {state['warm_ms']} ms.")
+            except Exception as e:
+                state['state'] = 'failed'
+                state['error'] = str(e)
+                logging.error(f"Warm-up of model '{name}' failed: {str(e)}")
+        self._finished_at = time.perf_counter()
+        failed = [name for name, state in self._models.items() if state['state'] == 'failed']
+        logging.info(f"Warm-up finished in {self._finished_at - self._started_at:.2f}s"
+                     + (f", failed: {', '.join(failed)}." if failed else "."))
+
+    @property
+    def ready(self):
+        return self._pid == os.getpid() and all(state['state'] == 'ready' for state in self._models.values())
+
+    def status(self):
+        started = self._pid == os.getpid()
+        finished_at = self._finished_at if started else None
+        return {
+            'ready': self.ready,
+            'started': started,
+            'finished': finished_at is not None,
+            'warmup_s': round(finished_at - self._started_at, 3) if finished_at is not None else None,
+            'models': {name: dict(state) for name, state in self._models.items()} if started else {},
+        }